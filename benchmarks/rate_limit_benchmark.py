@@ -0,0 +1,55 @@
+"""Measure the per-request overhead of rate_limited() on /api/login and /api/register
+
+Runs each view with and without its rate limiter inside a test request context
+and reports the difference. Every iteration uses a new client address so the
+limiter always takes its allow-and-update path.
+
+Usage (from the repository root, with Redis running as configured in main.py):
+    python benchmarks/rate_limit_benchmark.py [--iterations 2000] [--fakeredis]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+ENDPOINTS = [
+    ('/api/login', main.login),
+    ('/api/register', main.register),
+]
+
+def time_view(view, path, iterations, offset):
+    """Median and p99 latency in microseconds of calling view directly"""
+    # An empty body fails validation before any database or bcrypt work
+    samples = []
+    for i in range(iterations):
+        address = f"10.{(offset + i) // 65536 % 256}.{(offset + i) // 256 % 256}.{(offset + i) % 256}"
+        with main.app.test_request_context(path, method='POST', json={}, environ_base={'REMOTE_ADDR': address}):
+            started = time.perf_counter()
+            view()
+            samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--fakeredis', action='store_true', help='use an in-memory fakeredis server')
+    args = parser.parse_args()
+
+    if args.fakeredis:
+        import fakeredis
+        main.redis_client = fakeredis.FakeRedis(decode_responses=True)
+
+    print(f"{'endpoint':<16}{'no limiter':>14}{'limiter':>14}{'overhead':>14}{'p99 limiter':>14}   (microseconds)")
+    for path, view in ENDPOINTS:
+        bare_median, _ = time_view(view.__wrapped__, path, args.iterations, 0)
+        limited_median, limited_p99 = time_view(view, path, args.iterations, args.iterations)
+        print(f"{path:<16}{bare_median:>14.1f}{limited_median:>14.1f}{limited_median - bare_median:>14.1f}{limited_p99:>14.1f}")
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -9,8 +9,21 @@ import csv
 import io
 import os
 import base64
+import threading
+import multiprocessing
+import random
+import math
+import uuid
+import fnmatch
+import re
+import hmac
 import jwt
 import bcrypt
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import wraps
 
@@ -25,8 +38,10 @@ from email.mime.base import MIMEBase
 from email import encoders
 
 # Flask and Extensions
-from flask import Flask, request, jsonify, session
+from flask import Flask, request, jsonify, session, g, has_app_context, make_response
 from flask_cors import CORS
+from jinja2 import TemplateError
+from jinja2.sandbox import SandboxedEnvironment
 
 # Celery for Background Tasks
 from celery import Celery
@@ -73,16 +88,12 @@ JWT_ALGORITHM = 'HS256'
 JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
 JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=7)
 
-#JWT Blacklist for logout functionality
-JWT_BLACKLIST = set()
-
-def add_token_to_blacklist(jti):
-    """Add token JTI to blacklist"""
-    JWT_BLACKLIST.add(jti)
-
-def is_token_blacklisted(jti):
-    """Check if token is blacklisted"""
-    return jti in JWT_BLACKLIST
+#JWT revocation list for logout functionality, shared by all workers through Redis
+JWT_REVOCATION_KEY = 'revoked_tokens'  # sorted set: jti -> token expiry (epoch)
+JWT_REVOCATION_LOCAL_MAX_ENTRIES = 10000
+JWT_REVOCATION_LOCAL_TTL = 60  # seconds a "not revoked" answer is reused locally
+AUTH_TOKEN_CACHE_MAX_ENTRIES = 10000
+AUTH_TOKEN_CACHE_MAX_BYTES = 8 * 1024 * 1024
 
 #CONFIGURATION SETTINGS,  Email Configuration for MailHog
 EMAIL_HOST = 'localhost'
@@ -90,60 +101,125 @@ EMAIL_PORT = 1025
 EMAIL_USERNAME = 'admin@parkmate.com'
 EMAIL_PASSWORD = ''
 EMAIL_FROM = 'admin@parkmate.com'
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'false').lower() == 'true'
+EMAIL_SMTP_TIMEOUT = 10  # seconds per SMTP connection
+EMAIL_SMTP_POOL_SIZE = 4  # idle sessions kept per process
+EMAIL_SMTP_IDLE_TIMEOUT = 60  # servers drop idle sessions; don't reuse older ones
+EMAIL_SMTP_MAX_MESSAGES = 100  # messages per session before reconnecting
+EMAIL_STATS_KEY = 'email_stats'
+
+# Email Outbox Configuration
+# Handlers and tasks queue mail in email_outbox; deliver_outbox_emails sends it
+EMAIL_SENDER_WORKERS = int(os.environ.get('EMAIL_SENDER_WORKERS', 4))
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_BATCHES = 20  # per task run, the beat schedule picks up the rest
+EMAIL_MAX_ATTEMPTS = 6  # then the email is marked 'dead'
+EMAIL_RETRY_BASE_DELAY = 30  # seconds, doubled after every failed attempt
+EMAIL_RETRY_MAX_DELAY = 3600
+EMAIL_SENDING_TIMEOUT = 300  # reclaim emails left 'sending' by a crashed worker
+
+# Notification Template Configuration
+# Built-in email copy lives in templates/email/<name>.html; rows in
+# notification_templates override the subject and, optionally, the body
+NOTIFICATION_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')
+NOTIFICATION_TEMPLATE_RELOAD_INTERVAL = 30  # seconds between checks for edited templates
+
+# Batch Job Configuration
+NEW_LOT_NOTIFICATION_PAGE_SIZE = 1000  # users read per keyset page
+NEW_LOT_NOTIFICATION_CHUNK_SIZE = 200  # recipients per chunk task
+DAILY_REMINDER_PAGE_SIZE = 1000
+DAILY_REMINDER_CHUNK_SIZE = 500
+DAILY_REMINDER_DEFAULT_TIME = '18:00'  # when user_preferences has no reminder_time
+DAILY_REMINDER_INACTIVE_DAYS = 7  # no booking for this long gets the "book again" reminder
+MONTHLY_REPORT_PAGE_SIZE = 1000
+MONTHLY_REPORT_CHUNK_SIZE = 200  # users per shard task
+MONTHLY_REPORT_CHECKPOINT_SIZE = 50  # reports queued per checkpointed transaction
+MONTHLY_REPORT_STALE_AFTER = 600  # seconds without progress before a running job is resumed
+
+# Parking Reminder Configuration
+PARKING_REMINDER_DELAY_MINUTES = 30  # remind once a booking has waited this long unparked
+PARKING_REMINDER_WINDOW_HOURS = 2  # older bookings are left to expiry cleanup
+PARKING_REMINDER_BATCH_SIZE = 500  # per run, the beat schedule picks up the rest
 
 # Google Chat Webhook Configuration
 GOOGLE_CHAT_WEBHOOK = os.environ.get('GOOGLE_CHAT_WEBHOOK')
 
+# Database Configuration
+DATABASE_PATH = 'parking_lot.db'
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_CACHE_SIZE_KB = 20000  # page cache per connection
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+DB_POOL_SIZE_PER_THREAD = 2
+
+# Free Spot Index Configuration
+FREE_SPOT_KEY_PREFIX = 'free_spots'
+FREE_SPOT_SYNCED_KEY = 'free_spots:synced'
+
+# Reservation Allocation Configuration
+# 'sqlite' - reservations are checked and written inside one BEGIN IMMEDIATE
+# 'redis'  - spots are claimed atomically in Redis and written behind to SQLite
+RESERVATION_ALLOCATION_MODE = os.environ.get('RESERVATION_ALLOCATION_MODE', 'sqlite')
+ACTIVE_RESERVATION_KEY_PREFIX = 'active_reservation'
+ACTIVE_RESERVATION_KEY_TTL = 86400
+RESERVATION_CLAIMS_KEY = 'reservation_claims'
+RESERVATION_CLAIM_QUEUE_KEY = 'reservation_claims:queue'
+RESERVATION_CLAIM_DRAIN_LOCK_KEY = 'reservation_claims:drain_lock'
+RESERVATION_CLAIM_BATCH_SIZE = 200
+RESERVATION_CLAIM_FAILED_KEY_PREFIX = 'reservation_claims:failed'
+RESERVATION_CLAIM_FAILED_TTL = 86400  # how long my-reservations reports a rejected claim
+RESERVATION_EXPIRY_HOURS = 24  # bookings never parked within this long are expired
+RESERVATION_EXPIRY_BATCH_SIZE = 500  # per cleanup run, the beat schedule picks up the rest
+
+# Payment Gateway Configuration
+PAYMENT_GATEWAY = os.environ.get('PAYMENT_GATEWAY', 'simulator')
+PAYMENT_SIMULATOR_DELAY = 1.0  # seconds
+PAYMENT_SIMULATOR_SUCCESS_RATE = 0.95
+PAYMENT_PENDING_TIMEOUT_MINUTES = 5
+
+# Graph Rendering Configuration
+GRAPH_RENDER_WORKERS = int(os.environ.get('GRAPH_RENDER_WORKERS', 2))
+GRAPH_RENDER_QUEUE_LIMIT = GRAPH_RENDER_WORKERS * 4  # running + queued before answering 503
+GRAPH_RENDER_TIMEOUT = 30  # seconds
+GRAPH_CACHE_KEY_PREFIX = 'graph'
+GRAPH_CACHE_TTL = 3600
+GRAPH_RENDER_VERSION = 'v1'  # bump when the figures change so cached images are redrawn
+
 # Cache Configuration
 CACHE_TIMEOUT = 300 
 ANALYTICS_CACHE_TIMEOUT = 900
+ADMIN_ANALYTICS_CACHE_TIMEOUT = 30  # admin summary; also dropped by any booking through its lot tags
+CACHE_KEY_NAMESPACE = 'cache'
+CACHE_KEY_VERSION = os.environ.get('CACHE_KEY_VERSION', 'v2')  # bump when cached payloads change shape
+CACHE_STATS_KEY = 'cache_stats'  # outside the cache namespace so clearing keeps it
+CACHE_GENERATION_KEY = 'cache_generation'  # invalidation counter, also outside the namespace
+# Stampede protection: soft TTL = timeout, hard TTL = timeout + CACHE_STALE_TTL
+CACHE_STALE_TTL = 120
+CACHE_LOCK_TTL = 30  # seconds a recomputation may hold the single-flight lock
+CACHE_LOCK_WAIT = 2.0  # seconds a cold-miss caller waits for another worker's result
+CACHE_LOCK_POLL_INTERVAL = 0.05
+CACHE_EARLY_REFRESH_BETA = 1.0
+CACHE_TAG_TTL = max(CACHE_TIMEOUT, ANALYTICS_CACHE_TIMEOUT) + CACHE_STALE_TTL + 60
+# Every cached entry carries one of these broad tags, plus lot:{id} / user:{id}
+# tags for the rows it was built from so bookings only drop what they touch
+CACHE_TAGS = ['parking_lots', 'users', 'analytics']
+# In-process L1 in front of Redis, kept coherent through pub/sub invalidations
+CACHE_L1_ENABLED = os.environ.get('CACHE_L1_ENABLED', 'true').lower() == 'true'
+CACHE_L1_MAX_ENTRIES = 1024
+CACHE_L1_MAX_BYTES = 32 * 1024 * 1024
+CACHE_L1_TTL = 30  # seconds; also bounds staleness if an invalidation is missed
+CACHE_INVALIDATION_CHANNEL = 'cache_invalidations'
+CACHE_STATS_FLUSH_INTERVAL = 10  # seconds between flushes of local hit/miss counters
+
+# Password Hashing Configuration
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+PASSWORD_HASH_QUEUE_LIMIT = PASSWORD_HASH_WORKERS * 4  # running + queued before answering 503
+PASSWORD_HASH_TIMEOUT = 10  # seconds
 
 #Rate Limiting Configuration
 LOGIN_RATE_LIMIT = 5  # Max 5 attempts per minute
 REGISTER_RATE_LIMIT = 3  # Max 3 registrations per minute
-
-def rate_limit_key(endpoint, identifier):
-    """Generate rate limit key"""
-    return f"rate_limit:{endpoint}:{identifier}"
-
-def check_rate_limit(endpoint, identifier, limit_per_minute):
-    """Check if request is within rate limit"""
-    try:
-        key = rate_limit_key(endpoint, identifier)
-        current_count = redis_client.get(key)
-        
-        if current_count is None:
-
-            redis_client.setex(key, 60, 1) 
-            return True
-        
-        if int(current_count) >= limit_per_minute:
-            return False
-        
-        redis_client.incr(key)
-        return True
-        
-    except redis.RedisError as e:
-        logger.warning(f"Rate limiting error: {e}")
-        return True 
-
-def rate_limited(limit_per_minute):
-    """Decorator for rate limiting endpoints"""
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            identifier = request.remote_addr or 'unknown'
-            endpoint = f.__name__
-            
-            if not check_rate_limit(endpoint, identifier, limit_per_minute):
-                return jsonify({
-                    'error': 'Rate limit exceeded. Please try again later.',
-                    'retry_after': 60
-                }), 429
-            
-            return f(*args, **kwargs)
-        return decorated_function
-    return decorator
+RATE_LIMIT_LOCAL_MAX_KEYS = 10000  # fallback limiter state while Redis is down
 
 # REDIS CONFIGURATION
 redis_client = redis.Redis(
@@ -173,6 +249,14 @@ def make_celery(app):
             'task': 'main.generate_daily_report',
             'schedule': 20.0,  
         },
+        'persist-reservation-claims': {
+            'task': 'main.persist_reservation_claims',
+            'schedule': 5.0,
+        },
+        'deliver-outbox-emails': {
+            'task': 'main.deliver_outbox_emails',
+            'schedule': 10.0,
+        },
         'optimize-parking-allocation': {
             'task': 'main.optimize_parking_allocation',
             'schedule': 20.0,  
@@ -187,7 +271,8 @@ def make_celery(app):
         },
         'daily-mail-reminder': {
             'task': 'main.send_daily_reminders',
-            'schedule': crontab(minute=0, hour=18)  
+            # Users pick their own reminder_time, so look for due reminders all day
+            'schedule': crontab(minute='*/15')  
         },
         'monthly-mail-report-test': {
             'task': 'main.generate_monthly_activity_report',
@@ -216,71 +301,597 @@ def cache_key(*args):
     """Generate cache key from arguments"""
     return ':'.join(str(arg) for arg in args)
 
-def cached(timeout=CACHE_TIMEOUT, key_prefix=''):
-    """Decorator for caching function results"""
+def function_cache_key(key_prefix, func_name, args, kwargs):
+    """Build a cache key that is identical in every worker process
+
+    Arguments are serialized canonically and digested, unlike hash() which
+    is salted per interpreter.
+    """
+    payload = json.dumps([args, kwargs], sort_keys=True, separators=(',', ':'), default=str)
+    digest = hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+    return f"{CACHE_KEY_NAMESPACE}:{key_prefix}:{func_name}:{CACHE_KEY_VERSION}:{digest}"
+
+_cache_stats_lock = threading.Lock()
+_cache_stats_pending = {}
+_cache_stats_flushed_at = time.monotonic()
+
+def cache_stats_bucket(key_prefix, func_name):
+    """Stats are grouped by top-level prefix so per-user prefixes share a bucket"""
+    return f"{key_prefix.split(':')[0]}:{func_name}"
+
+def flush_cache_stats():
+    """Push this process's hit/miss counters to Redis"""
+    global _cache_stats_pending, _cache_stats_flushed_at
+    with _cache_stats_lock:
+        pending = _cache_stats_pending
+        _cache_stats_pending = {}
+        _cache_stats_flushed_at = time.monotonic()
+    if not pending:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for field, count in pending.items():
+            pipe.hincrby(CACHE_STATS_KEY, field, count)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Cache stats flush error: {e}")
+
+def record_cache_event(bucket, event):
+    """Count a cache hit or miss; flushed to Redis in batches"""
+    field = f"{bucket}:{event}"
+    with _cache_stats_lock:
+        _cache_stats_pending[field] = _cache_stats_pending.get(field, 0) + 1
+        due = time.monotonic() - _cache_stats_flushed_at >= CACHE_STATS_FLUSH_INTERVAL
+    if due:
+        flush_cache_stats()
+
+def get_cache_stats():
+    """Per-prefix hit/miss counts across all processes"""
+    flush_cache_stats()
+    stats = {}
+    for field, count in redis_client.hgetall(CACHE_STATS_KEY).items():
+        bucket, event = field.rsplit(':', 1)
+        stats.setdefault(bucket, {'l1_hits': 0, 'hits': 0, 'stale_hits': 0, 'misses': 0})[event] = int(count)
+    for bucket_stats in stats.values():
+        served = bucket_stats['l1_hits'] + bucket_stats['hits'] + bucket_stats['stale_hits']
+        bucket_stats['hit_rate'] = round(served / max(1, served + bucket_stats['misses']) * 100, 2)
+    return stats
+
+def cache_tag_key(tag):
+    """Redis set holding the cache keys registered under a tag"""
+    return f"{CACHE_KEY_NAMESPACE}:tag:{tag}"
+
+def cache_tag_generation_key(tag):
+    """Value of the invalidation counter when the tag was last invalidated"""
+    return f"{CACHE_GENERATION_KEY}:{tag}"
+
+def lot_cache_tags(lots):
+    """Tags for a cached list of lots: lot CRUD plus every lot it contains"""
+    return ('parking_lots', *(f"lot:{lot['id']}" for lot in lots))
+
+def user_cache_tags(users):
+    """Tags for a cached list of users: registrations plus every user it contains"""
+    return ('users', *(f"user:{user['id']}" for user in users))
+
+def cache_tag_keys(tags):
+    """KEYS for the tag scripts: each tag set followed by its generation key"""
+    keys = []
+    for tag in tags:
+        keys += [cache_tag_key(tag), cache_tag_generation_key(tag)]
+    return keys
+
+class LocalLRUCache:
+    """Thread-safe LRU bounded by entry count and payload bytes, with per-entry TTL"""
+    
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, size, expires_at, tags)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        """Return (found, value)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[2] <= time.monotonic():
+                self._remove(key)
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[0]
+    
+    def set(self, key, value, size, ttl, tags=()):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self._store(key, value, size, ttl, tags)
+    
+    def add(self, key, value, size, ttl, tags=()):
+        """Store only if the key has no live entry; returns True when stored"""
+        if size > self.max_bytes:
+            return False
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] > time.monotonic():
+                return False
+            self._store(key, value, size, ttl, tags)
+            return True
+    
+    def _store(self, key, value, size, ttl, tags):
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (value, size, time.monotonic() + ttl, frozenset(tags))
+        self.total_bytes += size
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+    
+    def invalidate_tags(self, tags):
+        tags = set(tags)
+        with self.lock:
+            for key in [k for k, entry in self.entries.items() if entry[3] & tags]:
+                self._remove(key)
+    
+    def invalidate_pattern(self, pattern):
+        with self.lock:
+            for key in [k for k in self.entries if fnmatch.fnmatchcase(k, pattern)]:
+                self._remove(key)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+    
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry[1]
+
+l1_cache = LocalLRUCache(CACHE_L1_MAX_ENTRIES, CACHE_L1_MAX_BYTES)
+# Local caches that are only trusted while the invalidation listener is subscribed
+LISTENER_BACKED_CACHES = [l1_cache]
+_l1_listener = {'pid': None, 'subscribed': False}
+_l1_listener_lock = threading.Lock()
+
+def apply_cache_invalidation(message):
+    """Apply an invalidation message to this process's L1"""
+    if message.get('tags'):
+        l1_cache.invalidate_tags(message['tags'])
+    if message.get('pattern'):
+        l1_cache.invalidate_pattern(message['pattern'])
+    if message.get('revoked_jti'):
+        remember_revoked_token(message['revoked_jti'], message['exp'])
+
+def publish_cache_invalidation(**message):
+    """Apply an invalidation locally and tell the other processes to do the same"""
+    apply_cache_invalidation(message)
+    try:
+        redis_client.publish(CACHE_INVALIDATION_CHANNEL, json.dumps(message))
+    except redis.RedisError as e:
+        logger.warning(f"Cache invalidation publish error: {e}")
+
+def _listen_for_cache_invalidations():
+    """Subscriber thread; L1 is only served while the subscription is live"""
+    while True:
+        pubsub = None
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            # Anything published before the subscription was missed
+            clear_listener_backed_caches()
+            _l1_listener['subscribed'] = True
+            for message in pubsub.listen():
+                if message.get('type') == 'message':
+                    apply_cache_invalidation(json.loads(message['data']))
+        except Exception as e:
+            logger.warning(f"Cache invalidation listener error: {e}")
+        finally:
+            _l1_listener['subscribed'] = False
+            clear_listener_backed_caches()
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+        time.sleep(1)
+
+def clear_listener_backed_caches():
+    for local_cache in LISTENER_BACKED_CACHES:
+        local_cache.clear()
+
+def l1_cache_ready():
+    """True when the L1 may serve"""
+    return CACHE_L1_ENABLED and invalidation_listener_ready()
+
+def invalidation_listener_ready():
+    """Start the invalidation listener once per process; True while it is subscribed"""
+    if _l1_listener['pid'] != os.getpid():
+        with _l1_listener_lock:
+            if _l1_listener['pid'] != os.getpid():
+                # Forked workers inherit entries but not the listener thread
+                clear_listener_backed_caches()
+                _l1_listener['pid'] = os.getpid()
+                _l1_listener['subscribed'] = False
+                threading.Thread(
+                    target=_listen_for_cache_invalidations,
+                    name='cache-invalidation-listener',
+                    daemon=True
+                ).start()
+    return _l1_listener['subscribed']
+
+RELEASE_LOCK_SCRIPT = redis_client.register_script("""
+-- KEYS: lock key; ARGV: owner token
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+def acquire_cache_lock(cache_key_name):
+    """Single-flight lock for recomputing one entry; returns (acquired, token)"""
+    token = uuid.uuid4().hex
+    try:
+        if redis_client.set(f"{cache_key_name}:lock", token, nx=True, ex=CACHE_LOCK_TTL):
+            return True, token
+        return False, None
+    except redis.RedisError as e:
+        # Without Redis there is nothing to coordinate on
+        logger.warning(f"Cache lock error: {e}")
+        return True, None
+
+def release_cache_lock(cache_key_name, token):
+    if not token:
+        return
+    try:
+        RELEASE_LOCK_SCRIPT(keys=[f"{cache_key_name}:lock"], args=[token], client=redis_client)
+    except redis.RedisError as e:
+        logger.warning(f"Cache lock release error: {e}")
+
+def wait_for_cache_fill(cache_key_name):
+    """Poll briefly for the entry another worker is computing"""
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(CACHE_LOCK_POLL_INTERVAL)
+        try:
+            raw = redis_client.get(cache_key_name)
+        except redis.RedisError:
+            return None
+        if raw:
+            return raw
+    return None
+
+def cache_entry_needs_refresh(entry, timeout):
+    """True once past the soft TTL, or early with rising probability (XFetch)"""
+    age = time.time() - entry['t']
+    if age >= timeout:
+        return True
+    # Expensive entries (large compute time) start refreshing earlier
+    return age - entry['d'] * CACHE_EARLY_REFRESH_BETA * math.log(1.0 - random.random()) >= timeout
+
+STORE_CACHE_ENTRY_SCRIPT = redis_client.register_script("""
+-- KEYS[1]: entry; then each tag set followed by its generation key
+-- ARGV: payload, entry ttl, tag set ttl, invalidation counter read before computing
+-- Writes nothing when a tag was invalidated while the value was being computed
+local started = tonumber(ARGV[4])
+for i = 2, #KEYS, 2 do
+    if tonumber(redis.call('GET', KEYS[i + 1]) or '0') > started then
+        return 0
+    end
+end
+redis.call('SETEX', KEYS[1], ARGV[2], ARGV[1])
+for i = 2, #KEYS, 2 do
+    redis.call('SADD', KEYS[i], KEYS[1])
+    redis.call('EXPIRE', KEYS[i], ARGV[3])
+end
+return 1
+""")
+
+def cached(timeout=CACHE_TIMEOUT, key_prefix='', tags=()):
+    """Decorator for caching function results, registered under invalidation tags
+
+    timeout is the soft TTL. Entries are kept CACHE_STALE_TTL longer and served
+    stale while a single worker, holding a Redis lock, recomputes them.
+    Results may be served from the in-process L1 and must be treated as read-only.
+    tags may be a callable that derives the tags from the result.
+    """
+    def entry_tags(value):
+        return tuple(tags(value)) if callable(tags) else tags
+    
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            cache_key_name = f"{key_prefix}:{f.__name__}:{hash(str(args) + str(sorted(kwargs.items())))}"
+            cache_key_name = function_cache_key(key_prefix, f.__name__, args, kwargs)
+            stats_bucket = cache_stats_bucket(key_prefix, f.__name__)
+            use_l1 = l1_cache_ready()
             
+            if use_l1:
+                found, value = l1_cache.get(cache_key_name)
+                if found:
+                    record_cache_event(stats_bucket, 'l1_hits')
+                    return value
+            
+            raw = None
             try:
-                cached_result = redis_client.get(cache_key_name)
-                if cached_result:
-                    logger.info(f"Cache hit for {cache_key_name}")
-                    return json.loads(cached_result)
+                raw = redis_client.get(cache_key_name)
             except redis.RedisError as e:
                 logger.warning(f"Redis cache read error: {e}")
             
-            result = f(*args, **kwargs)
-            
+            if raw:
+                entry = json.loads(raw)
+                if not cache_entry_needs_refresh(entry, timeout):
+                    logger.info(f"Cache hit for {cache_key_name}")
+                    record_cache_event(stats_bucket, 'hits')
+                    if use_l1:
+                        remaining = timeout - (time.time() - entry['t'])
+                        l1_cache.set(cache_key_name, entry['v'], len(raw), min(remaining, CACHE_L1_TTL), entry_tags(entry['v']))
+                    return entry['v']
+                
+                acquired, lock_token = acquire_cache_lock(cache_key_name)
+                if not acquired:
+                    # Someone else is refreshing; the stale value is good enough
+                    record_cache_event(stats_bucket, 'stale_hits')
+                    return entry['v']
+            else:
+                acquired, lock_token = acquire_cache_lock(cache_key_name)
+                if not acquired:
+                    raw = wait_for_cache_fill(cache_key_name)
+                    if raw:
+                        record_cache_event(stats_bucket, 'hits')
+                        return json.loads(raw)['v']
+            
+            record_cache_event(stats_bucket, 'misses')
             try:
-                redis_client.setex(cache_key_name, timeout, json.dumps(result, default=str))
-                logger.info(f"Cached result for {cache_key_name}")
-            except redis.RedisError as e:
-                logger.warning(f"Redis cache write error: {e}")
+                try:
+                    generation = int(redis_client.get(CACHE_GENERATION_KEY) or 0)
+                except redis.RedisError:
+                    generation = 0
+                started = time.monotonic()
+                result = f(*args, **kwargs)
+                payload = json.dumps({
+                    'v': result,
+                    't': time.time(),
+                    'd': time.monotonic() - started
+                }, default=str)
+                result_tags = entry_tags(result)
+                
+                try:
+                    stored = STORE_CACHE_ENTRY_SCRIPT(
+                        keys=[cache_key_name, *cache_tag_keys(result_tags)],
+                        args=[payload, timeout + CACHE_STALE_TTL, CACHE_TAG_TTL, generation],
+                        client=redis_client
+                    )
+                    if not stored:
+                        # Invalidated mid-computation; the result may predate the write
+                        logger.info(f"Skipped caching {cache_key_name}, invalidated while computing")
+                    else:
+                        logger.info(f"Cached result for {cache_key_name}")
+                        if use_l1:
+                            # Store what other processes will read back from Redis
+                            l1_cache.set(cache_key_name, json.loads(payload)['v'], len(payload), min(timeout, CACHE_L1_TTL), result_tags)
+                except redis.RedisError as e:
+                    logger.warning(f"Redis cache write error: {e}")
+            finally:
+                release_cache_lock(cache_key_name, lock_token)
             
             return result
         return decorated_function
     return decorator
 
+INVALIDATE_TAGS_SCRIPT = redis_client.register_script("""
+-- KEYS[1]: invalidation counter; then each tag set followed by its generation key
+-- ARGV: generation key ttl
+-- Deletes every member key and the set, and stamps the tag with a new counter
+-- value so computations that started earlier do not store their result
+local generation = redis.call('INCR', KEYS[1])
+local total = 0
+for t = 2, #KEYS, 2 do
+    local members = redis.call('SMEMBERS', KEYS[t])
+    for i = 1, #members, 500 do
+        redis.call('DEL', unpack(members, i, math.min(i + 499, #members)))
+    end
+    total = total + #members
+    redis.call('DEL', KEYS[t])
+    redis.call('SET', KEYS[t + 1], generation, 'EX', ARGV[1])
+end
+return total
+""")
+
+# Both invalidations delete from Redis before they broadcast: a process that
+# dropped its L1 entry earlier could read the old value back from Redis and
+# keep it in L1 for CACHE_L1_TTL.
+def invalidate_cache_tags(*tags):
+    """Drop every cache entry registered under the given tags"""
+    try:
+        cleared = INVALIDATE_TAGS_SCRIPT(
+            keys=[CACHE_GENERATION_KEY, *cache_tag_keys(tags)],
+            args=[CACHE_TAG_TTL],
+            client=redis_client
+        )
+        if cleared:
+            logger.info(f"Invalidated {cleared} cache keys tagged {', '.join(tags)}")
+    except redis.RedisError as e:
+        logger.warning(f"Cache invalidation error: {e}")
+        cleared = 0
+    publish_cache_invalidation(tags=list(tags))
+    return cleared
+
 def invalidate_cache_pattern(pattern):
-    """Invalidate cache keys matching pattern"""
+    """Invalidate cache keys matching pattern (incremental SCAN, admin use only)"""
+    cleared = 0
     try:
-        keys = redis_client.keys(pattern)
-        if keys:
-            redis_client.delete(*keys)
-            logger.info(f"Invalidated {len(keys)} cache keys matching {pattern}")
+        batch = []
+        for key in redis_client.scan_iter(match=pattern, count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                cleared += redis_client.delete(*batch)
+                batch = []
+        if batch:
+            cleared += redis_client.delete(*batch)
+        if cleared:
+            logger.info(f"Invalidated {cleared} cache keys matching {pattern}")
     except redis.RedisError as e:
         logger.warning(f"Cache invalidation error: {e}")
+    publish_cache_invalidation(pattern=pattern)
+    return cleared
 
 def robust_cache_invalidation():
-    """More comprehensive cache invalidation"""
+    """Invalidate every tagged cache entry"""
+    total_cleared = invalidate_cache_tags(*CACHE_TAGS)
+    logger.info(f"Total cache keys cleared: {total_cleared}")
+    return total_cleared
+
+# RATE LIMITING
+# GCRA (generic cell rate algorithm): each key stores the theoretical arrival
+# time (TAT) of the next request. A policy of `limit` requests per `period`
+# with `burst` allows `burst` requests at once and then one every
+# period/limit seconds. Check and update happen in one Lua call using the
+# Redis clock, so concurrent workers cannot race past the limit.
+RATE_LIMIT_SCRIPT = redis_client.register_script("""
+-- KEYS: limiter key; ARGV: emission interval (ms), burst tolerance (ms)
+-- returns {allowed, retry_after_ms, remaining}
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local new_tat = tat + interval
+local allow_at = new_tat - tolerance
+if now < allow_at then
+    return {0, allow_at - now, 0}
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', new_tat - now)
+return {1, 0, math.floor((now - allow_at) / interval)}
+""")
+
+_local_rate_limits = LocalLRUCache(RATE_LIMIT_LOCAL_MAX_KEYS, RATE_LIMIT_LOCAL_MAX_KEYS)
+_local_rate_limits_lock = threading.Lock()
+
+def rate_limit_key(endpoint, identifier):
+    """Generate rate limit key"""
+    return f"rate_limit:{endpoint}:{identifier}"
+
+def _check_rate_limit_locally(key, interval_ms, tolerance_ms):
+    """Per-process GCRA used while Redis is unavailable"""
+    now = time.time() * 1000
+    with _local_rate_limits_lock:
+        found, tat = _local_rate_limits.get(key)
+        tat = max(tat if found else now, now)
+        new_tat = tat + interval_ms
+        allow_at = new_tat - tolerance_ms
+        if now < allow_at:
+            return False, allow_at - now, 0
+        _local_rate_limits.set(key, new_tat, 1, (new_tat - now) / 1000)
+        return True, 0, int((now - allow_at) // interval_ms)
+
+def check_rate_limit(endpoint, identifier, limit, period=60, burst=None):
+    """Check if request is within rate limit; returns (allowed, retry_after_seconds, remaining)"""
+    key = rate_limit_key(endpoint, identifier)
+    interval_ms = max(1, round(period * 1000 / limit))
+    tolerance_ms = interval_ms * (burst or limit)
     try:
-        patterns_to_clear = [
-            '*parking_lots*',
-            '*user*',
-            '*admin*',
-            '*analytics*',
-            '*reservations*'
-        ]       
-        total_cleared = 0
-        for pattern in patterns_to_clear:
-            keys = redis_client.keys(pattern)
-            if keys:
-                redis_client.delete(*keys)
-                total_cleared += len(keys)
-                logger.info(f"Cleared {len(keys)} keys matching {pattern}")
-        
-        logger.info(f"Total cache keys cleared: {total_cleared}")
-        return total_cleared
+        allowed, retry_after_ms, remaining = RATE_LIMIT_SCRIPT(
+            keys=[key], args=[interval_ms, tolerance_ms], client=redis_client
+        )
     except redis.RedisError as e:
-        logger.warning(f"Cache invalidation error: {e}")
-        return 0
+        logger.warning(f"Rate limiting error, using local limiter: {e}")
+        allowed, retry_after_ms, remaining = _check_rate_limit_locally(key, interval_ms, tolerance_ms)
+    return bool(allowed), math.ceil(retry_after_ms / 1000), int(remaining)
+
+def rate_limit_identifier(scope):
+    """Who a limit applies to: the client IP, or the authenticated user when scope is 'user'"""
+    if scope == 'user':
+        user_data, _ = authenticate_request()
+        if user_data:
+            return f"user:{user_data['user_id']}"
+    return f"ip:{request.remote_addr or 'unknown'}"
+
+def rate_limited(limit_per_minute, period=60, burst=None, scope='ip'):
+    """Decorator for rate limiting endpoints
+
+    Allows limit_per_minute requests per period seconds (bursts of up to
+    burst, default limit_per_minute), counted per client IP or per user.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            identifier = rate_limit_identifier(scope)
+            endpoint = f.__name__
+            
+            allowed, retry_after, remaining = check_rate_limit(endpoint, identifier, limit_per_minute, period, burst)
+            if not allowed:
+                response = jsonify({
+                    'error': 'Rate limit exceeded. Please try again later.',
+                    'retry_after': retry_after
+                })
+                response.headers['Retry-After'] = str(retry_after)
+                return response, 429
+            
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+# JWT REVOCATION
+# Revoked token ids live in one Redis sorted set scored by token expiry, so
+# entries are trimmed once the token could no longer be used anyway. Each
+# process keeps an LRU in front of it: revocations are final and cached
+# until expiry, "not revoked" answers are reused for a short time and only
+# while revocations broadcast over pub/sub are being received.
+token_revocation_cache = LocalLRUCache(JWT_REVOCATION_LOCAL_MAX_ENTRIES, JWT_REVOCATION_LOCAL_MAX_ENTRIES)
+LISTENER_BACKED_CACHES.append(token_revocation_cache)
+
+def remember_revoked_token(jti, expires_at):
+    """Record a revocation in this process's front cache"""
+    token_revocation_cache.set(jti, True, 1, max(1, expires_at - time.time()))
+
+def add_token_to_blacklist(jti, expires_at=None):
+    """Revoke a token until it expires"""
+    if expires_at is None:
+        expires_at = time.time() + JWT_REFRESH_TOKEN_EXPIRES.total_seconds()
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zadd(JWT_REVOCATION_KEY, {jti: expires_at})
+        pipe.zremrangebyscore(JWT_REVOCATION_KEY, '-inf', time.time())
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Token revocation store error: {e}")
+    publish_cache_invalidation(revoked_jti=jti, exp=expires_at)
+
+def is_token_blacklisted(jti):
+    """Check if token is revoked"""
+    use_local = invalidation_listener_ready()
+    found, revoked = token_revocation_cache.get(jti)
+    if found and (revoked or use_local):
+        return revoked
+    
+    try:
+        expires_at = redis_client.zscore(JWT_REVOCATION_KEY, jti)
+    except redis.RedisError as e:
+        logger.warning(f"Token revocation lookup error: {e}")
+        return False
+    
+    if expires_at is not None and expires_at > time.time():
+        remember_revoked_token(jti, expires_at)
+        return True
+    if use_local:
+        # add, not set: a revocation broadcast stored meanwhile must win
+        token_revocation_cache.add(jti, False, 1, JWT_REVOCATION_LOCAL_TTL)
+    return False
+
+def count_revoked_tokens():
+    """Number of revoked tokens that have not expired yet"""
+    try:
+        return redis_client.zcount(JWT_REVOCATION_KEY, time.time(), '+inf')
+    except redis.RedisError as e:
+        logger.warning(f"Token revocation store error: {e}")
+        return None
 
 # DATABASE INITIALIZATION AND UTILITIES
 def init_db():
     """Initialize SQLite database with all required tables"""
-    conn = sqlite3.connect('parking_lot.db')
+    conn = get_db()
     cursor = conn.cursor()
     # Users table
     cursor.execute('''
@@ -410,27 +1021,495 @@ def init_db():
     ''', ('admin', admin_password, 'admin@parkinglot.com', 1))
     
     conn.commit()
+    run_migrations(conn)
     conn.close()
+    
+    rebuild_free_spot_index()
+    rebuild_active_reservation_keys()
+
+# SCHEMA MIGRATIONS
+# Each step is idempotent so it can also reconcile databases that were created
+# by older code (e.g. deployments that already have email_notifications).
+def rollup_upsert(table, keys, counters, where='1'):
+    """Trigger statement adding counters to the table's row for keys, creating the row if needed
+
+    keys and counters map column names to SQL expressions over NEW or OLD.
+    """
+    return f'''
+        INSERT INTO {table} ({', '.join([*keys, *counters])})
+        SELECT {', '.join([*keys.values(), *counters.values()])}
+        WHERE {where}
+        ON CONFLICT ({', '.join(keys)}) DO UPDATE SET
+            {', '.join(f'{column} = {column} + excluded.{column}' for column in counters)};
+    '''
+
+def reservation_lot(row):
+    """Lot of a reservation row inside a trigger, 0 once its spot is gone"""
+    return f"COALESCE((SELECT lot_id FROM parking_spots WHERE id = {row}.spot_id), 0)"
+
+def daily_lot_stats_upsert(row, sign):
+    """Trigger statement adding (sign 1) or removing (sign -1) a reservation row in daily_lot_stats"""
+    return rollup_upsert('daily_lot_stats', {
+        'day': f"DATE({row}.created_at)",
+        'lot_id': reservation_lot(row),
+    }, {
+        'reservations': f"{sign}",
+        'completed': f"{sign} * ({row}.status = 'completed')",
+        'active': f"{sign} * ({row}.status = 'active')",
+        'expired': f"{sign} * ({row}.status = 'expired')",
+        'revenue': f"{sign} * COALESCE({row}.parking_cost, 0)",
+    })
+
+def duration_category(row):
+    """Dashboard duration bucket of a reservation row"""
+    hours = f"(julianday({row}.leaving_timestamp) - julianday({row}.parking_timestamp)) * 24"
+    return f'''CASE 
+            WHEN {hours} <= 1 THEN '0-1 hours'
+            WHEN {hours} <= 2 THEN '1-2 hours'
+            WHEN {hours} <= 4 THEN '2-4 hours'
+            WHEN {hours} <= 8 THEN '4-8 hours'
+            ELSE '8+ hours'
+        END'''
+
+def dashboard_rollup_upserts(row, sign):
+    """Trigger statements adding (sign 1) or removing (sign -1) a reservation row in the dashboard rollups"""
+    return ''.join([
+        rollup_upsert('hourly_lot_stats', {
+            'hour_start': f"strftime('%Y-%m-%d %H', {row}.created_at)",
+            'lot_id': reservation_lot(row),
+        }, {
+            'reservations': f"{sign}",
+            'revenue': f"{sign} * COALESCE({row}.parking_cost, 0)",
+        }),
+        rollup_upsert('daily_user_stats', {
+            'day': f"DATE({row}.created_at)",
+            'user_id': f"{row}.user_id",
+        }, {
+            'reservations': f"{sign}",
+            'spent': f"{sign} * COALESCE({row}.parking_cost, 0)",
+        }),
+        rollup_upsert('daily_duration_stats', {
+            'day': f"DATE({row}.created_at)",
+            'duration_category': duration_category(row),
+        }, {
+            'reservations': f"{sign}",
+        }, where=f"{row}.parking_timestamp IS NOT NULL AND {row}.leaving_timestamp IS NOT NULL"),
+    ])
+
+MIGRATIONS = [
+    (1, 'reconcile tables present in deployed databases', [
+        '''
+        CREATE TABLE IF NOT EXISTS email_notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            email_address TEXT NOT NULL,
+            email_type TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'sent',
+            error_message TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS notification_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            template_name TEXT UNIQUE NOT NULL,
+            template_type TEXT NOT NULL,
+            subject_template TEXT NOT NULL,
+            body_template TEXT NOT NULL,
+            is_active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, 'secondary indexes for hot query paths', [
+        # Active reservation lookup per user (reserve/release/analytics)
+        "CREATE INDEX IF NOT EXISTS idx_reservations_user_status ON reservations (user_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_reservations_user_created ON reservations (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reservations_spot_status ON reservations (spot_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_reservations_created_at ON reservations (created_at)",
+        # Reserved but not yet parked (cleanup and parking reminders)
+        '''CREATE INDEX IF NOT EXISTS idx_reservations_pending
+           ON reservations (created_at) WHERE status = 'active' AND parking_timestamp IS NULL''',
+        "CREATE INDEX IF NOT EXISTS idx_parking_spots_lot_status ON parking_spots (lot_id, status)",
+        # Lowest free spot per lot for user_reserve_spot
+        '''CREATE INDEX IF NOT EXISTS idx_parking_spots_available
+           ON parking_spots (lot_id, spot_number) WHERE status = 'A'
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_parking_reminders_reservation ON parking_reminders (reservation_id, reminder_type)",
+        "CREATE INDEX IF NOT EXISTS idx_payment_transactions_user ON payment_transactions (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_user_preferences_user ON user_preferences (user_id)",
+        "ANALYZE",
+    ]),
+    (3, 'email outbox', [
+        '''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dedup_key TEXT UNIQUE,
+            user_id INTEGER,
+            email_type TEXT NOT NULL DEFAULT 'general',
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            attachment_filename TEXT,
+            attachment_data BLOB,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            claimed_at TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at)",
+    ]),
+    (4, 'one parking reminder per reservation and type', [
+        '''
+        DELETE FROM parking_reminders WHERE id NOT IN (
+            SELECT MIN(id) FROM parking_reminders GROUP BY reservation_id, reminder_type
+        )
+        ''',
+        # The unique index also serves the lookups the old one did
+        "DROP INDEX IF EXISTS idx_parking_reminders_reservation",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_parking_reminders_unique ON parking_reminders (reservation_id, reminder_type)",
+    ]),
+    # Reservation counters per creation day and lot, kept current by triggers
+    # on every write to reservations, so reports read a few rows instead of
+    # rescanning the day. Reservations whose spot is gone count under lot 0.
+    (5, 'daily reservation rollups', [
+        '''
+        CREATE TABLE IF NOT EXISTS daily_lot_stats (
+            day TEXT NOT NULL,
+            lot_id INTEGER NOT NULL,
+            reservations INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            active INTEGER NOT NULL DEFAULT 0,
+            expired INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, lot_id)
+        )
+        ''',
+        "DELETE FROM daily_lot_stats",
+        '''
+        INSERT INTO daily_lot_stats (day, lot_id, reservations, completed, active, expired, revenue)
+        SELECT 
+            DATE(r.created_at),
+            COALESCE(ps.lot_id, 0),
+            COUNT(*),
+            SUM(r.status = 'completed'),
+            SUM(r.status = 'active'),
+            SUM(r.status = 'expired'),
+            COALESCE(SUM(r.parking_cost), 0)
+        FROM reservations r
+        LEFT JOIN parking_spots ps ON r.spot_id = ps.id
+        GROUP BY DATE(r.created_at), COALESCE(ps.lot_id, 0)
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reservations_rollup_insert AFTER INSERT ON reservations
+        BEGIN {daily_lot_stats_upsert('NEW', 1)} END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reservations_rollup_update
+        AFTER UPDATE OF spot_id, status, parking_cost, created_at ON reservations
+        BEGIN {daily_lot_stats_upsert('OLD', -1)} {daily_lot_stats_upsert('NEW', 1)} END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reservations_rollup_delete AFTER DELETE ON reservations
+        BEGIN {daily_lot_stats_upsert('OLD', -1)} END
+        ''',
+    ]),
+    # Buckets behind the admin dashboard: reservations per hour and lot, per
+    # day and user, and per day and parked-duration range
+    (6, 'dashboard rollups', [
+        '''
+        CREATE TABLE IF NOT EXISTS hourly_lot_stats (
+            hour_start TEXT NOT NULL,
+            lot_id INTEGER NOT NULL,
+            reservations INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour_start, lot_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_user_stats (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            reservations INTEGER NOT NULL DEFAULT 0,
+            spent REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_duration_stats (
+            day TEXT NOT NULL,
+            duration_category TEXT NOT NULL,
+            reservations INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, duration_category)
+        )
+        ''',
+        "DELETE FROM hourly_lot_stats",
+        "DELETE FROM daily_user_stats",
+        "DELETE FROM daily_duration_stats",
+        '''
+        INSERT INTO hourly_lot_stats (hour_start, lot_id, reservations, revenue)
+        SELECT strftime('%Y-%m-%d %H', r.created_at), COALESCE(ps.lot_id, 0), COUNT(*), COALESCE(SUM(r.parking_cost), 0)
+        FROM reservations r
+        LEFT JOIN parking_spots ps ON r.spot_id = ps.id
+        GROUP BY 1, 2
+        ''',
+        '''
+        INSERT INTO daily_user_stats (day, user_id, reservations, spent)
+        SELECT DATE(created_at), user_id, COUNT(*), COALESCE(SUM(parking_cost), 0)
+        FROM reservations
+        GROUP BY 1, 2
+        ''',
+        f'''
+        INSERT INTO daily_duration_stats (day, duration_category, reservations)
+        SELECT DATE(r.created_at), {duration_category('r')}, COUNT(*)
+        FROM reservations r
+        WHERE r.parking_timestamp IS NOT NULL AND r.leaving_timestamp IS NOT NULL
+        GROUP BY 1, 2
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reservations_dashboard_insert AFTER INSERT ON reservations
+        BEGIN {dashboard_rollup_upserts('NEW', 1)} END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reservations_dashboard_update
+        AFTER UPDATE OF spot_id, user_id, status, parking_cost, created_at, parking_timestamp, leaving_timestamp
+        ON reservations
+        BEGIN {dashboard_rollup_upserts('OLD', -1)} {dashboard_rollup_upserts('NEW', 1)} END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_reservations_dashboard_delete AFTER DELETE ON reservations
+        BEGIN {dashboard_rollup_upserts('OLD', -1)} END
+        ''',
+    ]),
+]
+
+def get_schema_version(cursor):
+    """Highest applied migration version (0 for an unversioned database)"""
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+def run_migrations(conn):
+    """Apply pending schema migrations in order, one transaction per step"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+    
+    applied = 0
+    for version, name, steps in MIGRATIONS:
+        if version <= get_schema_version(cursor):
+            continue
+        
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            # Another worker may have applied it while we waited for the lock
+            if version <= get_schema_version(cursor):
+                cursor.execute('ROLLBACK')
+                continue
+            
+            for step in steps:
+                cursor.execute(step)
+            
+            cursor.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+            cursor.execute('COMMIT')
+            applied += 1
+            logger.info(f"Applied schema migration {version}: {name}")
+        except Exception as e:
+            cursor.execute('ROLLBACK')
+            logger.error(f"Schema migration {version} ({name}) failed: {e}")
+            raise
+    
+    if applied:
+        cursor.execute('PRAGMA optimize')
+    return get_schema_version(cursor)
+
+# Connection pool: each thread (and each forked gunicorn/Celery worker) keeps a
+# few open WAL-mode connections so requests don't pay connect + PRAGMA setup.
+_db_pool = threading.local()
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection whose close() returns it to the per-thread pool"""
+
+    def close(self):
+        release_db(self)
+
+def _open_db_connection():
+    """Open a new SQLite connection with tuned pragmas"""
+    conn = sqlite3.connect(
+        DATABASE_PATH,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        factory=PooledConnection
+    )
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}')
+    cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+    conn.owner_pid = os.getpid()
+    conn.checked_out = False
+    return conn
+
+def _thread_db_pool():
+    """Idle connections for the current thread, reset after a fork"""
+    if getattr(_db_pool, 'pid', None) != os.getpid():
+        _db_pool.pid = os.getpid()
+        _db_pool.connections = []
+    return _db_pool.connections
 
 def get_db():
-    """Get database connection"""
-    return sqlite3.connect('parking_lot.db')
+    """Get a pooled database connection; close() hands it back to the pool"""
+    pool = _thread_db_pool()
+    conn = pool.pop() if pool else _open_db_connection()
+    conn.checked_out = True
+    
+    # Safety net for routes that return early without closing
+    if has_app_context():
+        g.setdefault('_db_connections', []).append(conn)
+    return conn
 
-def hash_password(password):
-    """Hash password using bcrypt (more secure than SHA256)"""
+def release_db(conn):
+    """Return a connection to the pool, rolling back any open transaction"""
+    if not conn.checked_out:
+        return
+    conn.checked_out = False
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = None
+    except sqlite3.Error as e:
+        logger.warning(f"Discarding broken database connection: {e}")
+        sqlite3.Connection.close(conn)
+        return
+    
+    pool = _thread_db_pool()
+    if conn.owner_pid == os.getpid() and len(pool) < DB_POOL_SIZE_PER_THREAD:
+        pool.append(conn)
+    else:
+        sqlite3.Connection.close(conn)
+
+@contextmanager
+def db_connection(row_factory=None):
+    """Context manager yielding a pooled connection that is always released"""
+    conn = get_db()
+    if row_factory:
+        conn.row_factory = row_factory
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+@app.teardown_appcontext
+def release_request_db_connections(exception=None):
+    """Return any connection a request or task left checked out"""
+    for conn in g.pop('_db_connections', []):
+        release_db(conn)
+
+# Password hashing runs on a small bounded pool (bcrypt releases the GIL) so
+# login storms queue there instead of pinning every request thread
+class PasswordPoolSaturated(Exception):
+    """Raised when the password hashing pool has no capacity left"""
+
+_password_pool = {'pid': None, 'executor': None}
+_password_pool_lock = threading.Lock()
+_password_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE_LIMIT)
+
+def run_password_task(fn, *args):
+    """Run fn on the password pool
+
+    Raises PasswordPoolSaturated when it is full and TimeoutError after
+    PASSWORD_HASH_TIMEOUT.
+    """
+    if not _password_slots.acquire(blocking=False):
+        raise PasswordPoolSaturated()
     try:
-        salt = bcrypt.gensalt()
+        if _password_pool['pid'] != os.getpid():
+            with _password_pool_lock:
+                if _password_pool['pid'] != os.getpid():
+                    _password_pool['executor'] = ThreadPoolExecutor(
+                        max_workers=PASSWORD_HASH_WORKERS,
+                        thread_name_prefix='password-hash'
+                    )
+                    _password_pool['pid'] = os.getpid()
+        future = _password_pool['executor'].submit(fn, *args)
+    except Exception:
+        _password_slots.release()
+        raise
+    future.add_done_callback(lambda _: _password_slots.release())
+    return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+
+def _hash_password_sync(password):
+    try:
+        salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
         hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
         return hashed.decode('utf-8')
     except:
         return hashlib.sha256(password.encode()).hexdigest()
 
-def verify_password(password, hashed_password):
-    """Verify password against hash"""
+def _check_password_sync(password, hashed_password):
     try:
         return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
     except:
-        return hashlib.sha256(password.encode()).hexdigest() == hashed_password
+        return False
+
+def is_bcrypt_hash(hashed_password):
+    return hashed_password.startswith(('$2a$', '$2b$', '$2y$'))
+
+def hash_password(password):
+    """Hash password using bcrypt (more secure than SHA256)"""
+    return run_password_task(_hash_password_sync, password)
+
+def verify_password(password, hashed_password):
+    """Verify password against hash"""
+    if not is_bcrypt_hash(hashed_password):
+        # Legacy unsalted SHA-256 hash; cheap enough to check inline
+        legacy_hash = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy_hash, hashed_password)
+    return run_password_task(_check_password_sync, password, hashed_password)
+
+def password_needs_rehash(hashed_password):
+    """True for legacy SHA-256 hashes and bcrypt hashes below BCRYPT_ROUNDS"""
+    if not is_bcrypt_hash(hashed_password):
+        return True
+    try:
+        return int(hashed_password.split('$')[2]) < BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+def upgrade_password_hash(user_id, password, old_hash):
+    """Re-hash a password after a successful login with an outdated hash"""
+    try:
+        new_hash = hash_password(password)
+    except (PasswordPoolSaturated, TimeoutError):
+        # Try again on a later login
+        return
+    with db_connection() as conn:
+        conn.execute(
+            'UPDATE users SET password = ? WHERE id = ? AND password = ?',
+            (new_hash, user_id, old_hash)
+        )
+        conn.commit()
+    logger.info(f"Upgraded password hash for user ID: {user_id}")
+
+def pool_busy_response():
+    """503 for requests turned away by a saturated worker pool"""
+    response = jsonify({'error': 'Server is busy, please try again shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 def generate_tokens(user_data):
     """Generate JWT access and refresh tokens"""
@@ -475,10 +1554,19 @@ def generate_tokens(user_data):
         logger.error(f"Error generating tokens: {e}")
         return None
 
+# Tokens whose signature was already checked, mapped to their claims until expiry
+verified_token_cache = LocalLRUCache(AUTH_TOKEN_CACHE_MAX_ENTRIES, AUTH_TOKEN_CACHE_MAX_BYTES)
+
 def verify_token(token, token_type='access'):
     """Verify JWT token and return user data"""
     try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        found, payload = verified_token_cache.get(token)
+        if not found:
+            # jwt.decode checks the signature and the exp claim
+            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+            remaining = payload.get('exp', 0) - time.time()
+            if remaining > 0:
+                verified_token_cache.set(token, payload, len(token), remaining)
         
         # Check if token type matches
         if payload.get('type') != token_type:
@@ -490,14 +1578,8 @@ def verify_token(token, token_type='access'):
         if jti and is_token_blacklisted(jti):
             logger.warning(f"Blacklisted token attempt: {jti}")
             return None
-        
-        # Checks expiration manually for better error handling
-        exp = payload.get('exp')
-        if exp and datetime.utcfromtimestamp(exp) < datetime.utcnow():
-            logger.warning("Token has expired")
-            return None
             
-        return payload
+        return dict(payload)
     except jwt.ExpiredSignatureError:
         logger.warning("JWT token has expired")
         return None
@@ -509,146 +1591,74 @@ def verify_token(token, token_type='access'):
         return None
 
 # Authentication Decorators
-def token_required(f):
-    """Decorator to require valid JWT token"""
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
+def authenticate_request():
+    """Resolve the caller once per request; returns (user_data, (error, status))"""
+    if '_auth_result' not in g:
+        g._auth_result = _authenticate_request()
+    return g._auth_result
 
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            try:
-                token = auth_header.split(" ")[1] 
-            except IndexError:
-                return jsonify({'error': 'Invalid token format'}), 401
-        # Fallback to session-based auth if no token
-        if not token:
-            if not session.get('user_id'):
-                return jsonify({'error': 'Authentication required'}), 401
-            #Creates user data from session
-            request.current_user = {
-                'user_id': session.get('user_id'),
-                'is_admin': session.get('is_admin', False)
-            }
-            return f(*args, **kwargs)
-        
-        # Verifiess token
-        user_data = verify_token(token)
-        if not user_data:
-            return jsonify({'error': 'Invalid or expired token'}), 401
-        
-        request.current_user = user_data
-        return f(*args, **kwargs)
+def _authenticate_request():
+    token = None
     
-    return decorated
+    if 'Authorization' in request.headers:
+        auth_header = request.headers['Authorization']
+        try:
+            token = auth_header.split(" ")[1]
+        except IndexError:
+            return None, ('Invalid token format', 401)
+    
+    # Fallback to session-based auth if no token
+    if not token:
+        if not session.get('user_id'):
+            return None, ('Authentication required', 401)
+        return {
+            'user_id': session.get('user_id'),
+            'is_admin': bool(session.get('is_admin', False))
+        }, None
+    
+    user_data = verify_token(token)
+    if not user_data:
+        return None, ('Invalid or expired token', 401)
+    return user_data, None
+
+def is_admin_user(user_data):
+    return bool(user_data.get('is_admin'))
+
+def is_regular_user(user_data):
+    return not user_data.get('is_admin')
+
+def auth_guard(predicate=None, forbidden_message=None):
+    """Build an auth decorator from an optional role predicate"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            user_data, error = authenticate_request()
+            if error:
+                return jsonify({'error': error[0]}), error[1]
+            
+            if predicate and not predicate(user_data):
+                return jsonify({'error': forbidden_message}), 403
+            
+            request.current_user = user_data
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+def token_required(f):
+    """Decorator to require valid JWT token"""
+    return auth_guard()(f)
 
 def admin_required(f):
     """Decorator to require admin privileges"""
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            try:
-                token = auth_header.split(" ")[1]
-            except IndexError:
-                return jsonify({'error': 'Invalid token format'}), 401
-        
-        if not token:
-            # Session-based check
-            if not session.get('user_id'):
-                return jsonify({'error': 'Authentication required'}), 401
-            if not session.get('is_admin'):
-                return jsonify({'error': 'Admin access required'}), 403
-            request.current_user = {
-                'user_id': session.get('user_id'),
-                'is_admin': True
-            }
-            return f(*args, **kwargs)
-        
-        # Token-based check
-        user_data = verify_token(token)
-        if not user_data:
-            return jsonify({'error': 'Invalid or expired token'}), 401
-        
-        if not user_data.get('is_admin'):
-            return jsonify({'error': 'Admin access required'}), 403
-        
-        request.current_user = user_data
-        return f(*args, **kwargs)
-    
-    return decorated
+    return auth_guard(is_admin_user, 'Admin access required')(f)
 
 def user_required(f):
     """Decorator to require regular user privileges (non-admin)"""
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            try:
-                token = auth_header.split(" ")[1]
-            except IndexError:
-                return jsonify({'error': 'Invalid token format'}), 401
-        
-        if not token:
-           
-            if not session.get('user_id'):
-                return jsonify({'error': 'Authentication required'}), 401
-            if session.get('is_admin'):
-                return jsonify({'error': 'User access only'}), 403
-            request.current_user = {
-                'user_id': session.get('user_id'),
-                'is_admin': False
-            }
-            return f(*args, **kwargs)
-        
-        user_data = verify_token(token)
-        if not user_data:
-            return jsonify({'error': 'Invalid or expired token'}), 401
-        
-        if user_data.get('is_admin'):
-            return jsonify({'error': 'User access only'}), 403
-        
-        request.current_user = user_data
-        return f(*args, **kwargs)
-    
-    return decorated
+    return auth_guard(is_regular_user, 'User access only')(f)
 
 def login_required(f):
     """Decorator to require authentication (allows both users and admins)"""
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            try:
-                token = auth_header.split(" ")[1]
-            except IndexError:
-                return jsonify({'error': 'Invalid token format'}), 401
-        
-        if not token:
-           
-            if not session.get('user_id'):
-                return jsonify({'error': 'Authentication required'}), 401
-            request.current_user = {
-                'user_id': session.get('user_id'),
-                'is_admin': session.get('is_admin', False)
-            }
-
-            return f(*args, **kwargs)
-        
-        user_data = verify_token(token)
-        if not user_data:
-            return jsonify({'error': 'Invalid or expired token'}), 401
-        
-        request.current_user = user_data
-        return f(*args, **kwargs)
-    
-    return decorated
+    return auth_guard()(f)
 
 def dict_factory(cursor, row):
     """Convert sqlite row to dictionary"""
@@ -695,11 +1705,499 @@ def ensure_database_consistency():
         if orphaned_count > 0 or freed_spots > 0 or occupied_spots > 0:
             logger.info(f"Database consistency check: {orphaned_count} orphaned reservations, {freed_spots} spots freed, {occupied_spots} spots marked occupied")
         
+        if freed_spots > 0 or occupied_spots > 0:
+            rebuild_free_spot_index()
+        
         return True
     except Exception as e:
         logger.error(f"Database consistency check failed: {e}")
         return False
 
+# FREE SPOT INDEX
+# Per-lot sorted set of available spots (member = spot id, score = spot number)
+# shared by all workers through Redis. ZPOPMIN hands out the lowest free spot
+# without touching SQLite; the reservation transaction then only confirms it
+# with a conditional UPDATE. The database stays the source of truth: stale
+# entries fail confirmation and are dropped, and any drift triggers a resync.
+def free_spot_key(lot_id):
+    """Redis key of a lot's free-spot index"""
+    return f"{FREE_SPOT_KEY_PREFIX}:{lot_id}"
+
+REBUILD_FREE_SPOTS_SCRIPT = redis_client.register_script("""
+-- KEYS: synced lots set, claims hash, then one free spot set per lot
+-- ARGV: 1 for a full rebuild, then per lot: lot_id, n, and n (spot_number, spot_id) pairs
+-- Spots held by claims that are not persisted yet stay out of the index
+if ARGV[1] == '1' then
+    redis.call('DEL', KEYS[1])
+end
+local lot_keys = {}
+local pos = 2
+for k = 3, #KEYS do
+    local lot_id = ARGV[pos]
+    local last = pos + 1 + 2 * tonumber(ARGV[pos + 1])
+    redis.call('DEL', KEYS[k])
+    for i = pos + 2, last, 1000 do
+        redis.call('ZADD', KEYS[k], unpack(ARGV, i, math.min(i + 999, last)))
+    end
+    redis.call('SADD', KEYS[1], lot_id)
+    lot_keys[lot_id] = KEYS[k]
+    pos = last + 1
+end
+local claimed = 0
+for _, claim in ipairs(redis.call('HVALS', KEYS[2])) do
+    local lot_id, spot_id = string.match(claim, '^([^|]*)|([^|]*)|')
+    if lot_keys[lot_id] then
+        claimed = claimed + redis.call('ZREM', lot_keys[lot_id], spot_id)
+    end
+end
+return claimed
+""")
+
+def rebuild_free_spot_index(lot_id=None):
+    """Load the free-spot index for one lot (or every lot) from the database"""
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            if lot_id is None:
+                cursor.execute('SELECT id FROM parking_lots')
+                lot_ids = [row[0] for row in cursor.fetchall()]
+                cursor.execute("SELECT lot_id, id, spot_number FROM parking_spots WHERE status = 'A'")
+            else:
+                lot_ids = [lot_id]
+                cursor.execute("SELECT lot_id, id, spot_number FROM parking_spots WHERE lot_id = ? AND status = 'A'", (lot_id,))
+            free_spots = cursor.fetchall()
+        
+        free_by_lot = {}
+        for spot_lot_id, spot_id, spot_number in free_spots:
+            free_by_lot.setdefault(spot_lot_id, {})[spot_id] = spot_number
+        
+        args = [1 if lot_id is None else 0]
+        for lid in lot_ids:
+            spots = free_by_lot.get(lid, {})
+            args += [lid, len(spots)]
+            for spot_id, spot_number in spots.items():
+                args += [spot_number, spot_id]
+        claimed = REBUILD_FREE_SPOTS_SCRIPT(
+            keys=[FREE_SPOT_SYNCED_KEY, RESERVATION_CLAIMS_KEY, *(free_spot_key(lid) for lid in lot_ids)],
+            args=args,
+            client=redis_client
+        )
+        
+        logger.info(f"Free spot index rebuilt for {len(lot_ids)} lots ({len(free_spots) - claimed} free spots, {claimed} claimed)")
+        return True
+    except (redis.RedisError, sqlite3.Error) as e:
+        logger.warning(f"Free spot index rebuild failed: {e}")
+        return False
+
+def invalidate_free_spot_index(lot_id):
+    """Drop a lot's index so the next claim reloads it from the database"""
+    try:
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.srem(FREE_SPOT_SYNCED_KEY, lot_id)
+        pipe.delete(free_spot_key(lot_id))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Free spot index invalidation error: {e}")
+
+def claim_free_spot(lot_id):
+    """Pop the lowest-numbered free spot of a lot as (spot_id, spot_number)
+
+    Returns None when the index is empty or unavailable; callers then fall
+    back to scanning parking_spots.
+    """
+    try:
+        if not redis_client.sismember(FREE_SPOT_SYNCED_KEY, lot_id):
+            if not rebuild_free_spot_index(lot_id):
+                return None
+        popped = redis_client.zpopmin(free_spot_key(lot_id))
+        if popped:
+            spot_id, spot_number = popped[0]
+            return int(spot_id), int(spot_number)
+    except redis.RedisError as e:
+        logger.warning(f"Free spot index read error: {e}")
+    return None
+
+def release_free_spot(lot_id, spot_id, spot_number):
+    """Put a spot (back) into its lot's free-spot index"""
+    try:
+        if redis_client.sismember(FREE_SPOT_SYNCED_KEY, lot_id):
+            redis_client.zadd(free_spot_key(lot_id), {spot_id: spot_number})
+    except redis.RedisError as e:
+        logger.warning(f"Free spot index write error: {e}")
+
+def discard_free_spot(lot_id, spot_id):
+    """Remove a spot that was taken without going through claim_free_spot"""
+    try:
+        redis_client.zrem(free_spot_key(lot_id), spot_id)
+    except redis.RedisError as e:
+        logger.warning(f"Free spot index write error: {e}")
+
+# REDIS RESERVATION CLAIMS
+# In 'redis' allocation mode a booking is decided by one Lua script: it rejects
+# users that already hold a reservation and pops a spot from the lot's free-spot
+# index, so bookings for different lots never wait on the SQLite write lock.
+# Claims are queued and persisted in batches by persist_reservation_claims,
+# which re-checks them against the database and compensates conflicts.
+CLAIM_SPOT_SCRIPT = redis_client.register_script("""
+-- KEYS: active reservation key, free spot set, synced lots set, claims hash, claim queue
+-- ARGV: lot_id, user_id, spot_id ('' = lowest free), claimed_at, kind, key ttl
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return {-1}
+end
+if redis.call('SISMEMBER', KEYS[3], ARGV[1]) == 0 then
+    return {-2}
+end
+local spot_id
+local spot_number
+if ARGV[3] == '' then
+    local popped = redis.call('ZPOPMIN', KEYS[2])
+    if #popped == 0 then
+        return {0}
+    end
+    spot_id = popped[1]
+    spot_number = popped[2]
+else
+    spot_number = redis.call('ZSCORE', KEYS[2], ARGV[3])
+    if not spot_number then
+        return {0}
+    end
+    redis.call('ZREM', KEYS[2], ARGV[3])
+    spot_id = ARGV[3]
+end
+redis.call('SET', KEYS[1], 'claim:' .. spot_id, 'EX', ARGV[6])
+redis.call('HSET', KEYS[4], ARGV[2], ARGV[1] .. '|' .. spot_id .. '|' .. spot_number .. '|' .. ARGV[4] .. '|' .. ARGV[5])
+redis.call('RPUSH', KEYS[5], ARGV[2])
+return {1, spot_id, spot_number}
+""")
+
+def active_reservation_key(user_id):
+    """Redis key marking that a user holds (or is claiming) a reservation"""
+    return f"{ACTIVE_RESERVATION_KEY_PREFIX}:{user_id}"
+
+def failed_claim_key(user_id):
+    """Redis key holding a user's last claim that could not be persisted"""
+    return f"{RESERVATION_CLAIM_FAILED_KEY_PREFIX}:{user_id}"
+
+def get_failed_claim(user_id):
+    """The user's rejected claim, or None (redis allocation mode)"""
+    if RESERVATION_ALLOCATION_MODE != 'redis':
+        return None
+    try:
+        raw = redis_client.get(failed_claim_key(user_id))
+    except redis.RedisError as e:
+        logger.warning(f"Failed claim lookup error: {e}")
+        return None
+    return json.loads(raw) if raw else None
+
+def mark_active_reservation(user_id, reservation_id):
+    """Record a reservation made outside the claim script (redis allocation mode)"""
+    if RESERVATION_ALLOCATION_MODE != 'redis':
+        return
+    try:
+        redis_client.set(active_reservation_key(user_id), f'reservation:{reservation_id}', ex=ACTIVE_RESERVATION_KEY_TTL)
+    except redis.RedisError as e:
+        logger.warning(f"Active reservation key error: {e}")
+
+def clear_active_reservation(user_id):
+    """Forget a user's active reservation marker once the reservation ends"""
+    if RESERVATION_ALLOCATION_MODE != 'redis':
+        return
+    try:
+        redis_client.delete(active_reservation_key(user_id))
+    except redis.RedisError as e:
+        logger.warning(f"Active reservation key error: {e}")
+
+def claim_spot_atomically(user_id, lot_id, spot_id=None, kind='lot'):
+    """Run the claim script; returns (status, spot_id, spot_number)
+
+    status is 1 on success, 0 when no (or not that) spot is free and -1 when
+    the user already holds a reservation.
+    """
+    keys = [
+        active_reservation_key(user_id),
+        free_spot_key(lot_id),
+        FREE_SPOT_SYNCED_KEY,
+        RESERVATION_CLAIMS_KEY,
+        RESERVATION_CLAIM_QUEUE_KEY
+    ]
+    # Same format and timezone as the CURRENT_TIMESTAMP default of reservations.created_at
+    claimed_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    args = [lot_id, user_id, spot_id or '', claimed_at, kind, ACTIVE_RESERVATION_KEY_TTL]
+    
+    result = CLAIM_SPOT_SCRIPT(keys=keys, args=args, client=redis_client)
+    if result[0] == -2:
+        # Lot not indexed yet in this Redis - load it and retry once
+        if not rebuild_free_spot_index(lot_id):
+            raise redis.RedisError('free spot index unavailable')
+        result = CLAIM_SPOT_SCRIPT(keys=keys, args=args, client=redis_client)
+    
+    if result[0] == 1:
+        return 1, int(result[1]), int(float(result[2]))
+    return int(result[0]), None, None
+
+def rebuild_active_reservation_keys():
+    """Seed active reservation markers from the database (redis allocation mode)"""
+    if RESERVATION_ALLOCATION_MODE != 'redis':
+        return
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT user_id, id FROM reservations WHERE status = 'active'")
+            active = cursor.fetchall()
+        
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id, reservation_id in active:
+            pipe.set(active_reservation_key(user_id), f'reservation:{reservation_id}', ex=ACTIVE_RESERVATION_KEY_TTL)
+        pipe.execute()
+        logger.info(f"Seeded {len(active)} active reservation markers")
+    except (redis.RedisError, sqlite3.Error) as e:
+        logger.warning(f"Active reservation marker rebuild failed: {e}")
+
+def persist_claim_batch(entries):
+    """Write a batch of (user_id, claim) entries to SQLite in one transaction
+
+    Every claim is re-validated against the database, which stays the source
+    of truth. Returns (persisted, conflicts) lists of claim dicts.
+    """
+    persisted = []
+    conflicts = []
+    
+    with db_connection(dict_factory) as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            for user_id, raw_claim in entries:
+                if not raw_claim:
+                    continue
+                lot_id, spot_id, spot_number, claimed_at, kind = raw_claim.split('|')
+                claim = {
+                    'user_id': int(user_id),
+                    'lot_id': int(lot_id),
+                    'spot_id': int(spot_id),
+                    'spot_number': int(float(spot_number)),
+                    'claimed_at': claimed_at,
+                    'kind': kind
+                }
+                
+                cursor.execute(
+                    "SELECT id, spot_id FROM reservations WHERE user_id = ? AND status = 'active'",
+                    (claim['user_id'],)
+                )
+                existing = cursor.fetchone()
+                if existing:
+                    claim['reservation_id'] = existing['id']
+                    if existing['spot_id'] == claim['spot_id']:
+                        # Replayed after a crash between COMMIT and settlement
+                        claim['notify'] = False
+                        persisted.append(claim)
+                    else:
+                        claim['reason'] = 'user_active'
+                        conflicts.append(claim)
+                    continue
+                
+                cursor.execute(
+                    "UPDATE parking_spots SET status = 'O' WHERE id = ? AND status = 'A'",
+                    (claim['spot_id'],)
+                )
+                if cursor.rowcount != 1:
+                    claim['reason'] = 'spot_taken'
+                    conflicts.append(claim)
+                    continue
+                
+                cursor.execute('''
+                    INSERT INTO reservations (spot_id, user_id, status, created_at)
+                    VALUES (?, ?, 'active', ?)
+                ''', (claim['spot_id'], claim['user_id'], claimed_at))
+                claim['reservation_id'] = cursor.lastrowid
+                claim['notify'] = True
+                persisted.append(claim)
+            
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+    
+    return persisted, conflicts
+
+def settle_claims(persisted, conflicts):
+    """Update Redis after a batch was committed and compensate conflicts
+
+    A claim whose spot was taken was already answered with 202, so it is kept
+    under failed_claim_key for my-reservations to report.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for claim in persisted:
+        pipe.hdel(RESERVATION_CLAIMS_KEY, claim['user_id'])
+        pipe.set(active_reservation_key(claim['user_id']), f"reservation:{claim['reservation_id']}", ex=ACTIVE_RESERVATION_KEY_TTL)
+    for claim in conflicts:
+        pipe.hdel(RESERVATION_CLAIMS_KEY, claim['user_id'])
+        if claim['reason'] == 'user_active':
+            # The user already had a reservation; the claimed spot is still free
+            pipe.set(active_reservation_key(claim['user_id']), f"reservation:{claim['reservation_id']}", ex=ACTIVE_RESERVATION_KEY_TTL)
+            pipe.zadd(free_spot_key(claim['lot_id']), {claim['spot_id']: claim['spot_number']})
+        else:
+            pipe.delete(active_reservation_key(claim['user_id']))
+            pipe.set(failed_claim_key(claim['user_id']), json.dumps({
+                'lot_id': claim['lot_id'],
+                'spot_id': claim['spot_id'],
+                'spot_number': claim['spot_number'],
+                'claimed_at': claim['claimed_at'],
+                'reason': claim['reason'],
+                'status': 'failed'
+            }), ex=RESERVATION_CLAIM_FAILED_TTL)
+        logger.warning(f"Rejected reservation claim of user {claim['user_id']} for spot {claim['spot_id']}: {claim['reason']}")
+    pipe.execute()
+
+def notify_persisted_claims(persisted):
+    """Send booking confirmations for newly persisted claims"""
+    with db_connection(dict_factory) as conn:
+        cursor = conn.cursor()
+        for claim in persisted:
+            if not claim['notify']:
+                continue
+            cursor.execute('''
+                SELECT 
+                    r.*,
+                    ps.spot_number,
+                    pl.prime_location_name,
+                    pl.address,
+                    pl.price
+                FROM reservations r
+                JOIN parking_spots ps ON r.spot_id = ps.id
+                JOIN parking_lots pl ON ps.lot_id = pl.id
+                WHERE r.id = ?
+            ''', (claim['reservation_id'],))
+            reservation = cursor.fetchone()
+            
+            cursor.execute('SELECT username, email FROM users WHERE id = ?', (claim['user_id'],))
+            user_details = cursor.fetchone()
+            
+            if claim['kind'] == 'spot':
+                send_spot_reservation_confirmation(user_details, reservation)
+            else:
+                send_reservation_confirmation(user_details, reservation)
+
+def notify_rejected_claims(conflicts):
+    """Tell users whose spot was taken before their claim was persisted"""
+    rejected = [claim for claim in conflicts if claim['reason'] == 'spot_taken']
+    if not rejected:
+        return
+    with db_connection(dict_factory) as conn:
+        cursor = conn.cursor()
+        for claim in rejected:
+            cursor.execute('SELECT username, email FROM users WHERE id = ?', (claim['user_id'],))
+            user_details = cursor.fetchone()
+            if not user_details or not user_details['email']:
+                continue
+            
+            cursor.execute('SELECT prime_location_name, address FROM parking_lots WHERE id = ?', (claim['lot_id'],))
+            lot = cursor.fetchone() or {}
+            
+            subject, body = render_notification('booking_failed', {
+                'username': user_details['username'],
+                'claim': claim,
+                'lot': lot,
+            })
+            queue_email(user_details['email'], subject, body,
+                        email_type='reservation_failed', user_id=claim['user_id'],
+                        dedup_key=f"reservation_failed:{claim['user_id']}:{claim['spot_id']}:{claim['claimed_at']}")
+
+def schedule_claim_persistence():
+    """Kick the write-behind task, at most once per second"""
+    try:
+        if redis_client.set('reservation_claims:scheduled', 1, nx=True, ex=1):
+            persist_reservation_claims.delay()
+    except Exception as e:
+        # The beat schedule drains the queue anyway
+        logger.warning(f"Could not schedule reservation persistence: {e}")
+
+def reserve_with_redis_claim(user_id, lot_id, spot_id=None):
+    """Claim a spot in Redis and queue it for persistence (redis allocation mode)"""
+    kind = 'spot' if spot_id else 'lot'
+    status, claimed_spot_id, spot_number = claim_spot_atomically(user_id, lot_id, spot_id, kind)
+    
+    if status == -1:
+        # The marker may outlive its reservation (e.g. after an admin reset);
+        # trust the database, then try once more.
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM reservations WHERE user_id = ? AND status = 'active'", (user_id,))
+            has_active = cursor.fetchone() is not None
+        if has_active or redis_client.hexists(RESERVATION_CLAIMS_KEY, user_id):
+            return jsonify({'error': 'You already have an active reservation'}), 400
+        redis_client.delete(active_reservation_key(user_id))
+        status, claimed_spot_id, spot_number = claim_spot_atomically(user_id, lot_id, spot_id, kind)
+        if status == -1:
+            return jsonify({'error': 'You already have an active reservation'}), 400
+    
+    if status == 0:
+        if spot_id:
+            return jsonify({'error': 'This parking spot is no longer available'}), 400
+        return jsonify({'error': 'No available spots in this parking lot'}), 400
+    
+    redis_client.delete(failed_claim_key(user_id))
+    schedule_claim_persistence()
+    invalidate_cache_tags(f'lot:{lot_id}')
+    
+    logger.info(f"User {user_id} claimed spot {spot_number} (ID: {claimed_spot_id}) in lot {lot_id}")
+    
+    message = f'Spot #{spot_number} reserved successfully! Pay when you leave.' if spot_id else 'Spot reserved successfully'
+    return jsonify({
+        'message': message,
+        'reservation': {
+            'spot_id': claimed_spot_id,
+            'spot_number': spot_number,
+            'lot_id': lot_id,
+            'user_id': user_id,
+            'status': 'pending'
+        }
+    }), 202
+
+# PAYMENT GATEWAY
+# Releases are paid in three steps: a pending payment_transactions row is
+# committed, the gateway is called with no database lock held, and a short
+# transaction settles the payment and frees the spot. Providers register in
+# PAYMENT_GATEWAYS and are selected with PAYMENT_GATEWAY.
+class PaymentGateway(ABC):
+    """Interface for payment providers"""
+    
+    @abstractmethod
+    def charge(self, transaction_id, amount, payment_method, payment_details):
+        """Capture a payment; returns True on success"""
+
+class SimulatedPaymentGateway(PaymentGateway):
+    """Local stand-in for a real provider with demo latency and failure rate"""
+    
+    def __init__(self, delay=PAYMENT_SIMULATOR_DELAY, success_rate=PAYMENT_SIMULATOR_SUCCESS_RATE):
+        self.delay = delay
+        self.success_rate = success_rate
+    
+    def charge(self, transaction_id, amount, payment_method, payment_details):
+        time.sleep(self.delay)
+        return random.random() < self.success_rate
+
+PAYMENT_GATEWAYS = {
+    'simulator': SimulatedPaymentGateway
+}
+
+_payment_gateway = None
+
+def get_payment_gateway():
+    """Return the configured payment gateway instance"""
+    global _payment_gateway
+    if _payment_gateway is None:
+        gateway_class = PAYMENT_GATEWAYS.get(PAYMENT_GATEWAY)
+        if gateway_class is None:
+            raise ValueError(
+                f"Unknown PAYMENT_GATEWAY {PAYMENT_GATEWAY!r}; "
+                f"expected one of: {', '.join(sorted(PAYMENT_GATEWAYS))}"
+            )
+        _payment_gateway = gateway_class()
+    return _payment_gateway
+
+# A misspelled PAYMENT_GATEWAY fails at startup, not on the first release
+get_payment_gateway()
+
 # EMAIL AND NOTIFICATION UTILITIES
 def check_mailhog_status():
     """Check if MailHog is running and accessible"""
@@ -756,77 +2254,183 @@ def ensure_mailhog_running():
         logger.error(f"Error starting MailHog: {e}")
         return False
 
-def send_email(to_email, subject, body, attachment=None, retry_count=3):
-    """Enhanced email sending function with auto-start capability and retry logic"""
-    if not ensure_mailhog_running():
-        logger.error("Cannot send email - MailHog is not running and could not be started")
-        return False
+def build_email_message(to_email, subject, body, attachment=None):
+    """MIME message for an HTML email with an optional file attachment"""
+    msg = MIMEMultipart()
+    msg['From'] = EMAIL_FROM
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    
+    msg.attach(MIMEText(body, 'html'))
     
-    for attempt in range(retry_count):
+    if attachment:
+        part = MIMEBase('application', 'octet-stream')
+        part.set_payload(attachment['data'])
+        encoders.encode_base64(part)
+        part.add_header(
+            'Content-Disposition',
+            f'attachment; filename= {attachment["filename"]}'
+        )
+        msg.attach(part)
+    return msg
+
+# SMTP sessions are reused across messages and task runs instead of paying a
+# TCP (and TLS/AUTH) handshake per email. A session that went stale while idle
+# is replaced transparently; a rejected message leaves its session usable.
+class SMTPConnectionPool:
+    """Per-process pool of open SMTP sessions with delivery counters"""
+
+    def __init__(self, max_idle, idle_timeout, max_messages):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self._idle = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._stats[name] = self._stats.get(name, 0) + value
+
+    def _open(self):
+        server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT, timeout=EMAIL_SMTP_TIMEOUT)
         try:
-            if not check_mailhog_status():
-                logger.warning(f"MailHog not accessible on attempt {attempt + 1}/{retry_count}")
-                if attempt < retry_count - 1:
-                    ensure_mailhog_running()
-                    time.sleep(2)
-                    continue
-                else:
-                    logger.error("MailHog server is not accessible after all attempts")
-                    return False
-            
-            msg = MIMEMultipart()
-            msg['From'] = EMAIL_FROM
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            
-            msg.attach(MIMEText(body, 'html'))
-            
-            if attachment:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(attachment['data'])
-                encoders.encode_base64(part)
-                part.add_header(
-                    'Content-Disposition',
-                    f'attachment; filename= {attachment["filename"]}'
-                )
-                msg.attach(part)
-            
-            server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
-            server.sendmail(EMAIL_FROM, to_email, msg.as_string())
-            server.quit()
+            if EMAIL_USE_TLS:
+                server.starttls()
+            if EMAIL_PASSWORD:
+                server.login(EMAIL_USERNAME, EMAIL_PASSWORD)
+        except Exception:
+            server.close()
+            raise
+        self._count(connections_opened=1)
+        return {'server': server, 'messages': 0, 'last_used': time.monotonic()}
+
+    def _quit(self, session):
+        try:
+            session['server'].quit()
+        except Exception:
+            session['server'].close()
+
+    def _checkout(self):
+        with self._lock:
+            # Sessions inherited across a fork share their socket with the parent
+            if self._pid != os.getpid():
+                self._idle = []
+                self._pid = os.getpid()
+            while self._idle:
+                session = self._idle.pop()
+                if time.monotonic() - session['last_used'] < self.idle_timeout:
+                    self._stats['connections_reused'] = self._stats.get('connections_reused', 0) + 1
+                    return session
+                session['server'].close()
+        return self._open()
+
+    def _checkin(self, session):
+        if session['messages'] < self.max_messages:
+            session['last_used'] = time.monotonic()
+            with self._lock:
+                if self._pid == os.getpid() and len(self._idle) < self.max_idle:
+                    self._idle.append(session)
+                    return
+        self._quit(session)
+
+    def has_idle_sessions(self):
+        with self._lock:
+            return self._pid == os.getpid() and bool(self._idle)
+
+    def send_batch(self, messages):
+        """Send (to_email, MIME message) pairs over one session; returns None or an error per message"""
+        errors = []
+        session = None
+        unreachable = None
+        for to_email, msg in messages:
+            if unreachable:
+                errors.append(unreachable)
+                self._count(messages_failed=1)
+                continue
             
-            logger.info(f"Email sent successfully to {to_email}: {subject}")
-            return True
+            if session is not None and session['messages'] >= self.max_messages:
+                # Rotate within the batch too, so a long batch cannot exceed the cap
+                self._quit(session)
+                session = None
             
-        except ConnectionRefusedError as e:
-            logger.warning(f"Connection refused on attempt {attempt + 1}/{retry_count}: {e}")
-            if attempt < retry_count - 1:
-                ensure_mailhog_running()
-                time.sleep(3)
-                continue
-            else:
-                logger.error(f"Failed to send email after {retry_count} attempts - Connection refused")
-                return False
-                
-        except smtplib.SMTPException as e:
-            logger.error(f"SMTP error on attempt {attempt + 1}: {e}")
-            if attempt < retry_count - 1:
-                time.sleep(2)
-                continue
-            else:
-                logger.error(f"Failed to send email after {retry_count} attempts - SMTP error")
-                return False
+            payload = msg.as_string()
+            started = time.perf_counter()
+            reconnected = False
+            while True:
+                try:
+                    if session is None:
+                        session = self._checkout()
+                    session['server'].sendmail(EMAIL_FROM, to_email, payload)
+                    session['messages'] += 1
+                    self._count(messages_sent=1, bytes_sent=len(payload),
+                                send_seconds=time.perf_counter() - started)
+                    errors.append(None)
+                    break
+                except smtplib.SMTPServerDisconnected as e:
+                    error = e
+                except smtplib.SMTPException as e:
+                    # Rejected by the server; smtplib has reset the session for the next message
+                    errors.append(f"{type(e).__name__}: {e}")
+                    self._count(messages_failed=1)
+                    break
+                except OSError as e:
+                    error = e
                 
-        except Exception as e:
-            logger.error(f"Unexpected error on attempt {attempt + 1}: {e}")
-            if attempt < retry_count - 1:
-                time.sleep(2)
-                continue
+                # The session broke (dropped while idle or mid-batch): reconnect once
+                # per message. Failing to connect at all means the server is unreachable
+                retry = session is not None and not reconnected
+                if session is not None:
+                    session['server'].close()
+                    session = None
+                if retry:
+                    reconnected = True
+                    self._count(reconnects=1)
+                    continue
+                unreachable = f"{type(error).__name__}: {error}"
+                errors.append(unreachable)
+                self._count(messages_failed=1)
+                break
+        
+        if session is not None:
+            self._checkin(session)
+        return errors
+
+    def take_stats(self):
+        """Counters accumulated since the last call"""
+        with self._lock:
+            stats = self._stats
+            self._stats = {}
+        return stats
+
+smtp_pool = SMTPConnectionPool(EMAIL_SMTP_POOL_SIZE, EMAIL_SMTP_IDLE_TIMEOUT, EMAIL_SMTP_MAX_MESSAGES)
+
+def flush_email_stats():
+    """Add this process's delivery counters to the shared totals in Redis"""
+    stats = smtp_pool.take_stats()
+    if not stats:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for name, value in stats.items():
+            if isinstance(value, float):
+                pipe.hincrbyfloat(EMAIL_STATS_KEY, name, value)
             else:
-                logger.error(f"Failed to send email after {retry_count} attempts - Unexpected error")
-                return False
-    
-    return False
+                pipe.hincrby(EMAIL_STATS_KEY, name, value)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Email stats flush error: {e}")
+
+def get_email_stats():
+    """Delivery totals across all sender processes, with derived throughput"""
+    stats = {name: float(value) for name, value in redis_client.hgetall(EMAIL_STATS_KEY).items()}
+    sent = stats.get('messages_sent', 0)
+    opened = stats.get('connections_opened', 0)
+    stats['messages_per_second'] = round(sent / stats['send_seconds'], 2) if stats.get('send_seconds') else 0
+    stats['messages_per_connection'] = round(sent / opened, 2) if opened else 0
+    return stats
 
 def send_google_chat_message(message):
     try:
@@ -847,52 +2451,656 @@ def send_google_chat_message(message):
         logger.error(f"Error sending Google Chat message: {e}")
         return False
 
+# EMAIL OUTBOX
+# Request handlers and tasks never talk to SMTP. queue_email() inserts a row
+# into email_outbox (inside the caller's transaction when it passes one), and
+# deliver_outbox_emails claims due rows and sends them on a small thread pool.
+# Failed sends are retried with exponential backoff and jitter; emails that
+# keep failing are marked 'dead' for an admin to inspect and retry. A
+# dedup_key makes queueing idempotent, so a retried task never mails twice.
+OUTBOX_INSERT_SQL = '''
+    INSERT OR IGNORE INTO email_outbox
+        (dedup_key, user_id, email_type, to_email, subject, body, attachment_filename, attachment_data)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def queue_emails(messages, conn=None):
+    """Add emails to the outbox and return how many were new
+
+    Each message is a dict with to_email, subject and body, plus optional
+    attachment, email_type, user_id and dedup_key. With conn the rows join
+    the caller's transaction; the caller commits and then calls
+    schedule_outbox_delivery(), since a kick before the commit finds nothing.
+    """
+    rows = []
+    for message in messages:
+        attachment = message.get('attachment') or {}
+        rows.append((
+            message.get('dedup_key'),
+            message.get('user_id'),
+            message.get('email_type', 'general'),
+            message['to_email'],
+            message['subject'],
+            message['body'],
+            attachment.get('filename'),
+            attachment.get('data'),
+        ))
+    if not rows:
+        return 0
+    
+    if conn is not None:
+        cursor = conn.cursor()
+        cursor.executemany(OUTBOX_INSERT_SQL, rows)
+        return cursor.rowcount
+    
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(OUTBOX_INSERT_SQL, rows)
+        queued = cursor.rowcount
+        conn.commit()
+    
+    if queued:
+        schedule_outbox_delivery()
+    return queued
+
+def queue_email(to_email, subject, body, attachment=None, email_type='general', user_id=None, dedup_key=None, conn=None):
+    """Queue one email; False if an email with the same dedup_key was already queued"""
+    return queue_emails([{
+        'to_email': to_email,
+        'subject': subject,
+        'body': body,
+        'attachment': attachment,
+        'email_type': email_type,
+        'user_id': user_id,
+        'dedup_key': dedup_key,
+    }], conn) > 0
+
+def schedule_outbox_delivery():
+    """Kick the sender task, at most once per second"""
+    try:
+        if redis_client.set('email_outbox:scheduled', 1, nx=True, ex=1):
+            # No publish retries: a request must not wait on an unreachable broker
+            deliver_outbox_emails.apply_async(retry=False)
+    except Exception as e:
+        # The beat schedule drains the outbox anyway
+        logger.warning(f"Could not schedule email delivery: {e}")
+
+def claim_outbox_batch(limit):
+    """Mark up to limit due emails as 'sending' for this worker and return them"""
+    with db_connection(dict_factory) as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT id, to_email, subject, body, attachment_filename, attachment_data, attempts
+            FROM email_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP)
+               OR (status = 'sending' AND claimed_at <= datetime('now', ?))
+            ORDER BY next_attempt_at, id
+            LIMIT ?
+        ''', (f'-{EMAIL_SENDING_TIMEOUT} seconds', limit))
+        emails = cursor.fetchall()
+        
+        # Counting the attempt at claim time also bounds emails that crash a worker
+        cursor.executemany('''
+            UPDATE email_outbox
+            SET status = 'sending', claimed_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+            WHERE id = ?
+        ''', [(email['id'],) for email in emails])
+        conn.commit()
+    
+    for email in emails:
+        email['attempts'] += 1
+    return emails
+
+def send_outbox_batch(emails):
+    """Deliver claimed emails over one pooled SMTP session; returns an error (or None) per email"""
+    messages = []
+    for email in emails:
+        attachment = None
+        if email['attachment_filename']:
+            attachment = {'filename': email['attachment_filename'], 'data': email['attachment_data']}
+        messages.append((email['to_email'], build_email_message(email['to_email'], email['subject'], email['body'], attachment)))
+    
+    errors = smtp_pool.send_batch(messages)
+    for email, error in zip(emails, errors):
+        if error:
+            logger.warning(f"Email {email['id']} to {email['to_email']} failed (attempt {email['attempts']}): {error}")
+    return errors
+
+def outbox_retry_delay(attempts):
+    """Seconds to wait before the next attempt: exponential backoff with jitter"""
+    delay = min(EMAIL_RETRY_MAX_DELAY, EMAIL_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return int(delay * random.uniform(0.8, 1.2))
+
+def record_outbox_results(emails, errors):
+    """Mark sent emails and reschedule (or bury) failed ones in one transaction"""
+    sent = []
+    failed = []
+    for email, error in zip(emails, errors):
+        if error is None:
+            sent.append((email['id'],))
+        else:
+            failed.append((
+                EMAIL_MAX_ATTEMPTS,
+                error[:1000],
+                f'+{outbox_retry_delay(email["attempts"])} seconds',
+                email['id'],
+            ))
+    
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            UPDATE email_outbox
+            SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+            WHERE id = ?
+        ''', sent)
+        cursor.executemany('''
+            UPDATE email_outbox
+            SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END,
+                last_error = ?,
+                next_attempt_at = datetime('now', ?)
+            WHERE id = ?
+        ''', failed)
+        conn.commit()
+    return len(sent), len(failed)
+
+# NOTIFICATION TEMPLATES
+# Email subjects and bodies are Jinja templates compiled once per process and
+# rendered with a context dict. Every NOTIFICATION_TEMPLATE_RELOAD_INTERVAL
+# the notification_templates table is re-read and only templates whose
+# source changed are recompiled, so ops can edit copy without a deploy.
+# Database bodies named like 'default_<x>_template' (or left empty) keep the
+# built-in body. Templates run sandboxed and bodies are HTML-escaped.
+DEFAULT_NOTIFICATION_TEMPLATES = {
+    'welcome': "Welcome to ParkMate! 🚗",
+    'daily_reminder': "Parking Reminder - Book Your Spot Today! 🚗",
+    'availability_notification': "New Parking Opportunities Available! 🅿️",
+    'test_reminder': "🔔 TEST Daily Parking Reminder!",
+    'monthly_report': "📊 Your Monthly Parking Report - {{ month }}/{{ year }}",
+    'csv_export': "Your Parking Data Export",
+    'parking_reminder': "🚗 Parking Reminder - Spot #{{ reservation.spot_number }} Reserved",
+    'booking_confirmation': "Parking Reserved - {{ reservation.prime_location_name }}",
+    'spot_booking_confirmation': "Spot #{{ reservation.spot_number }} Reserved - {{ reservation.prime_location_name }}",
+    'booking_failed': "Reservation Not Confirmed - {{ lot.prime_location_name }}",
+    'payment_receipt': "Payment Receipt - Spot #{{ reservation.spot_number }} (${{ amount }})",
+    'lot_created': "New Parking Lot Created - {{ lot.prime_location_name }}",
+    'new_lot': "New Parking Location: {{ lot.prime_location_name }}",
+}
+BUILTIN_TEMPLATE_BODY = re.compile(r'default_\w+_template')
+
+def format_datetime(value, fmt='%Y-%m-%d %H:%M:%S'):
+    """Jinja filter: format a datetime the way our emails always have"""
+    return value.strftime(fmt) if value else ''
+
+class NotificationTemplateEngine:
+    """Compiled notification templates with hot reload from notification_templates"""
+
+    def __init__(self, defaults, template_dir, reload_interval):
+        self.defaults = defaults
+        self.template_dir = template_dir
+        self.reload_interval = reload_interval
+        self.subject_env = SandboxedEnvironment(autoescape=False)
+        self.body_env = SandboxedEnvironment(autoescape=True)
+        for env in (self.subject_env, self.body_env):
+            env.filters['datetime'] = format_datetime
+        self._builtin = {}
+        self._overrides = {}  # name -> (source, subject template, body template)
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def compile(self, subject_source, body_source):
+        """Compile a subject/body pair; raises TemplateError on bad syntax"""
+        return self.subject_env.from_string(subject_source), self.body_env.from_string(body_source)
+
+    def builtin(self, name):
+        """Built-in subject and body for name, compiled on first use"""
+        compiled = self._builtin.get(name)
+        if compiled is None:
+            with open(os.path.join(self.template_dir, f'{name}.html'), encoding='utf-8') as f:
+                compiled = self.compile(self.defaults[name], f.read())
+            self._builtin[name] = compiled
+        return compiled
+
+    def _load_overrides(self):
+        with db_connection(dict_factory) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT template_name, subject_template, body_template
+                FROM notification_templates
+                WHERE is_active = 1
+            ''')
+            rows = cursor.fetchall()
+        
+        overrides = {}
+        for row in rows:
+            name = row['template_name']
+            source = (row['subject_template'], row['body_template'])
+            current = self._overrides.get(name)
+            if current and current[0] == source:
+                overrides[name] = current
+                continue
+            try:
+                body_source = row['body_template'] or ''
+                if name in self.defaults and (not body_source.strip() or BUILTIN_TEMPLATE_BODY.fullmatch(body_source.strip())):
+                    subject = self.subject_env.from_string(row['subject_template'])
+                    body = self.builtin(name)[1]
+                else:
+                    subject, body = self.compile(row['subject_template'], body_source)
+                overrides[name] = (source, subject, body)
+            except (TemplateError, OSError) as e:
+                logger.error(f"Ignoring notification template {name}: {e}")
+        self._overrides = overrides
+
+    def refresh(self, force=False):
+        """Re-read notification_templates when the reload interval has passed"""
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            if not force and self._checked_at is not None and now - self._checked_at < self.reload_interval:
+                return
+            try:
+                self._load_overrides()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not reload notification templates: {e}")
+            self._checked_at = time.monotonic()
+
+    def render(self, name, context):
+        """Render (subject, body) for a template name"""
+        self.refresh()
+        context = {'now': datetime.now(), **context}
+        override = self._overrides.get(name)
+        if override:
+            try:
+                return override[1].render(context), override[2].render(context)
+            except Exception as e:
+                # A broken edit must not stop mail; fall back to the built-in copy
+                if name not in self.defaults:
+                    raise
+                logger.error(f"Notification template {name} failed to render, using built-in: {e}")
+        subject, body = self.builtin(name)
+        return subject.render(context), body.render(context)
+
+notification_templates = NotificationTemplateEngine(
+    DEFAULT_NOTIFICATION_TEMPLATES, NOTIFICATION_TEMPLATE_DIR, NOTIFICATION_TEMPLATE_RELOAD_INTERVAL
+)
+
+def render_notification(name, context):
+    """Subject and HTML body of a notification email"""
+    return notification_templates.render(name, context)
+
+# BATCH JOBS
+# Long fan-outs run as a planner task that splits the work into chunk tasks.
+# Their progress lives in batch_jobs: counters are kept in the JSON result
+# column and bumped atomically by every chunk, and whichever task finishes
+# the last chunk marks the job completed. Resumable jobs also record their
+# shards and a per-shard checkpoint, so a rerun only redoes unfinished work.
+def create_batch_job(job_type, parameters):
+    """Insert a pending batch job and return its id"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO batch_jobs (job_type, status, parameters, result)
+            VALUES (?, 'pending', ?, ?)
+        ''', (job_type, json.dumps(parameters), json.dumps({
+            'chunks_total': 0,
+            'chunks_done': 0,
+            'chunks_failed': 0,
+            'planned': 0,
+        })))
+        conn.commit()
+        return cursor.lastrowid
+
+def get_batch_job(job_id):
+    """Batch job row with parameters and result decoded, or None"""
+    with db_connection(dict_factory) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM batch_jobs WHERE id = ?', (job_id,))
+        job = cursor.fetchone()
+    if job:
+        job['parameters'] = json.loads(job['parameters'] or '{}')
+        job['result'] = json.loads(job['result'] or '{}')
+    return job
+
+def set_batch_job_status(job_id, status, task_id=None, error_message=None):
+    """Move a batch job to a new status"""
+    with db_connection() as conn:
+        conn.execute('''
+            UPDATE batch_jobs
+            SET status = ?, task_id = COALESCE(?, task_id), error_message = COALESCE(?, error_message),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (status, task_id, error_message, job_id))
+        conn.commit()
+
+def record_batch_progress(job_id, planned=False, error_message=None, **increments):
+    """Add to the job's progress counters and complete it once every chunk is accounted for"""
+    assignments = ''.join(
+        f", '$.{name}', COALESCE(json_extract(result, '$.{name}'), 0) + ?" for name in increments
+    )
+    if planned:
+        assignments += ", '$.planned', 1"
+    
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            UPDATE batch_jobs
+            SET result = json_set(COALESCE(result, '{{}}'){assignments}),
+                error_message = COALESCE(?, error_message),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (*increments.values(), error_message, job_id))
+        cursor.execute('''
+            UPDATE batch_jobs
+            SET status = CASE WHEN json_extract(result, '$.chunks_failed') > 0
+                              THEN 'completed_with_errors' ELSE 'completed' END,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'running'
+              AND json_extract(result, '$.planned') = 1
+              AND json_extract(result, '$.chunks_done') + json_extract(result, '$.chunks_failed')
+                  >= json_extract(result, '$.chunks_total')
+        ''', (job_id,))
+        conn.commit()
+
+def record_batch_shards(job_id, shards):
+    """Register (first_id, last_id) shards before they are dispatched so a resumed job can find them"""
+    assignments = ''.join(f", '$.shards.\"{first}\"', ?" for first, _ in shards)
+    with db_connection() as conn:
+        conn.execute(f'''
+            UPDATE batch_jobs
+            SET result = json_set(result, '$.chunks_total', json_extract(result, '$.chunks_total') + ?{assignments}),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (len(shards), *(last for _, last in shards), job_id))
+        conn.commit()
+
+def record_batch_checkpoint(conn, job_id, shard, position):
+    """Move a shard's checkpoint to position inside the caller's transaction"""
+    conn.execute('''
+        UPDATE batch_jobs
+        SET result = json_set(result, '$.checkpoints."' || ? || '"', ?), updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (shard, position, job_id))
+
 # GRAPH GENERATION UTILITIES
-def generate_graph_base64(fig):
-    """Convert matplotlib figure to base64 string"""
+# Figures are rasterized on a small process pool: a render is hundreds of
+# milliseconds of CPU and pyplot is not thread-safe, so it must not run on the
+# request thread. Images are cached in Redis under a hash of the data they
+# were drawn from. That hash is also the ETag, so an unchanged graph costs one
+# query and, for a client that already has it, a 304.
+class GraphPoolSaturated(Exception):
+    """Raised when the graph rendering pool has no capacity left"""
+
+_graph_pool = {'pid': None, 'executor': None}
+_graph_pool_lock = threading.Lock()
+_graph_slots = threading.BoundedSemaphore(GRAPH_RENDER_QUEUE_LIMIT)
+
+def graph_executor():
+    """This process's render pool, created on first use and after a breakage"""
+    if _graph_pool['pid'] != os.getpid() or _graph_pool['executor'] is None:
+        with _graph_pool_lock:
+            if _graph_pool['pid'] != os.getpid() or _graph_pool['executor'] is None:
+                # Workers come from a forkserver: forking this process could copy a
+                # lock held by one of its threads (listener, password pool, senders)
+                _graph_pool['executor'] = ProcessPoolExecutor(
+                    max_workers=GRAPH_RENDER_WORKERS,
+                    mp_context=multiprocessing.get_context('forkserver')
+                )
+                _graph_pool['pid'] = os.getpid()
+    return _graph_pool['executor']
+
+def discard_graph_executor(executor):
+    """Drop a pool whose worker died so the next render starts a fresh one"""
+    with _graph_pool_lock:
+        if _graph_pool['executor'] is executor:
+            _graph_pool['executor'] = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def run_graph_render(fn, data):
+    """Render data with fn on the graph pool
+
+    Raises GraphPoolSaturated when the pool is full or a worker died, and
+    TimeoutError after GRAPH_RENDER_TIMEOUT.
+    """
+    if not _graph_slots.acquire(blocking=False):
+        raise GraphPoolSaturated()
+    executor = None
+    try:
+        executor = graph_executor()
+        future = executor.submit(fn, data)
+    except BrokenProcessPool:
+        _graph_slots.release()
+        discard_graph_executor(executor)
+        raise GraphPoolSaturated()
+    except Exception:
+        _graph_slots.release()
+        raise
+    future.add_done_callback(lambda _: _graph_slots.release())
+    try:
+        return future.result(timeout=GRAPH_RENDER_TIMEOUT)
+    except BrokenProcessPool:
+        logger.error("Graph render worker died, restarting the pool")
+        discard_graph_executor(executor)
+        raise GraphPoolSaturated()
+
+def figure_to_png(fig):
+    """Rasterize a matplotlib figure to PNG bytes"""
     buffer = BytesIO()
     fig.savefig(buffer, format='png', dpi=150, bbox_inches='tight', 
                 facecolor='white', edgecolor='none')
-    buffer.seek(0)
     image_png = buffer.getvalue()
     buffer.close()
     plt.close(fig)
-    return base64.b64encode(image_png).decode('utf-8')
+    return image_png
+
+def render_occupancy_graph(data):
+    """Occupancy dashboard figure for per-lot spot counts, as PNG bytes"""
+    df = pd.DataFrame(data)
+    df['available_spots'] = df['total_spots'] - df['occupied_spots']
+    df['occupancy_rate'] = (df['occupied_spots'] / df['total_spots'] * 100).round(2)
+    
+    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(8, 6))
+    fig.suptitle('Parking Lot Analytics Dashboard', fontsize=12, fontweight='bold', y=0.96)
+    
+    colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FECA57', '#FF9FF3']
+    wedges, texts, autotexts = ax1.pie(df['occupied_spots'], labels=df['prime_location_name'], 
+                                      autopct='%1.1f%%', colors=colors[:len(df)])
+    ax1.set_title('Current Occupancy Distribution', fontweight='bold')
+    
+    x = range(len(df))
+    width = 0.35
+    ax2.bar([i - width/2 for i in x], df['occupied_spots'], width, 
+            label='Occupied', color='#FF6B6B', alpha=0.8)
+    ax2.bar([i + width/2 for i in x], df['available_spots'], width, 
+            label='Available', color='#4ECDC4', alpha=0.8)
+    ax2.set_xlabel('Parking Lots')
+    ax2.set_ylabel('Number of Spots')
+    ax2.set_title('Occupied vs Available Spots', fontweight='bold')
+    ax2.set_xticks(x)
+    ax2.set_xticklabels(df['prime_location_name'], rotation=45, ha='right')
+    ax2.legend()
+    ax2.grid(True, alpha=0.3)
+
+    bars = ax3.bar(df['prime_location_name'], df['occupancy_rate'], 
+                   color=['#FF6B6B' if x > 80 else '#FECA57' if x > 60 else '#4ECDC4' 
+                          for x in df['occupancy_rate']])
+    ax3.set_xlabel('Parking Lots')
+    ax3.set_ylabel('Occupancy Rate (%)')
+    ax3.set_title('Occupancy Rate by Location', fontweight='bold')
+    ax3.set_xticklabels(df['prime_location_name'], rotation=45, ha='right')
+    ax3.grid(True, alpha=0.3)
+    
+    for bar, rate in zip(bars, df['occupancy_rate']):
+        height = bar.get_height()
+        ax3.text(bar.get_x() + bar.get_width()/2., height + 1,
+                f'{rate}%', ha='center', va='bottom', fontweight='bold')
+    
+    total_spots = df['total_spots'].sum()
+    total_occupied = df['occupied_spots'].sum()
+    total_available = total_spots - total_occupied
+    
+    sizes = [total_occupied, total_available]
+    colors_overview = ['#FF6B6B', '#4ECDC4']
+    wedges, texts, autotexts = ax4.pie(sizes, labels=['Occupied', 'Available'], 
+                                      autopct=lambda pct: f'{pct:.1f}%\n({int(pct/100*total_spots)} spots)',
+                                      colors=colors_overview, startangle=90)
+    ax4.set_title(f'Overall System Status\nTotal: {total_spots} spots', fontweight='bold')
+    
+    plt.tight_layout(h_pad=3.0, w_pad=2.5, rect=[0.08, 0.08, 0.92, 0.88])
+    return figure_to_png(fig)
+
+def render_revenue_graph(data):
+    """Revenue dashboard figure for daily reservation totals, as PNG bytes"""
+    df = pd.DataFrame(data)
+    df['date'] = pd.to_datetime(df['date'])
+    
+    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(8, 6))
+    fig.suptitle('Revenue Analytics Dashboard', fontsize=14, fontweight='bold', y=0.98)
+    
+    ax1.plot(df['date'], df['revenue'], marker='o', linewidth=2, 
+            color='#4ECDC4', markersize=4)
+    ax1.set_xlabel('Date')
+    ax1.set_ylabel('Revenue ($)')
+    ax1.set_title('Daily Revenue Trend (Last 30 Days)', fontweight='bold')
+    ax1.grid(True, alpha=0.3)
+    ax1.tick_params(axis='x', rotation=45)
+    
+    ax2.scatter(df['reservations'], df['revenue'], alpha=0.6, 
+               color='#FF6B6B', s=50)
+    ax2.set_xlabel('Number of Reservations')
+    ax2.set_ylabel('Revenue ($)')
+    ax2.set_title('Reservations vs Revenue Correlation', fontweight='bold')
+    ax2.grid(True, alpha=0.3)
+    
+    z = np.polyfit(df['reservations'], df['revenue'], 1)
+    p = np.poly1d(z)
+    ax2.plot(df['reservations'], p(df['reservations']), "r--", alpha=0.8)
+    
+    df['week'] = df['date'].dt.isocalendar().week
+    weekly_revenue = df.groupby('week')['revenue'].sum().reset_index()
+    
+    bars = ax3.bar(range(len(weekly_revenue)), weekly_revenue['revenue'], 
+                  color='#45B7D1', alpha=0.8)
+    ax3.set_xlabel('Week')
+    ax3.set_ylabel('Total Revenue ($)')
+    ax3.set_title('Weekly Revenue Comparison', fontweight='bold')
+    ax3.grid(True, alpha=0.3)
+    
+    for bar, revenue in zip(bars, weekly_revenue['revenue']):
+        height = bar.get_height()
+        ax3.text(bar.get_x() + bar.get_width()/2., height + 5,
+                f'${revenue:.0f}', ha='center', va='bottom', fontweight='bold')
+    
+    ax4.hist(df['revenue'], bins=10, color='#96CEB4', alpha=0.7, edgecolor='black')
+    ax4.set_xlabel('Revenue ($)')
+    ax4.set_ylabel('Frequency')
+    ax4.set_title('Daily Revenue Distribution', fontweight='bold')
+    ax4.grid(True, alpha=0.3)
+    
+    plt.tight_layout(h_pad=3.0, w_pad=2.5, rect=[0.08, 0.08, 0.92, 0.88])
+    return figure_to_png(fig)
+
+def graph_content_hash(name, data):
+    """Hash of everything a graph image depends on"""
+    payload = json.dumps([GRAPH_RENDER_VERSION, name, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def get_graph_png(name, renderer, data, digest):
+    """PNG for the graph, from the cache or rendered on the pool"""
+    # The shared client decodes responses, so the image is kept base64-encoded
+    cache_key_name = f"{GRAPH_CACHE_KEY_PREFIX}:{name}:{digest}"
+    try:
+        cached_png = redis_client.get(cache_key_name)
+        if cached_png:
+            return base64.b64decode(cached_png)
+    except redis.RedisError as e:
+        logger.warning(f"Graph cache read error: {e}")
+    
+    png = run_graph_render(renderer, data)
+    try:
+        redis_client.setex(cache_key_name, GRAPH_CACHE_TTL, base64.b64encode(png).decode('ascii'))
+    except redis.RedisError as e:
+        logger.warning(f"Graph cache write error: {e}")
+    return png
+
+def wants_png():
+    """True when the client asked for the raw image (?format=png or Accept: image/png)"""
+    if request.args.get('format'):
+        return request.args.get('format') == 'png'
+    return request.accept_mimetypes.best_match(['application/json', 'image/png']) == 'image/png'
+
+def graph_response(name, renderer, data, summary):
+    """The {graph, data, summary} JSON by default, raw PNG on request; both with a content-hash ETag"""
+    digest = graph_content_hash(name, data)
+    png = wants_png()
+    etag = digest if png else f"{digest}-json"
+    
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    elif png:
+        response = make_response(get_graph_png(name, renderer, data, digest))
+        response.headers['Content-Type'] = 'image/png'
+    else:
+        response = jsonify({
+            'graph': base64.b64encode(get_graph_png(name, renderer, data, digest)).decode('utf-8'),
+            'data': data,
+            'summary': summary
+        })
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    # Admin-only data: browsers may keep it but must revalidate every time
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 # CELERY BACKGROUND TASKS
 @celery.task(bind=True)
 def cleanup_expired_reservations(self):
+    """Expire bookings that were never parked within RESERVATION_EXPIRY_HOURS"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        expiry_time = datetime.now() - timedelta(hours=24)
-        cursor.execute('''
-            SELECT r.id, r.spot_id FROM reservations r
-            WHERE r.status = 'active' 
-            AND r.parking_timestamp IS NULL 
-            AND r.created_at < ?
-        ''', (expiry_time,))
-        
-        expired_reservations = cursor.fetchall()
-        
-        if expired_reservations:
-            reservation_ids = [r[0] for r in expired_reservations]
-            spot_ids = [r[1] for r in expired_reservations]
-            cursor.executemany(
-                'UPDATE reservations SET status = "expired" WHERE id = ?',
-                [(rid,) for rid in reservation_ids]
+        # idx_reservations_pending only holds unparked active bookings in
+        # created_at order, and expired rows drop out of it. Reading it from the
+        # oldest entry visits exactly the bookings past their deadline, so a
+        # tick costs nothing more than the expirations it handles. The planner
+        # is pinned to it: idx_reservations_created_at would walk every old row.
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT r.id, r.spot_id, ps.lot_id, ps.spot_number, r.user_id
+                FROM reservations r INDEXED BY idx_reservations_pending
+                JOIN parking_spots ps ON r.spot_id = ps.id
+                WHERE r.status = 'active' 
+                AND r.parking_timestamp IS NULL 
+                AND r.created_at < datetime('now', ?)
+                ORDER BY r.created_at
+                LIMIT ?
+            ''', (f'-{RESERVATION_EXPIRY_HOURS} hours', RESERVATION_EXPIRY_BATCH_SIZE))
+            expired_reservations = cursor.fetchall()
+            
+            if not expired_reservations:
+                conn.rollback()
+                return "Cleaned up 0 expired reservations"
+            
+            reservation_ids = json.dumps([r[0] for r in expired_reservations])
+            spot_ids = json.dumps([r[1] for r in expired_reservations])
+            cursor.execute(
+                "UPDATE reservations SET status = 'expired' WHERE id IN (SELECT value FROM json_each(?))",
+                (reservation_ids,)
             )
-            cursor.executemany(
-                'UPDATE parking_spots SET status = "A" WHERE id = ?',
-                [(sid,) for sid in spot_ids]
+            cursor.execute(
+                "UPDATE parking_spots SET status = 'A' WHERE id IN (SELECT value FROM json_each(?))",
+                (spot_ids,)
             )
-            
             conn.commit()
-            
-            invalidate_cache_pattern('*parking_lots*')
-            invalidate_cache_pattern('*analytics*')
-            logger.info(f"Cleaned up {len(expired_reservations)} expired reservations")            
-        conn.close()
+        
+        for _, spot_id, lot_id, spot_number, user_id in expired_reservations:
+            release_free_spot(lot_id, spot_id, spot_number)
+            clear_active_reservation(user_id)
+        
+        # Only the lots and users whose bookings expired
+        touched_tags = {f'lot:{r[2]}' for r in expired_reservations} | {f'user:{r[4]}' for r in expired_reservations}
+        invalidate_cache_tags(*sorted(touched_tags))
+        logger.info(f"Cleaned up {len(expired_reservations)} expired reservations")
         return f"Cleaned up {len(expired_reservations)} expired reservations"
         
     except Exception as e:
@@ -900,41 +3108,207 @@ def cleanup_expired_reservations(self):
         raise
 
 @celery.task(bind=True)
-def generate_daily_report(self, date_str=None): #parking
+def persist_reservation_claims(self):
+    """Write-behind persistence of Redis reservation claims to SQLite"""
     try:
-        if not date_str:
-            date_str = datetime.now().strftime('%Y-%m-%d')
+        # One drainer at a time keeps queue order and makes replays detectable
+        if not redis_client.set(RESERVATION_CLAIM_DRAIN_LOCK_KEY, 1, nx=True, ex=60):
+            return "Reservation claims are already being persisted"
         
-        conn = get_db()
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
+        total_persisted = 0
+        total_conflicts = 0
+        touched_tags = set()
+        try:
+            while True:
+                user_ids = redis_client.lrange(RESERVATION_CLAIM_QUEUE_KEY, 0, RESERVATION_CLAIM_BATCH_SIZE - 1)
+                if not user_ids:
+                    break
+                
+                claims = redis_client.hmget(RESERVATION_CLAIMS_KEY, user_ids)
+                persisted, conflicts = persist_claim_batch(zip(user_ids, claims))
+                settle_claims(persisted, conflicts)
+                redis_client.ltrim(RESERVATION_CLAIM_QUEUE_KEY, len(user_ids), -1)
+                redis_client.expire(RESERVATION_CLAIM_DRAIN_LOCK_KEY, 60)
+                
+                total_persisted += len(persisted)
+                total_conflicts += len(conflicts)
+                for claim in persisted + conflicts:
+                    touched_tags.update((f"lot:{claim['lot_id']}", f"user:{claim['user_id']}"))
+                
+                try:
+                    notify_persisted_claims(persisted)
+                except Exception as e:
+                    logger.error(f"Error sending reservation confirmations: {e}")
+                try:
+                    notify_rejected_claims(conflicts)
+                except Exception as e:
+                    logger.error(f"Error sending rejected reservation notices: {e}")
+        finally:
+            redis_client.delete(RESERVATION_CLAIM_DRAIN_LOCK_KEY)
         
-        cursor.execute('''
-            SELECT 
-                COUNT(*) as total_reservations,
-                SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed_reservations,
-                SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END) as active_reservations,
-                SUM(CASE WHEN status = 'expired' THEN 1 ELSE 0 END) as expired_reservations,
-                COALESCE(SUM(parking_cost), 0) as total_revenue
-            FROM reservations 
-            WHERE DATE(created_at) = ?
-        ''', (date_str,))
+        if touched_tags:
+            invalidate_cache_tags(*sorted(touched_tags))
+            logger.info(f"Persisted {total_persisted} reservation claims, rejected {total_conflicts}")
+        return f"Persisted {total_persisted} reservation claims, rejected {total_conflicts}"
         
-        daily_stats = cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Error in persist_reservation_claims: {e}")
+        raise
+
+# Results are never read; skipping the result backend keeps the kick cheap
+@celery.task(bind=True, ignore_result=True)
+def deliver_outbox_emails(self):
+    """Send due outbox emails on a small pool of sender threads"""
+    try:
+        total_sent = 0
+        total_failed = 0
+        emails = claim_outbox_batch(EMAIL_OUTBOX_BATCH_SIZE)
+        if not emails:
+            return "No emails due"
         
-        cursor.execute('''
-            SELECT 
-                pl.prime_location_name,
-                COUNT(r.id) as reservations_count,
-                COALESCE(SUM(r.parking_cost), 0) as revenue
-            FROM parking_lots pl
-            LEFT JOIN parking_spots ps ON pl.id = ps.lot_id
-            LEFT JOIN reservations r ON ps.id = r.spot_id AND DATE(r.created_at) = ?
-            GROUP BY pl.id, pl.prime_location_name
-            ORDER BY reservations_count DESC
-        ''', (date_str,))
+        # Local development relies on MailHog; a live pooled session proves it is up
+        if not smtp_pool.has_idle_sessions():
+            ensure_mailhog_running()
+        
+        try:
+            with ThreadPoolExecutor(max_workers=EMAIL_SENDER_WORKERS, thread_name_prefix='email-sender') as pool:
+                for batch in range(EMAIL_OUTBOX_MAX_BATCHES):
+                    if batch:
+                        emails = claim_outbox_batch(EMAIL_OUTBOX_BATCH_SIZE)
+                        if not emails:
+                            break
+                    
+                    # One chunk per sender thread, each sent over a single SMTP session
+                    chunks = [emails[i::EMAIL_SENDER_WORKERS] for i in range(min(EMAIL_SENDER_WORKERS, len(emails)))]
+                    errors = pool.map(send_outbox_batch, chunks)
+                    ordered = [email for chunk in chunks for email in chunk]
+                    sent, failed = record_outbox_results(ordered, [error for chunk in errors for error in chunk])
+                    total_sent += sent
+                    total_failed += failed
+        finally:
+            flush_email_stats()
+        
+        logger.info(f"Email outbox: sent {total_sent}, failed {total_failed}")
+        return f"Sent {total_sent} emails, {total_failed} failed"
+        
+    except Exception as e:
+        logger.error(f"Error in deliver_outbox_emails: {e}")
+        raise
+
+@celery.task(bind=True)
+def fan_out_new_lot_notifications(self, job_id):
+    """Page through users by id and hand each chunk of recipients to its own task"""
+    try:
+        job = get_batch_job(job_id)
+        if not job or job['status'] not in ('pending', 'failed'):
+            return f"Batch job {job_id} is not pending"
+        set_batch_job_status(job_id, 'running', task_id=self.request.id)
+        
+        last_id = 0
+        recipients = 0
+        while True:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id FROM users
+                    WHERE is_admin = 0 AND email IS NOT NULL AND email != '' AND id > ?
+                    ORDER BY id
+                    LIMIT ?
+                ''', (last_id, NEW_LOT_NOTIFICATION_PAGE_SIZE))
+                user_ids = [row[0] for row in cursor.fetchall()]
+            if not user_ids:
+                break
+            
+            chunks = [
+                user_ids[i:i + NEW_LOT_NOTIFICATION_CHUNK_SIZE]
+                for i in range(0, len(user_ids), NEW_LOT_NOTIFICATION_CHUNK_SIZE)
+            ]
+            # Count the chunks before dispatching so a fast chunk can't complete the job early
+            record_batch_progress(job_id, chunks_total=len(chunks), recipients=len(user_ids))
+            for chunk in chunks:
+                send_new_lot_notification_chunk.delay(job_id, chunk[0], chunk[-1])
+            
+            recipients += len(user_ids)
+            last_id = user_ids[-1]
+        
+        record_batch_progress(job_id, planned=True)
+        logger.info(f"Batch job {job_id}: fanned out new lot notifications to {recipients} users")
+        return f"Dispatched notifications for {recipients} users"
+        
+    except Exception as e:
+        logger.error(f"Error in fan_out_new_lot_notifications for job {job_id}: {e}")
+        set_batch_job_status(job_id, 'failed', error_message=str(e))
+        raise
+
+@celery.task(bind=True)
+def send_new_lot_notification_chunk(self, job_id, first_user_id, last_user_id):
+    """Queue new lot notifications for the users in one id range"""
+    try:
+        job = get_batch_job(job_id)
+        lot = job['parameters']
+        
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, username, email FROM users
+                WHERE is_admin = 0 AND email IS NOT NULL AND email != '' AND id BETWEEN ? AND ?
+                ORDER BY id
+            ''', (first_user_id, last_user_id))
+            users = cursor.fetchall()
+        
+        notifications = []
+        for user_id, username, email in users:
+            subject, body = render_notification('new_lot', {'username': username, 'lot': lot})
+            notifications.append({
+                'to_email': email,
+                'subject': subject,
+                'body': body,
+                'email_type': 'new_lot',
+                'user_id': user_id,
+                # dedup keys make a retried chunk a no-op for users it already covered
+                'dedup_key': f"new_lot:{lot['lot_id']}:{user_id}",
+            })
+        queued = queue_emails(notifications)
+        
+        record_batch_progress(job_id, chunks_done=1, queued=queued)
+        return f"Queued {queued} new lot notifications"
+        
+    except Exception as e:
+        logger.error(f"Error in new lot notification chunk {first_user_id}-{last_user_id} of job {job_id}: {e}")
+        record_batch_progress(job_id, chunks_failed=1, error_message=str(e))
+        raise
+
+@celery.task(bind=True)
+def generate_daily_report(self, date_str=None): #parking
+    """Daily summary and per-lot statistics, read from the daily_lot_stats rollup"""
+    try:
+        if not date_str:
+            date_str = datetime.now().strftime('%Y-%m-%d')
         
-        lot_stats = cursor.fetchall()
+        with db_connection(dict_factory) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    COALESCE(SUM(reservations), 0) as total_reservations,
+                    COALESCE(SUM(completed), 0) as completed_reservations,
+                    COALESCE(SUM(active), 0) as active_reservations,
+                    COALESCE(SUM(expired), 0) as expired_reservations,
+                    COALESCE(SUM(revenue), 0) as total_revenue
+                FROM daily_lot_stats
+                WHERE day = ?
+            ''', (date_str,))
+            daily_stats = cursor.fetchone()
+            
+            cursor.execute('''
+                SELECT 
+                    pl.prime_location_name,
+                    COALESCE(d.reservations, 0) as reservations_count,
+                    COALESCE(d.revenue, 0) as revenue
+                FROM parking_lots pl
+                LEFT JOIN daily_lot_stats d ON d.day = ? AND d.lot_id = pl.id
+                ORDER BY reservations_count DESC
+            ''', (date_str,))
+            lot_stats = cursor.fetchall()
         
         report = {
             'date': date_str,
@@ -945,7 +3319,6 @@ def generate_daily_report(self, date_str=None): #parking
         report_key = f"daily_report:{date_str}"
         redis_client.setex(report_key, 86400, json.dumps(report, default=str))
         
-        conn.close()
         logger.info(f"Generated daily report for {date_str}")
         return report
         
@@ -1013,198 +3386,169 @@ def optimize_parking_allocation(self):
         logger.error(f"Error in parking optimization: {e}")
         raise
 
+# Users whose reminder is due and who haven't had one today. A user gets at
+# most one of the two daily emails, both deduplicated on the same key, so the
+# anti-join against email_outbox skips everyone already handled today.
+# Only users who will actually get an email match: nobody who booked today,
+# and, while no lot has free spots, only inactive users. Anyone else would be
+# selected again on every run without ever getting an outbox row.
+DUE_DAILY_REMINDER_USERS_SQL = '''
+    FROM users u
+    LEFT JOIN user_preferences up
+        ON up.id = (SELECT MAX(id) FROM user_preferences WHERE user_id = u.id)
+    WHERE u.is_admin = 0 AND u.email IS NOT NULL AND u.email != ''
+        AND COALESCE(up.reminder_enabled, 1) = 1
+        AND COALESCE(up.reminder_time, ?) <= ?
+        AND NOT EXISTS (
+            SELECT 1 FROM email_outbox eo
+            WHERE eo.dedup_key = 'daily_reminder:' || u.id || ':' || ?
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM reservations r
+            WHERE r.user_id = u.id AND r.created_at >= ?
+        )
+        AND (? OR NOT EXISTS (
+            SELECT 1 FROM reservations r
+            WHERE r.user_id = u.id AND r.created_at >= ?
+        ))
+'''
+
+def daily_reminder_filter_params(parameters):
+    """Bind values for DUE_DAILY_REMINDER_USERS_SQL"""
+    return (
+        DAILY_REMINDER_DEFAULT_TIME, parameters['due_by'], parameters['date'], parameters['day_started_at'],
+        bool(parameters['available_lots']), parameters['inactive_before'],
+    )
+
 @celery.task(bind=True)
 def send_daily_reminders(self):
+    """Page through users whose reminder is due and hand them to parallel chunk tasks"""
+    job_id = None
     try:
-        logger.info("🔄 Starting daily reminder job...")
-        
-        conn = get_db()
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        # Fetch users who have opted in for reminders
-        cursor.execute('''
-            SELECT 
-                u.id, u.username, u.email, u.phone,
-                up.reminder_enabled, up.notification_method,
-                up.reminder_time
-            FROM users u
-            LEFT JOIN user_preferences up ON u.id = up.user_id
-            WHERE u.is_admin = 0 AND u.email IS NOT NULL AND u.email != ''
-            AND (up.reminder_enabled = 1 OR up.reminder_enabled IS NULL)
-        ''')
-        users = cursor.fetchall()
-        seven_days_ago = datetime.now() - timedelta(days=7)
-        inactive_users = []
-        sent_count = 0
-        
-        # Find users who haven'ot made reservations in the last 7 days
-        for user in users:
+        with db_connection(dict_factory) as conn:
+            cursor = conn.cursor()
+            # One clock for every cutoff. Reminder times and the dedup date are
+            # local; created_at is UTC, so the start of the local day and the
+            # inactivity cutoff are converted to UTC.
             cursor.execute('''
-                SELECT COUNT(*) as recent_count
-                FROM reservations 
-                WHERE user_id = ? AND created_at >= ?
-            ''', (user['id'], seven_days_ago))
+                SELECT 
+                    DATE('now', 'localtime') as date,
+                    strftime('%H:%M', 'now', 'localtime') as due_by,
+                    datetime('now', 'localtime', 'start of day', 'utc') as day_started_at,
+                    datetime('now', ?) as inactive_before
+            ''', (f'-{DAILY_REMINDER_INACTIVE_DAYS} days',))
+            parameters = cursor.fetchone()
             
-            recent_reservations = cursor.fetchone()['recent_count']
+            cursor.execute('''
+                SELECT 
+                    pl.id, pl.prime_location_name as location_name, 
+                    pl.address, pl.price, pl.maximum_number_of_spots,
+                    COUNT(CASE WHEN ps.status = 'A' THEN 1 END) as available_slots
+                FROM parking_lots pl
+                LEFT JOIN parking_spots ps ON pl.id = ps.lot_id
+                GROUP BY pl.id, pl.prime_location_name, pl.address, pl.price, pl.maximum_number_of_spots
+                HAVING available_slots > 0
+                ORDER BY available_slots DESC
+                LIMIT 5
+            ''')
+            parameters['available_lots'] = cursor.fetchall()
+        
+        last_id = 0
+        recipients = 0
+        while True:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT u.id
+                    {DUE_DAILY_REMINDER_USERS_SQL}
+                        AND u.id > ?
+                    ORDER BY u.id
+                    LIMIT ?
+                ''', (*daily_reminder_filter_params(parameters), last_id, DAILY_REMINDER_PAGE_SIZE))
+                user_ids = [row[0] for row in cursor.fetchall()]
+            if not user_ids:
+                break
+            
+            if job_id is None:
+                # Most runs find nobody due; only real work gets a batch job
+                job_id = create_batch_job('daily_reminders', parameters)
+                set_batch_job_status(job_id, 'running', task_id=self.request.id)
+            
+            chunks = [
+                user_ids[i:i + DAILY_REMINDER_CHUNK_SIZE]
+                for i in range(0, len(user_ids), DAILY_REMINDER_CHUNK_SIZE)
+            ]
+            record_batch_progress(job_id, chunks_total=len(chunks), recipients=len(user_ids))
+            for chunk in chunks:
+                send_daily_reminder_chunk.delay(job_id, chunk[0], chunk[-1])
             
-            if recent_reservations == 0:
-                inactive_users.append(user)
-        
-        # Ftesting: if no inactive users
-        if len(inactive_users) == 0 and len(users) > 0:
-            inactive_users = users[:3]  # Take first 3 users for testing
-            logger.info(f"No inactive users found, using first {len(inactive_users)} users for testing")
-        
-        # gets available parking lots
-        cursor.execute('''
-            SELECT 
-                pl.id, pl.prime_location_name as location_name, 
-                pl.address, pl.price, pl.maximum_number_of_spots,
-                COUNT(CASE WHEN ps.status = 'A' THEN 1 END) as available_slots
-            FROM parking_lots pl
-            LEFT JOIN parking_spots ps ON pl.id = ps.lot_id
-            GROUP BY pl.id, pl.prime_location_name, pl.address, pl.price, pl.maximum_number_of_spots
-            HAVING available_slots > 0
-            ORDER BY available_slots DESC
-            LIMIT 5
-        ''')
+            recipients += len(user_ids)
+            last_id = user_ids[-1]
         
-        available_lots = cursor.fetchall()
-        
-        # Send reminders to inactive users
-        for user in inactive_users:
-            subject = "Parking Reminder - Book Your Spot Today! 🚗"
-            
-            body = f"""
-            <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                    <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                        <h1 style="margin: 0; font-size: 28px;">🚗 Parking Reminder</h1>
-                    </div>
-                    
-                    <div style="background: white; padding: 30px; border: 1px solid #ddd; border-radius: 0 0 10px 10px;">
-                        <h2 style="color: #667eea; margin-top: 0;">Hello {user['username']}!</h2>
-                        
-                        <p>We noticed you haven't booked a parking spot recently. Don't miss out on securing your parking space!</p>
-                        
-                        <div style="background: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                            <h3 style="color: #495057; margin-top: 0;">🅿️ Available Parking Lots</h3>
-            """
-            
-            for i, lot in enumerate(available_lots[:3]):  # Show top 3 lots
-                body += f"""
-                            <div style="border-left: 4px solid #667eea; padding-left: 15px; margin: 15px 0;">
-                                <h4 style="margin: 0; color: #333;">{lot['location_name']}</h4>
-                                <p style="margin: 5px 0; color: #666;"><strong>📍 Address:</strong> {lot['address']}</p>
-                                <p style="margin: 5px 0; color: #666;"><strong>💰 Price:</strong> ${lot['price']}/hour</p>
-                                <p style="margin: 5px 0; color: #666;"><strong>🚗 Available Spots:</strong> {lot['available_slots']}/{lot['maximum_number_of_spots']}</p>
-                            </div>
-                """
-            
-            body += """
-                        </div>
-                        
-                        <div style="background: #e8f4f8; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                            <h3 style="color: #0c5460; margin-top: 0;">📅 Quick Booking Tips</h3>
-                            <ul style="color: #0c5460;">
-                                <li>Book in advance to guarantee your spot</li>
-                                <li>Check availability during peak hours</li>
-                                <li>Save time with our quick booking feature</li>
-                            </ul>
-                        </div>
-                        
-                        <div style="text-align: center; margin-top: 30px;">
-                            <p style="font-size: 16px; color: #667eea; font-weight: bold;">Book your parking spot now to secure your place!</p>
-                            <p style="color: #6c757d; font-size: 14px;">
-                                Best regards,<br>
-                                <strong>Parking Management Team</strong>
-                            </p>
-                        </div>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
-            
-            if send_email(user['email'], subject, body):
-                sent_count += 1
-                logger.info(f"Sent reminder email to {user['username']} ({user['email']})")
+        if job_id is None:
+            return "No daily reminders due"
         
-        active_users = [user for user in users if user not in inactive_users]
+        record_batch_progress(job_id, planned=True)
+        logger.info(f"Daily reminders: dispatched {recipients} users in batch job {job_id}")
+        return f"Dispatched daily reminders for {recipients} users"
         
-        # For testing: if we have fewer than 2 active users
-        if len(active_users) < 2 and len(users) > len(inactive_users):
-            active_users = users[len(inactive_users):len(inactive_users)+2]  # Take next 2 users
-            logger.info(f"Using {len(active_users)} users for active user notifications")
+    except Exception as e:
+        logger.error(f"❌ Daily reminder job failed: {str(e)}")
+        if job_id is not None:
+            set_batch_job_status(job_id, 'failed', error_message=str(e))
+        raise
+
+@celery.task(bind=True)
+def send_daily_reminder_chunk(self, job_id, first_user_id, last_user_id):
+    """Queue the daily reminder or availability email for one id range of due users"""
+    try:
+        parameters = get_batch_job(job_id)['parameters']
+        available_lots = parameters['available_lots']
         
-        for user in active_users[:5]:  # Limit to 5 active users to avoid spam
-            # Check if they have active reservations today
-            cursor.execute('''
-                SELECT COUNT(*) as today_count
-                FROM reservations 
-                WHERE user_id = ? AND DATE(created_at) = DATE('now')
-            ''', (user['id'],))
-            
-            today_bookings = cursor.fetchone()['today_count']
-            
-            # only to users who haven't booked today, if today_bookings == 0 and available_lots:
-            if available_lots:  # for testing
-                subject = "New Parking Opportunities Available! 🅿️"
-                
-                body = f"""
-                <html>
-                <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                    <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                        <div style="background: linear-gradient(135deg, #56ab2f 0%, #a8e6cf 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                            <h1 style="margin: 0; font-size: 28px;">🅿️ Great Parking Options</h1>
-                        </div>
-                        
-                        <div style="background: white; padding: 30px; border: 1px solid #ddd; border-radius: 0 0 10px 10px;">
-                            <h2 style="color: #56ab2f; margin-top: 0;">Hello {user['username']}!</h2>
-                            
-                            <p>Great news! We have excellent parking lots available with plenty of spots:</p>
-                            
-                            <div style="background: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                                <h3 style="color: #495057; margin-top: 0;">🏢 Available Locations</h3>
-                """
-                
-                for lot in available_lots[:2]:
-                    body += f"""
-                                <div style="border-left: 4px solid #56ab2f; padding-left: 15px; margin: 15px 0;">
-                                    <h4 style="margin: 0; color: #333;">{lot['location_name']}</h4>
-                                    <p style="margin: 5px 0; color: #666;"><strong>📍 Address:</strong> {lot['address']}</p>
-                                    <p style="margin: 5px 0; color: #666;"><strong>💰 Price:</strong> ${lot['price']}/hour</p>
-                                    <p style="margin: 5px 0; color: #666;"><strong>🚗 Available Now:</strong> {lot['available_slots']} spots</p>
-                                </div>
-                    """
-                
-                body += """
-                            </div>
-                            
-                            <div style="text-align: center; margin-top: 30px;">
-                                <p style="font-size: 16px; color: #56ab2f; font-weight: bold;">Check out these locations and book your spot today!</p>
-                                <p style="color: #6c757d; font-size: 14px;">
-                                    Best regards,<br>
-                                    <strong>Parking Management Team</strong>
-                                </p>
-                            </div>
-                        </div>
-                    </div>
-                </body>
-                </html>
-                """
-                
-                if send_email(user['email'], subject, body):
-                    sent_count += 1
-                    logger.info(f"Sent availability notification to {user['username']} ({user['email']})")
+        # Every due user gets one of the two emails; the last booking per user
+        # comes from idx_reservations_user_created, one probe per user
+        with db_connection(dict_factory) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, username, email,
+                    last_reservation_at IS NULL OR last_reservation_at < ? as inactive
+                FROM (
+                    SELECT u.id, u.username, u.email,
+                        (SELECT MAX(r.created_at) FROM reservations r WHERE r.user_id = u.id) as last_reservation_at
+                    {DUE_DAILY_REMINDER_USERS_SQL}
+                        AND u.id BETWEEN ? AND ?
+                )
+                ORDER BY id
+            ''', (parameters['inactive_before'], *daily_reminder_filter_params(parameters), first_user_id, last_user_id))
+            users = cursor.fetchall()
         
-        conn.close()
-        logger.info(f"✅ Daily reminder job completed. Sent {sent_count} emails.")
-        return f"Sent {sent_count} reminder emails successfully"
+        notifications = []
+        for user in users:
+            if user['inactive']:
+                template, email_type = 'daily_reminder', 'daily_reminder'
+            else:
+                template, email_type = 'availability_notification', 'availability_notification'
+            
+            subject, body = render_notification(template, {
+                'username': user['username'],
+                'lots': available_lots,
+            })
+            notifications.append({
+                'to_email': user['email'],
+                'subject': subject,
+                'body': body,
+                'email_type': email_type,
+                'user_id': user['id'],
+                'dedup_key': f"daily_reminder:{user['id']}:{parameters['date']}",
+            })
+        queued = queue_emails(notifications)
+        
+        record_batch_progress(job_id, chunks_done=1, queued=queued)
+        return f"Queued {queued} daily reminder emails"
         
     except Exception as e:
-        logger.error(f"❌ Daily reminder job failed: {str(e)}")
+        logger.error(f"Error in daily reminder chunk {first_user_id}-{last_user_id} of job {job_id}: {e}")
+        record_batch_progress(job_id, chunks_failed=1, error_message=str(e))
         raise
 
 @celery.task(bind=True)
@@ -1231,48 +3575,13 @@ def send_test_daily_reminders(self):
         logger.info(f"Found {len(users)} users for testing")
         
         for user in users:
-            subject = "🔔 TEST Daily Parking Reminder!"
-            
-            body = f"""
-            <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                    <div style="background: linear-gradient(135deg, #ff6b35 0%, #f7931e 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                        <h1 style="margin: 0; font-size: 28px;">🔔 TEST Reminder</h1>
-                    </div>
-                    
-                    <div style="background: white; padding: 30px; border: 1px solid #ddd; border-radius: 0 0 10px 10px;">
-                        <h2 style="color: #ff6b35; margin-top: 0;">Hello {user['username']}! 👋</h2>
-                        
-                        <p><strong>This is a TEST email to verify the scheduled email system is working!</strong></p>
-                        
-                        <div style="background: #e8f4f8; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                            <h3 style="color: #0c5460; margin-top: 0;">✅ System Status</h3>
-                            <ul style="color: #0c5460;">
-                                <li>Celery Beat Scheduler: ✅ Running</li>
-                                <li>Email System: ✅ Working</li>
-                                <li>Database: ✅ Connected</li>
-                                <li>MailHog: ✅ Receiving</li>
-                            </ul>
-                        </div>
-                        
-                        <div style="text-align: center; margin-top: 30px;">
-                            <p style="font-size: 14px; color: #666;">
-                                Test sent at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}<br>
-                                <strong>Parking Management System</strong>
-                            </p>
-                        </div>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
-            
-            if send_email(user['email'], subject, body):
+            subject, body = render_notification('test_reminder', {'username': user['username']})
+            
+            if queue_email(user['email'], subject, body, email_type='test_reminder', user_id=user['id']):
                 sent_count += 1
-                logger.info(f"✅ Sent TEST email to {user['username']} ({user['email']})")
+                logger.info(f"✅ Queued TEST email to {user['username']} ({user['email']})")
             else:
-                logger.error(f"❌ Failed to send TEST email to {user['username']} ({user['email']})")
+                logger.error(f"❌ Failed to queue TEST email to {user['username']} ({user['email']})")
         
         conn.close()
         logger.info(f"🎉 TEST daily reminder completed. Sent {sent_count} emails.")
@@ -1282,218 +3591,257 @@ def send_test_daily_reminders(self):
         logger.error(f"❌ TEST daily reminder failed: {str(e)}")
         raise
 
+# Users with bookings in the report month and no report queued for it yet.
+# created_at is compared as a plain range so idx_reservations_user_created
+# answers the EXISTS probe instead of scanning every reservation.
+MONTHLY_REPORT_USERS_SQL = '''
+    FROM users u
+    WHERE u.is_admin = 0 AND u.email IS NOT NULL AND u.email != ''
+        AND (? IS NULL OR u.id = ?)
+        AND EXISTS (
+            SELECT 1 FROM reservations r
+            WHERE r.user_id = u.id AND r.created_at >= ? AND r.created_at < ?
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM email_outbox eo
+            WHERE eo.dedup_key = 'monthly_report:' || u.id || ':' || ?
+        )
+'''
+
+def monthly_report_parameters(month, year, user_id=None):
+    """Batch job parameters for one report month, with its created_at range"""
+    month, year = int(month), int(year)
+    user_id = int(user_id) if user_id else None
+    return {
+        'period': f"{year}-{month:02d}",
+        'month': month,
+        'year': year,
+        'user_id': user_id,
+        'start': f"{year}-{month:02d}-01",
+        'end': f"{year + month // 12}-{month % 12 + 1:02d}-01",
+    }
+
+def monthly_report_filter_params(parameters):
+    """Bind values for MONTHLY_REPORT_USERS_SQL"""
+    return (parameters['user_id'], parameters['user_id'], parameters['start'], parameters['end'], parameters['period'])
+
+def find_monthly_report_job(parameters):
+    """Latest unfinished report job for the same month and user filter, or None"""
+    with db_connection(dict_factory) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, status, updated_at < datetime('now', ?) as stale
+            FROM batch_jobs
+            WHERE job_type = 'monthly_reports' AND status != 'completed'
+                AND json_extract(parameters, '$.period') = ?
+                AND json_extract(parameters, '$.user_id') IS ?
+            ORDER BY id DESC
+            LIMIT 1
+        ''', (f'-{MONTHLY_REPORT_STALE_AFTER} seconds', parameters['period'], parameters['user_id']))
+        return cursor.fetchone()
+
+def summarize_monthly_activity(rows):
+    """Fold (user, lot, day) activity rows into one report context per user"""
+    reports = OrderedDict()
+    for row in rows:
+        report = reports.get(row['user_id'])
+        if report is None:
+            report = reports[row['user_id']] = {
+                'user_id': row['user_id'],
+                'username': row['username'],
+                'email': row['email'],
+                'stats': {'total_bookings': 0, 'completed_bookings': 0, 'total_spent': 0},
+                'lots': {},
+                'days': OrderedDict(),
+                'duration_hours': 0,
+                'timed_bookings': 0,
+            }
+        stats = report['stats']
+        stats['total_bookings'] += row['bookings']
+        stats['completed_bookings'] += row['completed_bookings']
+        stats['total_spent'] += row['total_spent']
+        report['duration_hours'] += row['duration_hours'] or 0
+        report['timed_bookings'] += row['timed_bookings']
+        report['days'][row['date']] = report['days'].get(row['date'], 0) + row['bookings']
+        if row['lot_id'] is not None:
+            lot = report['lots'].setdefault(row['lot_id'], {
+                'prime_location_name': row['prime_location_name'],
+                'usage_count': 0,
+            })
+            lot['usage_count'] += row['bookings']
+    
+    for report in reports.values():
+        duration_hours, timed_bookings = report.pop('duration_hours'), report.pop('timed_bookings')
+        report['stats']['avg_duration_hours'] = duration_hours / timed_bookings if timed_bookings else None
+        lots = report.pop('lots')
+        report['most_used_lot'] = max(lots.values(), key=lambda lot: lot['usage_count']) if lots else None
+        report['daily_usage'] = [
+            {'date': day, 'bookings': bookings} for day, bookings in sorted(report.pop('days').items())
+        ]
+    return list(reports.values())
+
 @celery.task(bind=True)
 def generate_monthly_activity_report(self, user_id=None, month=None, year=None):
-    """Generate monthly activity report for user(s)"""
+    """Shard the month's active users across chunk tasks, resuming an interrupted run"""
+    job_id = None
     try:
-        if not month:
-            month = datetime.now().month
-        if not year:
-            year = datetime.now().year
-        
-        logger.info(f"🔄 Starting monthly report generation for {month}/{year}")
+        now = datetime.now()
+        parameters = monthly_report_parameters(month or now.month, year or now.year, user_id)
+        
+        logger.info(f"🔄 Starting monthly report generation for {parameters['month']}/{parameters['year']}")
+        
+        last_id = 0
+        job = find_monthly_report_job(parameters)
+        if job and job['status'] in ('pending', 'running') and not job['stale']:
+            return f"Monthly reports for {parameters['period']} are already running in batch job {job['id']}"
+        
+        if job:
+            # Pick up where the crashed or failed run stopped: finished shards
+            # stay done, the others restart from their checkpoint
+            job_id = job['id']
+            set_batch_job_status(job_id, 'running', task_id=self.request.id)
+            result = get_batch_job(job_id)['result']
+            shards = {int(first): last for first, last in result.get('shards', {}).items()}
+            checkpoints = result.get('checkpoints', {})
+            pending = [
+                (first, last) for first, last in sorted(shards.items())
+                if checkpoints.get(str(first), first - 1) < last
+            ]
+            with db_connection() as conn:
+                conn.execute('''
+                    UPDATE batch_jobs
+                    SET result = json_set(result, '$.chunks_total', ?, '$.chunks_done', ?, '$.chunks_failed', 0)
+                    WHERE id = ?
+                ''', (len(shards), len(shards) - len(pending), job_id))
+                conn.commit()
+            for first, last in pending:
+                send_monthly_report_chunk.delay(job_id, first, last)
+            logger.info(f"Resuming monthly report job {job_id}: {len(pending)} of {len(shards)} shards left")
+            
+            if result.get('planned'):
+                record_batch_progress(job_id, planned=True)
+                return f"Resumed monthly reports for {parameters['period']} in batch job {job_id}"
+            last_id = max(shards.values(), default=0)
+        
+        users = 0
+        while True:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT u.id
+                    {MONTHLY_REPORT_USERS_SQL}
+                        AND u.id > ?
+                    ORDER BY u.id
+                    LIMIT ?
+                ''', (*monthly_report_filter_params(parameters), last_id, MONTHLY_REPORT_PAGE_SIZE))
+                user_ids = [row[0] for row in cursor.fetchall()]
+            if not user_ids:
+                break
+            
+            if job_id is None:
+                # Reruns for a month that's already covered find nobody and leave no job behind
+                job_id = create_batch_job('monthly_reports', parameters)
+                set_batch_job_status(job_id, 'running', task_id=self.request.id)
+            
+            shards = [
+                (user_ids[i], user_ids[min(i + MONTHLY_REPORT_CHUNK_SIZE, len(user_ids)) - 1])
+                for i in range(0, len(user_ids), MONTHLY_REPORT_CHUNK_SIZE)
+            ]
+            record_batch_shards(job_id, shards)
+            record_batch_progress(job_id, recipients=len(user_ids))
+            for first, last in shards:
+                send_monthly_report_chunk.delay(job_id, first, last)
             
-        conn = get_db()
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        
-        #getting users with email addresses
-        if user_id:
-            cursor.execute('SELECT * FROM users WHERE id = ? AND is_admin = 0 AND email IS NOT NULL AND email != ""', (user_id,))
-            users = cursor.fetchall()
-        else:
-            cursor.execute('SELECT * FROM users WHERE is_admin = 0 AND email IS NOT NULL AND email != ""')
-            users = cursor.fetchall()
+            users += len(user_ids)
+            last_id = user_ids[-1]
         
-        reports_generated = 0
+        if job_id is None:
+            return f"No monthly reports left to generate for {parameters['period']}"
         
-        logger.info(f"Found {len(users)} users to generate reports for")
+        record_batch_progress(job_id, planned=True)
+        logger.info(f"Monthly reports for {parameters['period']}: dispatched {users} users in batch job {job_id}")
+        return f"Dispatched monthly reports for {users} users in batch job {job_id}"
         
-        for user in users:
-            try:
-                #genrating monthly statistics
-                cursor.execute('''
-                    SELECT 
-                        COUNT(*) as total_bookings,
-                        COUNT(CASE WHEN status = 'completed' THEN 1 END) as completed_bookings,
-                        COALESCE(SUM(parking_cost), 0) as total_spent,
-                        AVG(CASE 
-                            WHEN parking_timestamp IS NOT NULL AND leaving_timestamp IS NOT NULL 
-                            THEN (julianday(leaving_timestamp) - julianday(parking_timestamp)) * 24 
-                            ELSE NULL 
-                        END) as avg_duration_hours
-                    FROM reservations 
-                    WHERE user_id = ? 
-                        AND strftime('%Y', created_at) = ? 
-                        AND strftime('%m', created_at) = ?
-                ''', (user['id'], str(year), str(month).zfill(2)))
-                
-                monthly_stats = cursor.fetchone()
-                
-                #skips users with no activity this month
-                if not monthly_stats or monthly_stats['total_bookings'] == 0:
-                    logger.info(f"Skipping {user['username']} - no activity this month")
-                    continue
-                
-                #show most used parking lot
-                cursor.execute('''
-                    SELECT 
-                        pl.prime_location_name,
-                        COUNT(*) as usage_count
-                    FROM reservations r
-                    JOIN parking_spots ps ON r.spot_id = ps.id
-                    JOIN parking_lots pl ON ps.lot_id = pl.id
-                    WHERE r.user_id = ? 
-                        AND strftime('%Y', r.created_at) = ? 
-                        AND strftime('%m', r.created_at) = ?
-                    GROUP BY pl.id, pl.prime_location_name
-                    ORDER BY usage_count DESC
-                    LIMIT 1
-                ''', (user['id'], str(year), str(month).zfill(2)))
-                
-                most_used_lot = cursor.fetchone()
-                
-                #shows daily usage pattern
-                cursor.execute('''
-                    SELECT 
-                        DATE(created_at) as date,
-                        COUNT(*) as bookings
-                    FROM reservations
-                    WHERE user_id = ? 
-                        AND strftime('%Y', created_at) = ? 
-                        AND strftime('%m', created_at) = ?
-                    GROUP BY DATE(created_at)
-                    ORDER BY date
-                ''', (user['id'], str(year), str(month).zfill(2)))
-                
-                daily_usage = cursor.fetchall()
-                
-                #create enhanced HTML report
-                html_report = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>Monthly Parking Activity Report</title>
-                    <style>
-                        body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; margin: 0; padding: 20px; background-color: #f5f5f5; }}
-                        .container {{ max-width: 800px; margin: 0 auto; background: white; border-radius: 10px; overflow: hidden; box-shadow: 0 0 20px rgba(0,0,0,0.1); }}
-                        .header {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; text-align: center; }}
-                        .header h1 {{ margin: 0; font-size: 28px; }}
-                        .content {{ padding: 30px; }}
-                        .stat-box {{ background: linear-gradient(135deg, #e8f4f8 0%, #f0f8ff 100%); padding: 20px; margin: 20px 0; border-radius: 8px; border-left: 4px solid #667eea; }}
-                        .stat-box h2 {{ color: #333; margin-top: 0; font-size: 20px; }}
-                        .stat-item {{ display: inline-block; margin: 10px 20px 10px 0; }}
-                        .stat-value {{ font-size: 24px; font-weight: bold; color: #667eea; display: block; }}
-                        .stat-label {{ color: #666; font-size: 14px; }}
-                        .table {{ width: 100%; border-collapse: collapse; margin: 20px 0; }}
-                        .table th, .table td {{ border: 1px solid #ddd; padding: 12px; text-align: left; }}
-                        .table th {{ background-color: #667eea; color: white; font-weight: bold; }}
-                        .table tr:nth-child(even) {{ background-color: #f9f9f9; }}
-                        .highlight {{ background: linear-gradient(135deg, #ffeaa7 0%, #fab1a0 100%); padding: 15px; border-radius: 8px; margin: 20px 0; }}
-                        .footer {{ background: #f8f9fa; padding: 20px; text-align: center; color: #666; }}
-                    </style>
-                </head>
-                <body>
-                    <div class="container">
-                        <div class="header">
-                            <h1>📊 Monthly Parking Report</h1>
-                            <p style="margin: 10px 0 0 0; font-size: 18px;">ParkMate Activity Summary</p>
-                        </div>
-                        
-                        <div class="content">
-                            <div style="text-align: center; margin-bottom: 30px;">
-                                <h2 style="color: #333; margin: 0;">Hello {user['username']}! 👋</h2>
-                                <p style="color: #666; margin: 5px 0;"><strong>Report Period:</strong> {month}/{year}</p>
-                                <p style="color: #666; margin: 5px 0;"><strong>Generated:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                            </div>
-                            
-                            <div class="stat-box">
-                                <h2>📈 Monthly Summary</h2>
-                                <div style="display: flex; flex-wrap: wrap;">
-                                    <div class="stat-item">
-                                        <span class="stat-value">{monthly_stats['total_bookings'] if monthly_stats else 0}</span>
-                                        <span class="stat-label">Total Bookings</span>
-                                    </div>
-                                    <div class="stat-item">
-                                        <span class="stat-value">{monthly_stats['completed_bookings'] if monthly_stats else 0}</span>
-                                        <span class="stat-label">Completed Sessions</span>
-                                    </div>
-                                    <div class="stat-item">
-                                        <span class="stat-value">${"{:.2f}".format(monthly_stats['total_spent']) if monthly_stats and monthly_stats.get('total_spent') else '0.00'}</span>
-                                        <span class="stat-label">Total Spent</span>
-                                    </div>
-                                    <div class="stat-item">
-                                        <span class="stat-value">{f"{monthly_stats['avg_duration_hours']:.1f}h" if monthly_stats and monthly_stats.get('avg_duration_hours') is not None else 'N/A'}</span>
-                                        <span class="stat-label">Avg. Duration</span>
-                                    </div>
-                                </div>
-                            </div>
-                            
-                            <div class="stat-box">
-                                <h2>🏢 Favorite Location</h2>
-                                <p style="font-size: 18px; margin: 10px 0;"><strong>{most_used_lot['prime_location_name'] if most_used_lot else 'No specific preference'}</strong></p>
-                                <p style="color: #666;">Usage: {most_used_lot['usage_count'] if most_used_lot else 0} times this month</p>
-                            </div>
-                            
-                            <div class="stat-box">
-                                <h2>📅 Daily Activity Pattern</h2>
-                                <table class="table">
-                                    <thead>
-                                        <tr><th>Date</th><th>Bookings Made</th></tr>
-                                    </thead>
-                                    <tbody>
-                """
-                
-                for day in daily_usage:
-                    html_report += f"<tr><td>{day['date']}</td><td>{day['bookings']}</td></tr>"
-                
-                html_report += """
-                                    </tbody>
-                                </table>
-                            </div>
-                            
-                            <div class="highlight">
-                                <h2 style="margin-top: 0;">💡 Tips for Next Month</h2>
-                                <ul style="margin: 10px 0;">
-                                    <li>📅 <strong>Plan ahead:</strong> Book parking spots in advance to ensure availability</li>
-                                    <li>⏰ <strong>Off-peak savings:</strong> Consider booking during off-peak hours for better rates</li>
-                                    <li>🎫 <strong>Monthly passes:</strong> Ask about monthly parking passes for regular users</li>
-                                    <li>📱 <strong>Mobile app:</strong> Use our app for quick and easy booking</li>
-                                </ul>
-                            </div>
-                        </div>
-                        
-                        <div class="footer">
-                            <p><strong>Thank you for using ParkMate!</strong></p>
-                            <p>Questions? Contact us at admin@parkmate.com</p>
-                            <p style="font-size: 12px; margin-top: 15px;">This is an automated report from ParkMate Parking Management System</p>
-                        </div>
-                    </div>
-                </body>
-                </html>
-                """
-                
-                # Send the email
-                if send_email(
-                    user['email'], 
-                    f"📊 Your Monthly Parking Report - {month}/{year}",
-                    html_report
-                ):
-                    reports_generated += 1
-                    logger.info(f"Successfully sent monthly report to {user['username']} ({user['email']})")
-                else:
-                    logger.warning(f"Failed to send monthly report to {user['username']} ({user['email']})")
-                    
-            except Exception as e:
-                logger.error(f"Error generating report for user {user['username']}: {e}")
-                continue
+    except Exception as e:
+        logger.error(f"❌ Error generating monthly reports: {e}")
+        if job_id is not None:
+            set_batch_job_status(job_id, 'failed', error_message=str(e))
+        raise
+
+@celery.task(bind=True)
+def send_monthly_report_chunk(self, job_id, first_user_id, last_user_id):
+    """Build and queue the monthly reports for one shard of users"""
+    try:
+        job = get_batch_job(job_id)
+        parameters = job['parameters']
+        checkpoint = job['result'].get('checkpoints', {}).get(str(first_user_id), first_user_id - 1)
         
-        conn.close()
-        logger.info(f"✅ Monthly report generation completed. Generated {reports_generated} reports for {month}/{year}")
-        return f"Generated {reports_generated} monthly reports for {month}/{year}"
+        # One grouped pass over the month for the whole shard; the per-user
+        # summary, favourite lot and daily pattern are folded from its rows
+        with db_connection(dict_factory) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    u.id as user_id, u.username, u.email,
+                    pl.id as lot_id, pl.prime_location_name,
+                    DATE(r.created_at) as date,
+                    COUNT(*) as bookings,
+                    COUNT(CASE WHEN r.status = 'completed' THEN 1 END) as completed_bookings,
+                    COALESCE(SUM(r.parking_cost), 0) as total_spent,
+                    SUM((julianday(r.leaving_timestamp) - julianday(r.parking_timestamp)) * 24) as duration_hours,
+                    COUNT(julianday(r.leaving_timestamp) - julianday(r.parking_timestamp)) as timed_bookings
+                FROM users u
+                JOIN reservations r ON r.user_id = u.id
+                    AND r.created_at >= ? AND r.created_at < ?
+                LEFT JOIN parking_spots ps ON r.spot_id = ps.id
+                LEFT JOIN parking_lots pl ON ps.lot_id = pl.id
+                WHERE u.is_admin = 0 AND u.email IS NOT NULL AND u.email != ''
+                    AND u.id BETWEEN ? AND ?
+                GROUP BY u.id, pl.id, DATE(r.created_at)
+                ORDER BY u.id
+            ''', (parameters['start'], parameters['end'], checkpoint + 1, last_user_id))
+            reports = summarize_monthly_activity(cursor.fetchall())
+        
+        queued = 0
+        for i in range(0, len(reports), MONTHLY_REPORT_CHECKPOINT_SIZE):
+            batch = reports[i:i + MONTHLY_REPORT_CHECKPOINT_SIZE]
+            notifications = []
+            for report in batch:
+                subject, body = render_notification('monthly_report', {
+                    'username': report['username'],
+                    'month': parameters['month'],
+                    'year': parameters['year'],
+                    'stats': report['stats'],
+                    'most_used_lot': report['most_used_lot'],
+                    'daily_usage': report['daily_usage'],
+                })
+                notifications.append({
+                    'to_email': report['email'],
+                    'subject': subject,
+                    'body': body,
+                    'email_type': 'monthly_report',
+                    'user_id': report['user_id'],
+                    'dedup_key': f"monthly_report:{report['user_id']}:{parameters['period']}",
+                })
+            # The emails and the checkpoint commit together, so a retry neither
+            # resends this batch nor skips the one after it
+            with db_connection() as conn:
+                batch_queued = queue_emails(notifications, conn)
+                record_batch_checkpoint(conn, job_id, first_user_id, batch[-1]['user_id'])
+                conn.commit()
+            if batch_queued:
+                schedule_outbox_delivery()
+            queued += batch_queued
+        
+        with db_connection() as conn:
+            record_batch_checkpoint(conn, job_id, first_user_id, last_user_id)
+            conn.commit()
+        record_batch_progress(job_id, chunks_done=1, queued=queued)
+        return f"Queued {queued} monthly reports"
         
     except Exception as e:
-        logger.error(f"❌ Error generating monthly reports: {e}")
+        logger.error(f"Error in monthly report chunk {first_user_id}-{last_user_id} of job {job_id}: {e}")
+        record_batch_progress(job_id, chunks_failed=1, error_message=str(e))
         raise
 
 @celery.task(bind=True)
@@ -1582,28 +3930,13 @@ def export_user_parking_data_csv(self, user_id):
                 'data': csv_bytes
             }
             
-            email_body = f"""
-            <html>
-            <body>
-                <h2>Your Parking Data Export is Ready!</h2>
-                <p>Dear {user['username']},</p>
-                <p>Your parking data export has been completed successfully.</p>
-                <p>The attached CSV file contains:</p>
-                <ul>
-                    <li>All your parking reservations</li>
-                    <li>Booking timestamps</li>
-                    <li>Parking duration and costs</li>
-                    <li>Location details</li>
-                </ul>
-                <p>Total records: {len(parking_data)}</p>
-                <p>Export generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                <br>
-                <p>Best regards,<br>Parking Management System</p>
-            </body>
-            </html>
-            """
-            
-            send_email(user_email, "Your Parking Data Export", email_body, attachment)
+            subject, email_body = render_notification('csv_export', {
+                'username': user['username'],
+                'records': len(parking_data),
+            })
+            
+            queue_email(user_email, subject, email_body, attachment,
+                        email_type='csv_export', user_id=user_id, dedup_key=f"csv_export:{filename}")
         
         conn.close()
         logger.info(f"CSV export completed for user {user_id}: {filename}")
@@ -1633,157 +3966,73 @@ def export_user_parking_data_csv(self, user_id):
 def send_parking_reminders(self):
     """Send reminders to users who have reserved but not parked"""
     try:
-        conn = get_db()
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        
-        #finds reservationms that are active but user hasn't parked yet, send reminder after 30 minutes of boking
-        reminder_time = datetime.now() - timedelta(minutes=30)
-        
-        cursor.execute('''
-            SELECT 
-                r.id as reservation_id,
-                r.created_at,
-                r.user_id,
-                u.username,
-                u.email,
-                ps.spot_number,
-                pl.prime_location_name,
-                pl.address,
-                pl.price
-            FROM reservations r
-            JOIN users u ON r.user_id = u.id
-            JOIN parking_spots ps ON r.spot_id = ps.id
-            JOIN parking_lots pl ON ps.lot_id = pl.id
-            WHERE r.status = 'active' 
-                AND r.parking_timestamp IS NULL 
-                AND r.created_at < ?
-                AND r.created_at > ?
-        ''', (reminder_time, datetime.now() - timedelta(hours=2)))
-        
-        pending_reservations = cursor.fetchall()
-        
-        reminders_sent = 0
-        
-        for reservation in pending_reservations:
-            try:
-                cursor.execute('''
-                    SELECT id FROM parking_reminders 
-                    WHERE reservation_id = ? AND reminder_type = 'parking_pending'
-                ''', (reservation['reservation_id'],))
-                
-                if cursor.fetchone():
-                    continue
-                #calculate time since booking
-                booking_time = datetime.fromisoformat(reservation['created_at'])
-                time_elapsed = datetime.now() - booking_time
-                hours_elapsed = time_elapsed.total_seconds() / 3600
-                
-                reminder_email_body = f"""
-                <html>
-                <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                    <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                        <div style="background: linear-gradient(135deg, #ff9a56 0%, #ff6b35 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                            <h1 style="margin: 0; font-size: 28px;">⏰ Parking Reminder</h1>
-                        </div>
-                        
-                        <div style="background: white; padding: 30px; border: 1px solid #ddd; border-radius: 0 0 10px 10px;">
-                            <h2 style="color: #ff6b35; margin-top: 0;">Hello {reservation['username']}!</h2>
-                            
-                            <div style="background: #fff3cd; border: 1px solid #ffeaa7; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                                <h3 style="color: #856404; margin-top: 0;">⚠️ Your Vehicle is Not Parked Yet!</h3>
-                                <p style="color: #856404; margin-bottom: 0;">You have a reserved parking spot that's waiting for you.</p>
-                            </div>
-                            
-                            <div style="background: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                                <h3 style="color: #495057; margin-top: 0;">Reservation Details</h3>
-                                <table style="width: 100%; border-collapse: collapse;">
-                                    <tr style="border-bottom: 1px solid #dee2e6;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Reservation ID:</td>
-                                        <td style="padding: 8px 0;">#{reservation['reservation_id']}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #dee2e6;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Location:</td>
-                                        <td style="padding: 8px 0;">{reservation['prime_location_name']}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #dee2e6;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Address:</td>
-                                        <td style="padding: 8px 0;">{reservation['address']}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #dee2e6;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Spot Number:</td>
-                                        <td style="padding: 8px 0;">#{reservation['spot_number']}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #dee2e6;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Reserved At:</td>
-                                        <td style="padding: 8px 0;">{booking_time.strftime('%Y-%m-%d %H:%M:%S')}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #dee2e6;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Time Elapsed:</td>
-                                        <td style="padding: 8px 0; color: #dc3545; font-weight: bold;">{round(hours_elapsed, 1)} hours</td>
-                                    </tr>
-                                    <tr>
-                                        <td style="padding: 8px 0; font-weight: bold;">Rate:</td>
-                                        <td style="padding: 8px 0;">${reservation['price']}/hour</td>
-                                    </tr>
-                                </table>
-                            </div>
-                            
-                            <div style="background: #d1ecf1; border: 1px solid #bee5eb; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                                <h3 style="color: #0c5460; margin-top: 0;">📍 What You Need to Do:</h3>
-                                <ol style="color: #0c5460;">
-                                    <li><strong>Arrive at the location:</strong> {reservation['address']}</li>
-                                    <li><strong>Find your spot:</strong> Look for spot number #{reservation['spot_number']}</li>
-                                    <li><strong>Park your vehicle</strong> in the reserved spot</li>
-                                    <li><strong>Check-in:</strong> Use your ParkMate app to confirm parking</li>
-                                </ol>
-                            </div>
-                            
-                            <div style="background: #f8d7da; border: 1px solid #f5c6cb; padding: 15px; border-radius: 8px; margin: 20px 0;">
-                                <p style="color: #721c24; margin: 0; font-weight: bold;">
-                                    ⚠️ Important: Your reservation may expire if you don't arrive soon. Please park your vehicle to secure your spot!
-                                </p>
-                            </div>
-                            
-                            <div style="text-align: center; margin-top: 30px;">
-                                <p style="color: #6c757d; font-size: 14px;">
-                                    Need help? Contact us at admin@parkmate.com or call support.
-                                </p>
-                                <p style="color: #6c757d; font-size: 12px;">
-                                    This is an automated reminder from ParkMate.
-                                </p>
-                            </div>
-                        </div>
-                    </div>
-                </body>
-                </html>
-                """
-                
-                # sends the reminder email
-                if send_email(
-                    reservation['email'], 
-                    f"🚗 Parking Reminder - Spot #{reservation['spot_number']} Reserved", 
-                    reminder_email_body
-                ):
-                    # Record that i sent this reminder
-                    cursor.execute('''
-                        INSERT INTO parking_reminders 
-                        (reservation_id, user_id, reminder_type, sent_at) 
-                        VALUES (?, ?, 'parking_pending', ?)
-                    ''', (reservation['reservation_id'], reservation['user_id'], datetime.now()))
-                    
-                    reminders_sent += 1
-                    logger.info(f"Parking reminder sent to {reservation['email']} for reservation #{reservation['reservation_id']}")
-                
-            except Exception as e:
-                logger.error(f"Error sending parking reminder for reservation {reservation['reservation_id']}: {e}")
-                continue
-        
-        if reminders_sent > 0:
+        # One pass over idx_reservations_pending: bookings that have waited
+        # long enough but not too long, minus those already reminded
+        with db_connection(dict_factory) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    r.id as reservation_id,
+                    r.created_at,
+                    r.user_id,
+                    u.username,
+                    u.email,
+                    ps.spot_number,
+                    pl.prime_location_name,
+                    pl.address,
+                    pl.price,
+                    (julianday('now') - julianday(r.created_at)) * 24 as hours_elapsed
+                FROM reservations r
+                JOIN users u ON r.user_id = u.id
+                JOIN parking_spots ps ON r.spot_id = ps.id
+                JOIN parking_lots pl ON ps.lot_id = pl.id
+                WHERE r.status = 'active' 
+                    AND r.parking_timestamp IS NULL 
+                    AND r.created_at >= datetime('now', ?)
+                    AND r.created_at < datetime('now', ?)
+                    AND NOT EXISTS (
+                        SELECT 1 FROM parking_reminders pr
+                        WHERE pr.reservation_id = r.id AND pr.reminder_type = 'parking_pending'
+                    )
+                ORDER BY r.created_at
+                LIMIT ?
+            ''', (
+                f'-{PARKING_REMINDER_WINDOW_HOURS} hours',
+                f'-{PARKING_REMINDER_DELAY_MINUTES} minutes',
+                PARKING_REMINDER_BATCH_SIZE,
+            ))
+            pending_reservations = cursor.fetchall()
+            
+            if not pending_reservations:
+                return "Sent 0 parking reminders"
+            
+            notifications = []
+            for reservation in pending_reservations:
+                subject, reminder_email_body = render_notification('parking_reminder', {
+                    'reservation': reservation,
+                    'booked_at': datetime.fromisoformat(reservation['created_at']),
+                    'hours_elapsed': reservation['hours_elapsed'],
+                })
+                notifications.append({
+                    'to_email': reservation['email'],
+                    'subject': subject,
+                    'body': reminder_email_body,
+                    'email_type': 'parking_reminder',
+                    'user_id': reservation['user_id'],
+                    'dedup_key': f"parking_reminder:{reservation['reservation_id']}",
+                })
+            
+            # Emails and reminder records commit together; the unique index and
+            # the dedup keys make an overlapping run a no-op
+            reminders_sent = queue_emails(notifications, conn)
+            cursor.executemany('''
+                INSERT OR IGNORE INTO parking_reminders (reservation_id, user_id, reminder_type)
+                VALUES (?, ?, 'parking_pending')
+            ''', [(reservation['reservation_id'], reservation['user_id']) for reservation in pending_reservations])
             conn.commit()
         
-        conn.close()
-        
+        if reminders_sent:
+            schedule_outbox_delivery()
         logger.info(f"Parking reminders task completed: {reminders_sent} reminders sent")
         return f"Sent {reminders_sent} parking reminders"
         
@@ -1797,11 +4046,9 @@ def health_check():
     """Health check endpoint with security status"""
     try:
         # Check database connection
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT 1')
+        with db_connection() as conn:
+            conn.execute('SELECT 1')
         db_status = "OK"
-        conn.close()
     except Exception:
         db_status = "ERROR"
     
@@ -1829,7 +4076,7 @@ def health_check():
             'bcrypt_enabled': True,
             'cors_enabled': True,
             'security_headers': True,
-            'blacklisted_tokens': len(JWT_BLACKLIST)
+            'blacklisted_tokens': count_revoked_tokens()
         },
         'version': '1.0.0'
     }), 200
@@ -1930,44 +4177,23 @@ def register():
         user_id = cursor.lastrowid
         conn.commit()
         conn.close()
-        welcome_email_body = f"""
-        <html>
-        <body>
-            <h2>Welcome to ParkMate! 🚗</h2>
-            <p>Dear {username},</p>
-            <p>Thank you for registering with ParkMate! Your account has been successfully created.</p>
-            
-            <div style="background-color: #f0f8ff; padding: 20px; border-radius: 5px; margin: 20px 0;">
-                <h3>Account Details:</h3>
-                <p><strong>Username:</strong> {username}</p>
-                <p><strong>Email:</strong> {email}</p>
-                <p><strong>Phone:</strong> {phone}</p>
-                <p><strong>Registration Date:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-            </div>
-            
-            <h3>What's Next?</h3>
-            <ul>
-                <li>🚗 Browse available parking lots</li>
-                <li>📅 Make your first parking reservation</li>
-                <li>💰 View pricing and payment options</li>
-                <li>📊 Track your parking history</li>
-            </ul>
-            <p>If you need any assistance, feel free to contact our support team.</p>
-            <p>Happy Parking!<br>
-            <strong>The ParkMate Team</strong></p>
-        </body>
-        </html>
-        """
+        subject, welcome_email_body = render_notification('welcome', {
+            'username': username,
+            'email': email,
+            'phone': phone,
+        })
         if email:
-            send_email(email, "Welcome to ParkMate! 🚗", welcome_email_body)
+            queue_email(email, subject, welcome_email_body,
+                        email_type='welcome', user_id=user_id, dedup_key=f"welcome:{user_id}")
         
-        invalidate_cache_pattern('*users*')
-        invalidate_cache_pattern('*admin*')
+        invalidate_cache_tags('users')
         
         return jsonify({
             'message': 'User registered successfully',
             'user_id': user_id
         }), 201
+    except (PasswordPoolSaturated, TimeoutError):
+        return pool_busy_response()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1987,7 +4213,6 @@ def login():
         conn.row_factory = dict_factory
         cursor = conn.cursor()
         
-        hashed_password = hash_password(password)
         cursor.execute('''
             SELECT id, username, email, phone, is_admin, password 
             FROM users WHERE username = ?
@@ -1999,6 +4224,9 @@ def login():
         if not user or not verify_password(password, user['password']):
             return jsonify({'error': 'Invalid credentials'}), 401
         
+        if password_needs_rehash(user['password']):
+            upgrade_password_hash(user['id'], password, user['password'])
+        
         # Remove password from user data before generatin tokens
         user_data = {
             'id': user['id'],
@@ -2030,6 +4258,8 @@ def login():
         
         return jsonify(response_data), 200
         
+    except (PasswordPoolSaturated, TimeoutError):
+        return pool_busy_response()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -2050,7 +4280,7 @@ def logout():
             # JWT-based logout - add token to blacklist
             user_data = verify_token(token)
             if user_data and user_data.get('jti'):
-                add_token_to_blacklist(user_data['jti'])
+                add_token_to_blacklist(user_data['jti'], user_data.get('exp'))
                 logger.info(f"JWT token blacklisted for user: {user_data.get('username')}")
             
             data = request.get_json() or {}
@@ -2058,7 +4288,7 @@ def logout():
             if refresh_token:
                 refresh_data = verify_token(refresh_token, 'refresh')
                 if refresh_data and refresh_data.get('jti'):
-                    add_token_to_blacklist(refresh_data['jti'])
+                    add_token_to_blacklist(refresh_data['jti'], refresh_data.get('exp'))
                     logger.info(f"Refresh token blacklisted for user: {refresh_data.get('username')}")
         
         # Session-based logout
@@ -2116,7 +4346,7 @@ def refresh_token():
         
         # Blacklist the old refresh token
         if user_data.get('jti'):
-            add_token_to_blacklist(user_data.get('jti'))
+            add_token_to_blacklist(user_data.get('jti'), user_data.get('exp'))
             logger.info(f"Old refresh token blacklisted for user: {current_user['username']}")
         
         # Generate new tokens
@@ -2182,7 +4412,7 @@ def admin_parking_lots():
     cursor = conn.cursor()
     
     if request.method == 'GET':
-        @cached(timeout=CACHE_TIMEOUT, key_prefix='admin')
+        @cached(timeout=CACHE_TIMEOUT, key_prefix='admin', tags=lot_cache_tags)
         def get_parking_lots():
             cursor.execute('''
                 SELECT 
@@ -2226,6 +4456,7 @@ def admin_parking_lots():
                 ''', (lot_id, spot_num))
             
             conn.commit()
+            rebuild_free_spot_index(lot_id)
             
             cursor.execute('SELECT username, email FROM users WHERE id = ? AND is_admin = 1', (request.current_user['user_id'],))
             admin_details = cursor.fetchone()
@@ -2233,80 +4464,42 @@ def admin_parking_lots():
             conn.close()
             
             if admin_details and admin_details['email']:
-                lot_creation_email = f"""
-                <html>
-                <body>
-                    <h2>New Parking Lot Created Successfully! 🅿️</h2>
-                    <p>Dear {admin_details['username']},</p>
-                    <p>A new parking lot has been successfully added to the ParkMate system.</p>
-                    
-                    <div style="background-color: #e8f5e8; padding: 20px; border-radius: 5px; margin: 20px 0; border-left: 4px solid #4CAF50;">
-                        <h3>Parking Lot Details:</h3>
-                        <p><strong>Lot ID:</strong> #{lot_id}</p>
-                        <p><strong>Name:</strong> {location_name}</p>
-                        <p><strong>Address:</strong> {address}</p>
-                        <p><strong>PIN Code:</strong> {pin_code}</p>
-                        <p><strong>Price:</strong> ${price}/hour</p>
-                        <p><strong>Total Spots:</strong> {max_spots}</p>
-                        <p><strong>Created At:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                        <p><strong>Status:</strong> All spots available</p>
-                    </div>
-                    
-                    <div style="background-color: #d4edda; padding: 15px; border-radius: 5px; margin: 20px 0;">
-                        <h3>System Updates:</h3>
-                        <ul>
-                            <li>✅ {max_spots} parking spots have been automatically created</li>
-                            <li>🔄 All spots are marked as available</li>
-                            <li>📊 The new lot is now visible to users</li>
-                            <li>📈 Analytics data has been updated</li>
-                        </ul>
-                    </div>
-                    <p>The parking lot is now live and ready for reservations!</p>
-                    <p>Best regards,<br>
-                    <strong>ParkMate System</strong></p>
-                </body>
-                </html>
-                """
-                
-                send_email(admin_details['email'], f"New Parking Lot Created - {location_name}", lot_creation_email)
-            
-            cursor = get_db().cursor()
-            cursor.execute('SELECT email, username FROM users WHERE is_admin = 0 AND email IS NOT NULL')
-            users = cursor.fetchall()
-            cursor.connection.close()
-            
-            for user in users:
-                new_lot_notification = f"""
-                <html>
-                <body>
-                    <h2>New Parking Location Available! 🆕</h2>
-                    <p>Dear {user[1]},</p>
-                    <p>Great news! A new parking location has been added to ParkMate.</p>
-                    
-                    <div style="background-color: #cce5ff; padding: 20px; border-radius: 5px; margin: 20px 0; border-left: 4px solid #007bff;">
-                        <h3>New Location:</h3>
-                        <p><strong>📍 {location_name}</strong></p>
-                        <p><strong>Address:</strong> {address}</p>
-                        <p><strong>Price:</strong> ${price}/hour</p>
-                        <p><strong>Available Spots:</strong> {max_spots}</p>
-                    </div>
-                    
-                    <p>🚗 Ready to book? Log in to your ParkMate account and reserve your spot now!</p>
-                    
-                    <p>Happy Parking!<br>
-                    <strong>The ParkMate Team</strong></p>
-                </body>
-                </html>
-                """
+                subject, lot_creation_email = render_notification('lot_created', {
+                    'username': admin_details['username'],
+                    'lot': {
+                        'id': lot_id,
+                        'prime_location_name': location_name,
+                        'address': address,
+                        'pin_code': pin_code,
+                        'price': price,
+                        'maximum_number_of_spots': max_spots,
+                    },
+                })
                 
-                send_email(user[0], f"New Parking Location: {location_name}", new_lot_notification)
+                queue_email(admin_details['email'], subject, lot_creation_email,
+                            email_type='lot_created', user_id=request.current_user['user_id'],
+                            dedup_key=f"lot_created:{lot_id}")
+            
+            # Notifying every user is a batch job, so the request doesn't grow with the user base
+            job_id = create_batch_job('new_lot_notifications', {
+                'lot_id': lot_id,
+                'prime_location_name': location_name,
+                'address': address,
+                'price': price,
+                'maximum_number_of_spots': max_spots,
+            })
+            try:
+                fan_out_new_lot_notifications.apply_async((job_id,), retry=False)
+            except Exception as e:
+                logger.error(f"Could not start new lot notifications for lot {lot_id}: {e}")
+                set_batch_job_status(job_id, 'failed', error_message=str(e))
             
-            invalidate_cache_pattern('*parking_lots*')
-            invalidate_cache_pattern('*admin*')
+            invalidate_cache_tags('parking_lots')
             
             return jsonify({
                 'message': 'Parking lot created successfully',
-                'lot_id': lot_id
+                'lot_id': lot_id,
+                'notification_job_id': job_id
             }), 201
             
         except Exception as e:
@@ -2372,8 +4565,8 @@ def update_parking_lot(lot_id):
         conn.commit()
         conn.close()
         
-        invalidate_cache_pattern('*parking_lots*')
-        invalidate_cache_pattern('*admin*')
+        rebuild_free_spot_index(lot_id)
+        invalidate_cache_tags('parking_lots')
         
         return jsonify({'message': 'Parking lot updated successfully'}), 200
         
@@ -2420,8 +4613,8 @@ def delete_parking_lot(lot_id):
         conn.commit()
         conn.close()
         
-        invalidate_cache_pattern('*parking_lots*')
-        invalidate_cache_pattern('*admin*')
+        invalidate_free_spot_index(lot_id)
+        invalidate_cache_tags('parking_lots')
         
         return jsonify({'message': 'Parking lot deleted successfully'}), 200
         
@@ -2531,16 +4724,22 @@ def free_parking_spot(spot_id):
         
         cursor.execute('UPDATE parking_spots SET status = ? WHERE id = ?', ('A', spot_id))
         
+        cursor.execute("SELECT user_id FROM reservations WHERE spot_id = ? AND status = 'active'", (spot_id,))
+        freed_user_ids = [row[0] for row in cursor.fetchall()]
+        
         cursor.execute('''
             UPDATE reservations 
-            SET status = 'completed', end_timestamp = CURRENT_TIMESTAMP 
+            SET status = 'completed', leaving_timestamp = CURRENT_TIMESTAMP 
             WHERE spot_id = ? AND status = 'active'
         ''', (spot_id,))
         
         conn.commit()
         conn.close()
         
-        invalidate_cache_pattern('*admin*')
+        release_free_spot(spot[1], spot_id, spot[2])
+        for freed_user_id in freed_user_ids:
+            clear_active_reservation(freed_user_id)
+        invalidate_cache_tags(f'lot:{spot[1]}', *(f'user:{freed_user_id}' for freed_user_id in freed_user_ids))
         
         return jsonify({'message': 'Parking spot freed successfully'}), 200
         
@@ -2553,7 +4752,7 @@ def free_parking_spot(spot_id):
 def admin_users():
     """Admin users management endpoint"""
     
-    @cached(timeout=CACHE_TIMEOUT, key_prefix='admin:users')
+    @cached(timeout=CACHE_TIMEOUT, key_prefix='admin:users', tags=user_cache_tags)
     def get_users_with_stats():
         conn = get_db()
         conn.row_factory = dict_factory
@@ -2603,10 +4802,12 @@ def delete_user(user_id):
             return jsonify({'error': 'Cannot delete admin users'}), 400
         
         cursor.execute('''
-            SELECT spot_id FROM reservations 
-            WHERE user_id = ? AND status = 'active'
+            SELECT r.spot_id, ps.lot_id, ps.spot_number FROM reservations r
+            JOIN parking_spots ps ON r.spot_id = ps.id
+            WHERE r.user_id = ? AND r.status = 'active'
         ''', (user_id,))
-        spots_to_free = [row[0] for row in cursor.fetchall()]
+        freed_spot_rows = cursor.fetchall()
+        spots_to_free = [row[0] for row in freed_spot_rows]
         
         cursor.execute('DELETE FROM reservations WHERE user_id = ?', (user_id,))
         
@@ -2621,8 +4822,12 @@ def delete_user(user_id):
         conn.commit()
         conn.close()
         
+        for spot_id, lot_id, spot_number in freed_spot_rows:
+            release_free_spot(lot_id, spot_id, spot_number)
+        clear_active_reservation(user_id)
+        
         ensure_database_consistency()
-        robust_cache_invalidation()
+        invalidate_cache_tags(f'user:{user_id}', *sorted({f'lot:{row[1]}' for row in freed_spot_rows}))
         
         logger.info(f"Admin deleted user: {user[1]} (ID: {user_id}), freed {len(spots_to_free)} spots")
         return jsonify({
@@ -2639,62 +4844,62 @@ def delete_user(user_id):
 def admin_analytics():
     """Admin analytics endpoint"""
     
-    try:
-        conn = get_db()
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) as total_lots FROM parking_lots')
-        total_lots = cursor.fetchone()['total_lots']
-        
-        cursor.execute('SELECT COUNT(*) as total_spots FROM parking_spots')
-        total_spots = cursor.fetchone()['total_spots']
-        
-        cursor.execute('SELECT COUNT(*) as occupied_spots FROM parking_spots WHERE status = "O"')
-        occupied_spots = cursor.fetchone()['occupied_spots']
-        
-        cursor.execute('SELECT COUNT(*) as total_users FROM users WHERE is_admin = 0')
-        total_users = cursor.fetchone()['total_users']
-        
-        cursor.execute('SELECT COUNT(*) as active_reservations FROM reservations WHERE status = "active"')
-        active_reservations = cursor.fetchone()['active_reservations']
-        
-        cursor.execute('SELECT SUM(parking_cost) as total_revenue FROM reservations WHERE parking_cost IS NOT NULL')
-        revenue_result = cursor.fetchone()
-        total_revenue = revenue_result['total_revenue'] if revenue_result['total_revenue'] else 0
-        
-        cursor.execute('''
-            SELECT 
-                pl.id,
-                pl.prime_location_name,
-                pl.maximum_number_of_spots,
-                COUNT(ps.id) as total_spots,
-                SUM(CASE WHEN ps.status = 'O' THEN 1 ELSE 0 END) as occupied_spots,
-                ROUND((SUM(CASE WHEN ps.status = 'O' THEN 1 ELSE 0 END) * 100.0 / COUNT(ps.id)), 2) as occupancy_rate
-            FROM parking_lots pl
-            LEFT JOIN parking_spots ps ON pl.id = ps.lot_id
-            GROUP BY pl.id
-        ''')
-        lot_occupancy = cursor.fetchall()
-        
-        conn.close()
+    # The admin home screen polls this. It is tagged with every lot it lists,
+    # so bookings, releases and expiry invalidate it as well as lot changes
+    # and registrations
+    @cached(timeout=ADMIN_ANALYTICS_CACHE_TIMEOUT, key_prefix='admin',
+            tags=lambda analytics: ('users', *lot_cache_tags(analytics['lot_occupancy'])))
+    def get_admin_analytics():
+        with db_connection(dict_factory) as conn:
+            cursor = conn.cursor()
+            # Per-lot occupancy straight from idx_parking_spots_lot_status; the
+            # Redis free-spot sets are filled lazily per lot, so they cannot
+            # answer for every lot
+            cursor.execute('''
+                SELECT 
+                    pl.id,
+                    pl.prime_location_name,
+                    pl.maximum_number_of_spots,
+                    COALESCE(ps.total_spots, 0) as total_spots,
+                    COALESCE(ps.occupied_spots, 0) as occupied_spots,
+                    COALESCE(ROUND(ps.occupied_spots * 100.0 / ps.total_spots, 2), 0) as occupancy_rate
+                FROM parking_lots pl
+                LEFT JOIN (
+                    SELECT lot_id, COUNT(*) as total_spots, SUM(status = 'O') as occupied_spots
+                    FROM parking_spots
+                    GROUP BY lot_id
+                ) ps ON ps.lot_id = pl.id
+            ''')
+            lot_occupancy = cursor.fetchall()
+            
+            # Reservation totals come from the daily_lot_stats counters
+            cursor.execute('''
+                SELECT 
+                    (SELECT COUNT(*) FROM users WHERE is_admin = 0) as total_users,
+                    COALESCE(SUM(active), 0) as active_reservations,
+                    COALESCE(SUM(revenue), 0) as total_revenue
+                FROM daily_lot_stats
+            ''')
+            totals = cursor.fetchone()
         
-        analytics_data = {
+        total_spots = sum(lot['total_spots'] for lot in lot_occupancy)
+        occupied_spots = sum(lot['occupied_spots'] for lot in lot_occupancy)
+        return {
             'summary': {
-                'total_lots': total_lots,
+                'total_lots': len(lot_occupancy),
                 'total_spots': total_spots,
                 'occupied_spots': occupied_spots,
                 'available_spots': total_spots - occupied_spots,
-                'total_users': total_users,
-                'active_reservations': active_reservations,
-                'total_revenue': total_revenue,
+                'total_users': totals['total_users'],
+                'active_reservations': totals['active_reservations'],
+                'total_revenue': totals['total_revenue'],
                 'occupancy_rate': round((occupied_spots / total_spots * 100) if total_spots > 0 else 0, 2)
             },
             'lot_occupancy': lot_occupancy
         }
-        
-        logger.info(f"Analytics data: {analytics_data}")
-        return jsonify(analytics_data), 200
+    
+    try:
+        return jsonify(get_admin_analytics()), 200
         
     except Exception as e:
         logger.error(f"Error in admin_analytics: {e}")
@@ -2726,15 +4931,18 @@ def admin_analytics_dashboard_data():
         ''')
         occupancy_data = cursor.fetchall()
         
+        # Everything below reads the rollup tables the reservation triggers
+        # maintain, so the cost follows the time window, not the history
         #revenue data (last 30 days)
         cursor.execute('''
             SELECT 
-                DATE(created_at) as date,
-                COUNT(*) as reservations,
-                SUM(CASE WHEN parking_cost IS NOT NULL THEN parking_cost ELSE 0 END) as revenue
-            FROM reservations 
-            WHERE created_at >= date('now', '-30 days')
-            GROUP BY DATE(created_at)
+                day as date,
+                SUM(reservations) as reservations,
+                SUM(revenue) as revenue
+            FROM daily_lot_stats 
+            WHERE day >= date('now', '-30 days')
+            GROUP BY day
+            HAVING SUM(reservations) > 0
             ORDER BY date
         ''')
         revenue_data = cursor.fetchall()
@@ -2742,12 +4950,13 @@ def admin_analytics_dashboard_data():
         #monthly trends (last 12 months)
         cursor.execute('''
             SELECT 
-                strftime('%Y-%m', created_at) as month,
-                COUNT(*) as reservations,
-                SUM(CASE WHEN parking_cost IS NOT NULL THEN parking_cost ELSE 0 END) as revenue
-            FROM reservations 
-            WHERE created_at >= date('now', '-12 month')
-            GROUP BY strftime('%Y-%m', created_at)
+                substr(day, 1, 7) as month,
+                SUM(reservations) as reservations,
+                SUM(revenue) as revenue
+            FROM daily_lot_stats 
+            WHERE day >= date('now', '-12 month')
+            GROUP BY substr(day, 1, 7)
+            HAVING SUM(reservations) > 0
             ORDER BY month
         ''')
         monthly_trends = cursor.fetchall()
@@ -2755,11 +4964,12 @@ def admin_analytics_dashboard_data():
         #hourly usage pattern
         cursor.execute('''
             SELECT 
-                strftime('%H', created_at) as hour,
-                COUNT(*) as reservations
-            FROM reservations 
-            WHERE created_at >= date('now', '-7 days')
-            GROUP BY strftime('%H', created_at)
+                substr(hour_start, 12, 2) as hour,
+                SUM(reservations) as reservations
+            FROM hourly_lot_stats 
+            WHERE hour_start >= date('now', '-7 days')
+            GROUP BY substr(hour_start, 12, 2)
+            HAVING SUM(reservations) > 0
             ORDER BY hour
         ''')
         hourly_usage = cursor.fetchall()
@@ -2767,18 +4977,12 @@ def admin_analytics_dashboard_data():
         #duration analysis
         cursor.execute('''
             SELECT 
-                CASE 
-                    WHEN (julianday(leaving_timestamp) - julianday(parking_timestamp)) * 24 <= 1 THEN '0-1 hours'
-                    WHEN (julianday(leaving_timestamp) - julianday(parking_timestamp)) * 24 <= 2 THEN '1-2 hours'
-                    WHEN (julianday(leaving_timestamp) - julianday(parking_timestamp)) * 24 <= 4 THEN '2-4 hours'
-                    WHEN (julianday(leaving_timestamp) - julianday(parking_timestamp)) * 24 <= 8 THEN '4-8 hours'
-                    ELSE '8+ hours'
-                END as duration_category,
-                COUNT(*) as count
-            FROM reservations 
-            WHERE parking_timestamp IS NOT NULL AND leaving_timestamp IS NOT NULL
-                AND created_at >= date('now', '-30 days')
+                duration_category,
+                SUM(reservations) as count
+            FROM daily_duration_stats 
+            WHERE day >= date('now', '-30 days')
             GROUP BY duration_category
+            HAVING SUM(reservations) > 0
             ORDER BY count DESC
         ''')
         duration_analysis = cursor.fetchall()
@@ -2787,12 +4991,13 @@ def admin_analytics_dashboard_data():
         cursor.execute('''
             SELECT 
                 u.username,
-                COUNT(r.id) as total_reservations,
-                SUM(CASE WHEN r.parking_cost IS NOT NULL THEN r.parking_cost ELSE 0 END) as total_spent
-            FROM users u
-            JOIN reservations r ON u.id = r.user_id
-            WHERE u.is_admin = 0 AND r.created_at >= date('now', '-30 days')
-            GROUP BY u.id
+                SUM(d.reservations) as total_reservations,
+                SUM(d.spent) as total_spent
+            FROM daily_user_stats d
+            JOIN users u ON u.id = d.user_id
+            WHERE u.is_admin = 0 AND d.day >= date('now', '-30 days')
+            GROUP BY d.user_id
+            HAVING SUM(d.reservations) > 0
             ORDER BY total_reservations DESC
             LIMIT 10
         ''')
@@ -3039,21 +5244,18 @@ def generate_occupancy_graph():
     """Generate occupancy analytics graph"""
     
     try:
-        conn = get_db()
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                pl.prime_location_name,
-                COUNT(ps.id) as total_spots,
-                SUM(CASE WHEN ps.status = 'O' THEN 1 ELSE 0 END) as occupied_spots
-            FROM parking_lots pl
-            LEFT JOIN parking_spots ps ON pl.id = ps.lot_id
-            GROUP BY pl.id
-        ''')
-        data = cursor.fetchall()
-        conn.close()
+        with db_connection(dict_factory) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    pl.prime_location_name,
+                    COUNT(ps.id) as total_spots,
+                    COALESCE(SUM(CASE WHEN ps.status = 'O' THEN 1 ELSE 0 END), 0) as occupied_spots
+                FROM parking_lots pl
+                LEFT JOIN parking_spots ps ON pl.id = ps.lot_id
+                GROUP BY pl.id
+            ''')
+            data = cursor.fetchall()
         
         if not data:
             data = [
@@ -3063,71 +5265,17 @@ def generate_occupancy_graph():
                 {'prime_location_name': 'Student Center', 'total_spots': 35, 'occupied_spots': 25}
             ]
         
-        df = pd.DataFrame(data)
-        df['available_spots'] = df['total_spots'] - df['occupied_spots']
-        df['occupancy_rate'] = (df['occupied_spots'] / df['total_spots'] * 100).round(2)
-        
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(8, 6))
-        fig.suptitle('Parking Lot Analytics Dashboard', fontsize=12, fontweight='bold', y=0.96)
-        
-        colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FECA57', '#FF9FF3']
-        wedges, texts, autotexts = ax1.pie(df['occupied_spots'], labels=df['prime_location_name'], 
-                                          autopct='%1.1f%%', colors=colors[:len(df)])
-        ax1.set_title('Current Occupancy Distribution', fontweight='bold')
-        
-        x = range(len(df))
-        width = 0.35
-        ax2.bar([i - width/2 for i in x], df['occupied_spots'], width, 
-                label='Occupied', color='#FF6B6B', alpha=0.8)
-        ax2.bar([i + width/2 for i in x], df['available_spots'], width, 
-                label='Available', color='#4ECDC4', alpha=0.8)
-        ax2.set_xlabel('Parking Lots')
-        ax2.set_ylabel('Number of Spots')
-        ax2.set_title('Occupied vs Available Spots', fontweight='bold')
-        ax2.set_xticks(x)
-        ax2.set_xticklabels(df['prime_location_name'], rotation=45, ha='right')
-        ax2.legend()
-        ax2.grid(True, alpha=0.3)
-
-        bars = ax3.bar(df['prime_location_name'], df['occupancy_rate'], 
-                       color=['#FF6B6B' if x > 80 else '#FECA57' if x > 60 else '#4ECDC4' 
-                              for x in df['occupancy_rate']])
-        ax3.set_xlabel('Parking Lots')
-        ax3.set_ylabel('Occupancy Rate (%)')
-        ax3.set_title('Occupancy Rate by Location', fontweight='bold')
-        ax3.set_xticklabels(df['prime_location_name'], rotation=45, ha='right')
-        ax3.grid(True, alpha=0.3)
-        
-        for bar, rate in zip(bars, df['occupancy_rate']):
-            height = bar.get_height()
-            ax3.text(bar.get_x() + bar.get_width()/2., height + 1,
-                    f'{rate}%', ha='center', va='bottom', fontweight='bold')
-        
-        total_spots = df['total_spots'].sum()
-        total_occupied = df['occupied_spots'].sum()
-        total_available = total_spots - total_occupied
-        
-        sizes = [total_occupied, total_available]
-        colors_overview = ['#FF6B6B', '#4ECDC4']
-        wedges, texts, autotexts = ax4.pie(sizes, labels=['Occupied', 'Available'], 
-                                          autopct=lambda pct: f'{pct:.1f}%\n({int(pct/100*total_spots)} spots)',
-                                          colors=colors_overview, startangle=90)
-        ax4.set_title(f'Overall System Status\nTotal: {total_spots} spots', fontweight='bold')
-        
-        plt.tight_layout(h_pad=3.0, w_pad=2.5, rect=[0.08, 0.08, 0.92, 0.88])
-        graph_data = generate_graph_base64(fig)
-        
-        return jsonify({
-            'graph': graph_data, 
-            'data': data,
-            'summary': {
-                'total_spots': int(total_spots),
-                'total_occupied': int(total_occupied),
-                'total_available': int(total_available),
-                'overall_occupancy': round(total_occupied / total_spots * 100, 2) if total_spots > 0 else 0
-            }
-        }), 200
-        
+        total_spots = sum(row['total_spots'] for row in data)
+        total_occupied = sum(row['occupied_spots'] for row in data)
+        return graph_response('occupancy', render_occupancy_graph, data, {
+            'total_spots': total_spots,
+            'total_occupied': total_occupied,
+            'total_available': total_spots - total_occupied,
+            'overall_occupancy': round(total_occupied / total_spots * 100, 2) if total_spots > 0 else 0
+        })
+        
+    except (GraphPoolSaturated, TimeoutError):
+        return pool_busy_response()
     except Exception as e:
         logger.error(f"Error generating occupancy graph: {e}")
         return jsonify({'error': 'Failed to generate graph'}), 500
@@ -3138,132 +5286,104 @@ def generate_revenue_graph():
     """Generate revenue analytics graph"""
     
     try:
-        conn = get_db()
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                DATE(created_at) as date,
-                COUNT(*) as reservations,
-                SUM(CASE WHEN parking_cost IS NOT NULL THEN parking_cost ELSE 0 END) as revenue
-            FROM reservations 
-            WHERE created_at >= date('now', '-30 days')
-            GROUP BY DATE(created_at)
-            ORDER BY date
-        ''')
-        data = cursor.fetchall()
-        conn.close()
+        with db_connection(dict_factory) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    day as date,
+                    SUM(reservations) as reservations,
+                    SUM(revenue) as revenue
+                FROM daily_lot_stats 
+                WHERE day >= date('now', '-30 days')
+                GROUP BY day
+                HAVING SUM(reservations) > 0
+                ORDER BY date
+            ''')
+            data = cursor.fetchall()
         
         if not data:
+            # Fixed demo series, like the occupancy fallback, so the content
+            # hash (and the cached image) only changes with the date
             dates = pd.date_range(start=datetime.now() - timedelta(days=29), 
                                 end=datetime.now(), freq='D')
             data = []
-            for date in dates:
-                reservations = np.random.randint(5, 25)
-                revenue = np.random.uniform(50, 300)
+            for i, date in enumerate(dates):
+                reservations = 5 + (i * 7) % 21
                 data.append({
                     'date': date.strftime('%Y-%m-%d'),
                     'reservations': reservations,
-                    'revenue': round(revenue, 2)
+                    'revenue': round(reservations * 12.5, 2)
                 })
         
-        df = pd.DataFrame(data)
-        df['date'] = pd.to_datetime(df['date'])
-        
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(8, 6))
-        fig.suptitle('Revenue Analytics Dashboard', fontsize=14, fontweight='bold', y=0.98)
-        
-        ax1.plot(df['date'], df['revenue'], marker='o', linewidth=2, 
-                color='#4ECDC4', markersize=4)
-        ax1.set_xlabel('Date')
-        ax1.set_ylabel('Revenue ($)')
-        ax1.set_title('Daily Revenue Trend (Last 30 Days)', fontweight='bold')
-        ax1.grid(True, alpha=0.3)
-        ax1.tick_params(axis='x', rotation=45)
-        
-        ax2.scatter(df['reservations'], df['revenue'], alpha=0.6, 
-                   color='#FF6B6B', s=50)
-        ax2.set_xlabel('Number of Reservations')
-        ax2.set_ylabel('Revenue ($)')
-        ax2.set_title('Reservations vs Revenue Correlation', fontweight='bold')
-        ax2.grid(True, alpha=0.3)
-        
-        z = np.polyfit(df['reservations'], df['revenue'], 1)
-        p = np.poly1d(z)
-        ax2.plot(df['reservations'], p(df['reservations']), "r--", alpha=0.8)
-        
-        df['week'] = df['date'].dt.isocalendar().week
-        weekly_revenue = df.groupby('week')['revenue'].sum().reset_index()
-        
-        bars = ax3.bar(range(len(weekly_revenue)), weekly_revenue['revenue'], 
-                      color='#45B7D1', alpha=0.8)
-        ax3.set_xlabel('Week')
-        ax3.set_ylabel('Total Revenue ($)')
-        ax3.set_title('Weekly Revenue Comparison', fontweight='bold')
-        ax3.grid(True, alpha=0.3)
-        
-        for bar, revenue in zip(bars, weekly_revenue['revenue']):
-            height = bar.get_height()
-            ax3.text(bar.get_x() + bar.get_width()/2., height + 5,
-                    f'${revenue:.0f}', ha='center', va='bottom', fontweight='bold')
-        
-        ax4.hist(df['revenue'], bins=10, color='#96CEB4', alpha=0.7, edgecolor='black')
-        ax4.set_xlabel('Revenue ($)')
-        ax4.set_ylabel('Frequency')
-        ax4.set_title('Daily Revenue Distribution', fontweight='bold')
-        ax4.grid(True, alpha=0.3)
-        
-        plt.tight_layout(h_pad=3.0, w_pad=2.5, rect=[0.08, 0.08, 0.92, 0.88])
-        graph_data = generate_graph_base64(fig)
-        
-        total_revenue = df['revenue'].sum()
-        avg_daily_revenue = df['revenue'].mean()
-        
-        return jsonify({
-            'graph': graph_data,
-            'data': data,
-            'summary': {
-                'total_revenue': round(total_revenue, 2),
-                'avg_daily_revenue': round(avg_daily_revenue, 2),
-                'total_reservations': int(df['reservations'].sum()),
-                'avg_daily_reservations': round(df['reservations'].mean(), 1)
-            }
-        }), 200
-        
+        total_revenue = sum(row['revenue'] for row in data)
+        total_reservations = sum(row['reservations'] for row in data)
+        return graph_response('revenue', render_revenue_graph, data, {
+            'total_revenue': round(total_revenue, 2),
+            'avg_daily_revenue': round(total_revenue / len(data), 2),
+            'total_reservations': total_reservations,
+            'avg_daily_reservations': round(total_reservations / len(data), 1)
+        })
+        
+    except (GraphPoolSaturated, TimeoutError):
+        return pool_busy_response()
     except Exception as e:
         logger.error(f"Error generating revenue graph: {e}")
         return jsonify({'error': 'Failed to generate graph'}), 500
 
 # USER API ENDPOINTS
+def send_reservation_confirmation(user_details, reservation):
+    """Email the booking confirmation for an auto-allocated spot"""
+    if user_details and user_details['email']:
+        subject, reservation_email_body = render_notification('booking_confirmation', {
+            'username': user_details['username'],
+            'reservation': reservation,
+        })
+
+        queue_email(user_details['email'], subject, reservation_email_body,
+                    email_type='reservation_confirmation', user_id=reservation['user_id'],
+                    dedup_key=f"reservation_confirmation:{reservation['id']}")
+
+def send_spot_reservation_confirmation(user_details, reservation):
+    """Email the booking confirmation for a user-selected spot"""
+    if user_details and user_details['email']:
+        subject, reservation_email_body = render_notification('spot_booking_confirmation', {
+            'username': user_details['username'],
+            'reservation': reservation,
+        })
+
+        queue_email(
+            user_details['email'], 
+            subject, 
+            reservation_email_body,
+            email_type='reservation_confirmation',
+            user_id=reservation['user_id'],
+            dedup_key=f"reservation_confirmation:{reservation['id']}"
+        )
+
 @app.route('/api/user/parking-lots', methods=['GET'])
 @login_required
 def user_parking_lots():
     """Get available parking lots for users"""
     
-    @cached(timeout=CACHE_TIMEOUT, key_prefix='user')
+    # Full lots stay in the cached list, tagged like the others, so a spot
+    # freed in one of them drops the entry
+    @cached(timeout=CACHE_TIMEOUT, key_prefix='user', tags=lot_cache_tags)
     def get_user_parking_lots():
-        conn = get_db()
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                pl.*,
-                COUNT(ps.id) as total_spots,
-                SUM(CASE WHEN ps.status = 'A' THEN 1 ELSE 0 END) as available_spots
-            FROM parking_lots pl
-            LEFT JOIN parking_spots ps ON pl.id = ps.lot_id
-            GROUP BY pl.id
-            HAVING available_spots > 0
-            ORDER BY pl.prime_location_name
-        ''')
-        
-        lots = cursor.fetchall()
-        conn.close()
-        return lots
+        with db_connection(dict_factory) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    pl.*,
+                    COUNT(ps.id) as total_spots,
+                    SUM(CASE WHEN ps.status = 'A' THEN 1 ELSE 0 END) as available_spots
+                FROM parking_lots pl
+                LEFT JOIN parking_spots ps ON pl.id = ps.lot_id
+                GROUP BY pl.id
+                ORDER BY pl.prime_location_name
+            ''')
+            return cursor.fetchall()
     
-    lots = get_user_parking_lots()
+    lots = [lot for lot in get_user_parking_lots() if lot['available_spots'] > 0]
     return jsonify({'parking_lots': lots}), 200
 
 @app.route('/api/user/reserve-spot', methods=['POST'])
@@ -3278,10 +5398,20 @@ def user_reserve_spot():
         if not lot_id:
             return jsonify({'error': 'Lot ID is required'}), 400
         
+        if RESERVATION_ALLOCATION_MODE == 'redis':
+            try:
+                return reserve_with_redis_claim(request.current_user['user_id'], lot_id)
+            except redis.RedisError as e:
+                logger.warning(f"Redis allocation unavailable, falling back to SQLite: {e}")
+        
         conn = get_db()
         conn.row_factory = dict_factory
         cursor = conn.cursor()
         
+        # Pick the candidate spot from the free-spot index before taking the
+        # write lock; the transaction below only has to confirm it.
+        candidate = claim_free_spot(lot_id)
+        
         cursor.execute('BEGIN IMMEDIATE')
         
         try:
@@ -3294,19 +5424,36 @@ def user_reserve_spot():
             if cursor.fetchone():
                 cursor.execute('ROLLBACK')
                 conn.close()
+                if candidate:
+                    release_free_spot(lot_id, *candidate)
                 return jsonify({'error': 'You already have an active reservation'}), 400
             
-            cursor.execute('''
-                SELECT id FROM parking_spots 
-                WHERE lot_id = ? AND status = 'A' 
-                ORDER BY spot_number LIMIT 1
-            ''', (lot_id,))
+            spot = None
+            if candidate:
+                cursor.execute('''
+                    UPDATE parking_spots SET status = 'O'
+                    WHERE id = ? AND lot_id = ? AND status = 'A'
+                ''', (candidate[0], lot_id))
+                if cursor.rowcount == 1:
+                    spot = {'id': candidate[0]}
             
-            spot = cursor.fetchone()
             if not spot:
-                cursor.execute('ROLLBACK')
-                conn.close()
-                return jsonify({'error': 'No available spots in this parking lot'}), 400
+                # Index empty, stale or unavailable - fall back to the table
+                cursor.execute('''
+                    SELECT id FROM parking_spots 
+                    WHERE lot_id = ? AND status = 'A' 
+                    ORDER BY spot_number LIMIT 1
+                ''', (lot_id,))
+                
+                spot = cursor.fetchone()
+                if not spot:
+                    cursor.execute('ROLLBACK')
+                    conn.close()
+                    return jsonify({'error': 'No available spots in this parking lot'}), 400
+                
+                cursor.execute('UPDATE parking_spots SET status = "O" WHERE id = ?', (spot['id'],))
+                if candidate:
+                    invalidate_free_spot_index(lot_id)
             
             cursor.execute('''
                 INSERT INTO reservations (spot_id, user_id, status)
@@ -3315,8 +5462,9 @@ def user_reserve_spot():
             
             reservation_id = cursor.lastrowid
             
-            cursor.execute('UPDATE parking_spots SET status = "O" WHERE id = ?', (spot['id'],))
             cursor.execute('COMMIT')
+            candidate = None
+            mark_active_reservation(request.current_user['user_id'], reservation_id)
             
             cursor.execute('''
                 SELECT 
@@ -3338,47 +5486,9 @@ def user_reserve_spot():
             
             conn.close()
             
-            if user_details and user_details['email']:
-                reservation_email_body = f"""
-                <html>
-                <body>
-                    <h2>Parking Spot Reserved Successfully! 🅿️</h2>
-                    <p>Dear {user_details['username']},</p>
-                    <p>Your parking spot has been successfully reserved. Here are the details:</p>
-                    
-                    <div style="background-color: #e8f5e8; padding: 20px; border-radius: 5px; margin: 20px 0; border-left: 4px solid #4CAF50;">
-                        <h3>Reservation Details:</h3>
-                        <p><strong>Reservation ID:</strong> #{reservation_id}</p>
-                        <p><strong>Parking Lot:</strong> {reservation['prime_location_name']}</p>
-                        <p><strong>Spot Number:</strong> {reservation['spot_number']}</p>
-                        <p><strong>Address:</strong> {reservation['address']}</p>
-                        <p><strong>Price:</strong> ${reservation['price']}/hour</p>
-                        <p><strong>Reserved At:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                        <p><strong>Status:</strong> Active</p>
-                    </div>
-                    
-                    <div style="background-color: #fff3cd; padding: 15px; border-radius: 5px; margin: 20px 0; border-left: 4px solid #ffc107;">
-                        <h3>Important Notes:</h3>
-                        <ul>
-                            <li>Your parking spot is now reserved and secured</li>
-                            <li>Please arrive at the location to start your parking session</li>
-                            <li>Don't forget to check in when you arrive</li>
-                            <li>You can view your reservation details in your dashboard</li>
-                        </ul>
-                    </div>
-                    
-                    <p>Thank you for using ParkMate!</p>
-                    <p>Safe travels! 🚗</p>
-                    
-                    <p>Best regards,<br>
-                    <strong>The ParkMate Team</strong></p>
-                </body>
-                </html>
-                """
-                
-                send_email(user_details['email'], f"Parking Reserved - {reservation['prime_location_name']}", reservation_email_body)
+            send_reservation_confirmation(user_details, reservation)
             
-            robust_cache_invalidation()
+            invalidate_cache_tags(f'lot:{lot_id}', f"user:{request.current_user['user_id']}")
             
             logger.info(f"User {request.current_user['user_id']} reserved spot {reservation['spot_number']} at {reservation['prime_location_name']}")
             
@@ -3388,7 +5498,10 @@ def user_reserve_spot():
             }), 201
             
         except Exception as e:
-            cursor.execute('ROLLBACK')
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            if candidate:
+                release_free_spot(lot_id, *candidate)
             raise e
             
     except Exception as e:
@@ -3425,7 +5538,7 @@ def user_park_vehicle():
         conn.commit()
         conn.close()
         
-        invalidate_cache_pattern(f'*user:{request.current_user["user_id"]}*')
+        invalidate_cache_tags(f'user:{request.current_user["user_id"]}')
         
         return jsonify({
             'message': 'Vehicle parked successfully',
@@ -3485,227 +5598,203 @@ def user_release_spot():
             except ValueError:
                 return jsonify({'error': 'Invalid expiry date'}), 400
         
-        conn = get_db()
-        conn.row_factory = dict_factory
-        cursor = conn.cursor()
-        
-        cursor.execute('BEGIN IMMEDIATE')
+        user_id = request.current_user['user_id']
         
-        try:
-            cursor.execute('''
-                SELECT 
-                    r.*,
-                    ps.spot_number,
-                    pl.price,
-                    pl.prime_location_name,
-                    pl.address
-                FROM reservations r
-                JOIN parking_spots ps ON r.spot_id = ps.id
-                JOIN parking_lots pl ON ps.lot_id = pl.id
-                WHERE r.id = ? AND r.user_id = ? AND r.status = 'active'
-            ''', (reservation_id, request.current_user['user_id']))
-            
-            reservation = cursor.fetchone()
-            if not reservation:
-                cursor.execute('ROLLBACK')
-                conn.close()
-                return jsonify({'error': 'Invalid reservation'}), 400
-            
-            if not reservation['parking_timestamp']:
-                cursor.execute('ROLLBACK')
-                conn.close()
-                return jsonify({'error': 'Vehicle not yet parked'}), 400
-            
-            leaving_time = datetime.now()
-            parking_start = datetime.fromisoformat(reservation['parking_timestamp'])
-            duration_hours = max(1, (leaving_time - parking_start).total_seconds() / 3600)
-            parking_cost = duration_hours * reservation['price']
-            
-            # Create payment transaction
-            import uuid
-            transaction_id = f"PAY_{uuid.uuid4().hex[:12].upper()}"
-            
-            # Store payment details securely (in real world, encrypt sensitive data)
-            if payment_method == 'upi':
-                payment_details_json = json.dumps({
-                    'upi_id': payment_details['upi_id'],
-                    'method': 'upi'
-                })
-            else:  # card
-                # In production, never store full card details
-                payment_details_json = json.dumps({
-                    'method': 'card',
-                    'last_4_digits': card_number[-4:],
-                    'cardholder_name': card_details['cardholder_name'],
-                    'expiry': f"{card_details['expiry_month']}/{card_details['expiry_year']}"
-                })
-            
-            # Simulate payment processing
-            import random
-            time.sleep(1)  # Simulate processing time
-            
-            # 95% success rate for demo
-            payment_success = random.random() < 0.95
-            
-            cursor.execute('''
-                INSERT INTO payment_transactions 
-                (reservation_id, user_id, payment_method, payment_details, amount, transaction_id, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                reservation_id,
-                request.current_user['user_id'], 
-                payment_method, 
-                payment_details_json, 
-                parking_cost, 
-                transaction_id,
-                'completed' if payment_success else 'failed'
-            ))
+        # Phase 1: price the session and record a pending payment
+        with db_connection(dict_factory) as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
             
-            if not payment_success:
+            try:
+                cursor.execute('''
+                    SELECT 
+                        r.*,
+                        ps.spot_number,
+                        ps.lot_id,
+                        pl.price,
+                        pl.prime_location_name,
+                        pl.address
+                    FROM reservations r
+                    JOIN parking_spots ps ON r.spot_id = ps.id
+                    JOIN parking_lots pl ON ps.lot_id = pl.id
+                    WHERE r.id = ? AND r.user_id = ? AND r.status = 'active'
+                ''', (reservation_id, user_id))
+                
+                reservation = cursor.fetchone()
+                if not reservation:
+                    cursor.execute('ROLLBACK')
+                    return jsonify({'error': 'Invalid reservation'}), 400
+                
+                if not reservation['parking_timestamp']:
+                    cursor.execute('ROLLBACK')
+                    return jsonify({'error': 'Vehicle not yet parked'}), 400
+                
+                # A pending payment older than the timeout was abandoned mid-flight
+                pending_cutoff = f'-{PAYMENT_PENDING_TIMEOUT_MINUTES} minutes'
+                cursor.execute('''
+                    UPDATE payment_transactions 
+                    SET status = 'expired', processed_at = CURRENT_TIMESTAMP
+                    WHERE reservation_id = ? AND status = 'pending' AND created_at <= datetime('now', ?)
+                ''', (reservation_id, pending_cutoff))
+                
+                cursor.execute(
+                    "SELECT transaction_id FROM payment_transactions WHERE reservation_id = ? AND status = 'pending'",
+                    (reservation_id,)
+                )
+                if cursor.fetchone():
+                    cursor.execute('ROLLBACK')
+                    return jsonify({'error': 'Payment for this reservation is already in progress'}), 409
+                
+                leaving_time = datetime.now()
+                parking_start = datetime.fromisoformat(reservation['parking_timestamp'])
+                duration_hours = max(1, (leaving_time - parking_start).total_seconds() / 3600)
+                parking_cost = duration_hours * reservation['price']
+                
+                transaction_id = f"PAY_{uuid.uuid4().hex[:12].upper()}"
+                
+                # Store payment details securely (in real world, encrypt sensitive data)
+                if payment_method == 'upi':
+                    payment_details_json = json.dumps({
+                        'upi_id': payment_details['upi_id'],
+                        'method': 'upi'
+                    })
+                else:  # card
+                    # In production, never store full card details
+                    payment_details_json = json.dumps({
+                        'method': 'card',
+                        'last_4_digits': card_number[-4:],
+                        'cardholder_name': card_details['cardholder_name'],
+                        'expiry': f"{card_details['expiry_month']}/{card_details['expiry_year']}"
+                    })
+                
+                cursor.execute('''
+                    INSERT INTO payment_transactions 
+                    (reservation_id, user_id, payment_method, payment_details, amount, transaction_id, status)
+                    VALUES (?, ?, ?, ?, ?, ?, 'pending')
+                ''', (
+                    reservation_id,
+                    user_id, 
+                    payment_method, 
+                    payment_details_json, 
+                    parking_cost, 
+                    transaction_id
+                ))
+                
+                cursor.execute('COMMIT')
+            except Exception:
                 cursor.execute('ROLLBACK')
-                conn.close()
-                return jsonify({
-                    'error': 'Payment failed. Please try again.',
-                    'transaction_id': transaction_id,
-                    'amount': round(parking_cost, 2)
-                }), 400
-            
-            cursor.execute('''
-                UPDATE reservations 
-                SET leaving_timestamp = ?, parking_cost = ?, status = 'completed'
-                WHERE id = ?
-            ''', (leaving_time, parking_cost, reservation_id))
-            
-            cursor.execute('UPDATE parking_spots SET status = "A" WHERE id = ?', (reservation['spot_id'],))
-            
-            # Update payment transaction with processed timestamp
-            cursor.execute('''
-                UPDATE payment_transactions 
-                SET processed_at = CURRENT_TIMESTAMP
-                WHERE transaction_id = ?
-            ''', (transaction_id,))
-            
-            #gets user details for email notification before committing
-            cursor.execute('SELECT email, username FROM users WHERE id = ?', (request.current_user['user_id'],))
-            user_details = cursor.fetchone()
-            
-            cursor.execute('COMMIT')
-            
-            conn.close()
-            
-            robust_cache_invalidation()
+                raise
+        
+        # Phase 2: talk to the gateway without holding any database lock
+        try:
+            payment_success = get_payment_gateway().charge(
+                transaction_id, round(parking_cost, 2), payment_method, payment_details
+            )
+        except Exception as e:
+            logger.error(f"Payment gateway error for {transaction_id}: {e}")
+            payment_success = False
+        
+        # Phase 3: settle the payment and free the spot in a short transaction
+        with db_connection(dict_factory) as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
             
-            #sends release confirmation email with payment details
-            if user_details:
-                payment_method_display = "UPI Payment" if payment_method == 'upi' else "Card Payment"
-                payment_info = payment_details['upi_id'] if payment_method == 'upi' else f"**** **** **** {card_number[-4:]}"
+            try:
+                if not payment_success:
+                    cursor.execute('''
+                        UPDATE payment_transactions 
+                        SET status = 'failed', processed_at = CURRENT_TIMESTAMP
+                        WHERE transaction_id = ?
+                    ''', (transaction_id,))
+                    cursor.execute('COMMIT')
+                    return jsonify({
+                        'error': 'Payment failed. Please try again.',
+                        'transaction_id': transaction_id,
+                        'amount': round(parking_cost, 2)
+                    }), 400
                 
-                release_email_body = f"""
-                <html>
-                <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                    <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                        <div style="background: linear-gradient(135deg, #4CAF50 0%, #45a049 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                            <h1 style="margin: 0; font-size: 28px;">✅ Payment Successful!</h1>
-                        </div>
-                        
-                        <div style="background: white; padding: 30px; border: 1px solid #ddd; border-radius: 0 0 10px 10px;">
-                            <h2 style="color: #4CAF50; margin-top: 0;">Hello {user_details['username']}!</h2>
-                            
-                            <p>Thank you! Your payment has been processed successfully and your parking session is now complete.</p>
-                            
-                            <div style="background: #e8f5e9; padding: 20px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #4CAF50;">
-                                <h3 style="color: #2e7d32; margin-top: 0;">💳 Payment Details</h3>
-                                <table style="width: 100%; border-collapse: collapse;">
-                                    <tr style="border-bottom: 1px solid #c8e6c9;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Transaction ID:</td>
-                                        <td style="padding: 8px 0; color: #2e7d32; font-weight: bold;">{transaction_id}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #c8e6c9;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Payment Method:</td>
-                                        <td style="padding: 8px 0;">{payment_method_display}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #c8e6c9;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Payment Info:</td>
-                                        <td style="padding: 8px 0;">{payment_info}</td>
-                                    </tr>
-                                    <tr>
-                                        <td style="padding: 8px 0; font-weight: bold;">Amount Paid:</td>
-                                        <td style="padding: 8px 0; color: #2e7d32; font-weight: bold; font-size: 18px;">${round(parking_cost, 2)}</td>
-                                    </tr>
-                                </table>
-                            </div>
-                            
-                            <div style="background: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                                <h3 style="color: #495057; margin-top: 0;">🅿️ Parking Session Summary</h3>
-                                <table style="width: 100%; border-collapse: collapse;">
-                                    <tr style="border-bottom: 1px solid #dee2e6;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Parking Spot:</td>
-                                        <td style="padding: 8px 0;">#{reservation['spot_number']}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #dee2e6;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Location:</td>
-                                        <td style="padding: 8px 0;">{reservation.get('prime_location_name', 'N/A')}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #dee2e6;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Parked At:</td>
-                                        <td style="padding: 8px 0;">{parking_start.strftime('%Y-%m-%d %H:%M:%S')}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #dee2e6;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Left At:</td>
-                                        <td style="padding: 8px 0;">{leaving_time.strftime('%Y-%m-%d %H:%M:%S')}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #dee2e6;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Duration:</td>
-                                        <td style="padding: 8px 0;">{round(duration_hours, 2)} hours</td>
-                                    </tr>
-                                    <tr>
-                                        <td style="padding: 8px 0; font-weight: bold;">Rate:</td>
-                                        <td style="padding: 8px 0;">${reservation['price']}/hour</td>
-                                    </tr>
-                                </table>
-                            </div>
-                            
-                            <div style="text-align: center; margin-top: 30px;">
-                                <p style="color: #4CAF50; font-weight: bold; font-size: 16px;">
-                                    Payment completed successfully! Thank you for using ParkMate! 🚗
-                                </p>
-                                <p style="color: #6c757d; font-size: 14px;">
-                                    Keep this email as your receipt.<br>
-                                    <strong>The ParkMate Team</strong>
-                                </p>
-                            </div>
-                        </div>
-                    </div>
-                </body>
-                </html>
-                """
+                cursor.execute('''
+                    UPDATE reservations 
+                    SET leaving_timestamp = ?, parking_cost = ?, status = 'completed'
+                    WHERE id = ? AND status = 'active'
+                ''', (leaving_time, parking_cost, reservation_id))
                 
-                #send the email asynchronously
-                try:
-                    send_email(user_details['email'], f"Payment Receipt - Spot #{reservation['spot_number']} (${round(parking_cost, 2)})", release_email_body)
-                    logger.info(f"Payment receipt email sent to {user_details['email']}")
-                except Exception as email_error:
-                    logger.error(f"Failed to send payment receipt email: {email_error}")
-            
-            logger.info(f"User {request.current_user['user_id']} released spot {reservation['spot_number']}, paid: ${round(parking_cost, 2)} - Transaction: {transaction_id}")
-            
-            return jsonify({
-                'message': 'Payment successful! Spot released.',
-                'leaving_timestamp': leaving_time.isoformat(),
-                'parking_cost': round(parking_cost, 2),
-                'duration_hours': round(duration_hours, 2),
-                'payment': {
-                    'transaction_id': transaction_id,
-                    'amount': round(parking_cost, 2),
-                    'method': payment_method,
-                    'status': 'completed'
-                }
-            }), 200
-            
-        except Exception as e:
-            cursor.execute('ROLLBACK')
-            conn.close()
-            raise e
+                if cursor.rowcount != 1:
+                    # Freed by an admin while the payment was in flight
+                    cursor.execute('''
+                        UPDATE payment_transactions 
+                        SET status = 'refund_required', processed_at = CURRENT_TIMESTAMP
+                        WHERE transaction_id = ?
+                    ''', (transaction_id,))
+                    cursor.execute('COMMIT')
+                    logger.error(f"Reservation {reservation_id} ended during payment {transaction_id}; refund required")
+                    return jsonify({
+                        'error': 'Reservation is no longer active. The payment will be refunded.',
+                        'transaction_id': transaction_id,
+                        'amount': round(parking_cost, 2)
+                    }), 409
+                
+                cursor.execute('UPDATE parking_spots SET status = "A" WHERE id = ?', (reservation['spot_id'],))
+                
+                cursor.execute('''
+                    UPDATE payment_transactions 
+                    SET status = 'completed', processed_at = CURRENT_TIMESTAMP
+                    WHERE transaction_id = ?
+                ''', (transaction_id,))
+                
+                #gets user details for email notification before committing
+                cursor.execute('SELECT email, username FROM users WHERE id = ?', (user_id,))
+                user_details = cursor.fetchone()
+                
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+        
+        release_free_spot(reservation['lot_id'], reservation['spot_id'], reservation['spot_number'])
+        clear_active_reservation(user_id)
+        invalidate_cache_tags(f"lot:{reservation['lot_id']}", f'user:{user_id}')
+        
+        #sends release confirmation email with payment details
+        if user_details:
+            payment_method_display = "UPI Payment" if payment_method == 'upi' else "Card Payment"
+            payment_info = payment_details['upi_id'] if payment_method == 'upi' else f"**** **** **** {card_number[-4:]}"
+            
+            subject, release_email_body = render_notification('payment_receipt', {
+                'username': user_details['username'],
+                'transaction_id': transaction_id,
+                'payment_method_display': payment_method_display,
+                'payment_info': payment_info,
+                'amount': round(parking_cost, 2),
+                'reservation': reservation,
+                'parked_at': parking_start,
+                'left_at': leaving_time,
+                'duration_hours': duration_hours,
+            })
+            
+            #queue the email for the outbox sender
+            try:
+                queue_email(user_details['email'], subject, release_email_body,
+                            email_type='payment_receipt', user_id=request.current_user['user_id'],
+                            dedup_key=f"payment_receipt:{transaction_id}")
+                logger.info(f"Payment receipt email queued for {user_details['email']}")
+            except Exception as email_error:
+                logger.error(f"Failed to queue payment receipt email: {email_error}")
+        
+        logger.info(f"User {request.current_user['user_id']} released spot {reservation['spot_number']}, paid: ${round(parking_cost, 2)} - Transaction: {transaction_id}")
+        
+        return jsonify({
+            'message': 'Payment successful! Spot released.',
+            'leaving_timestamp': leaving_time.isoformat(),
+            'parking_cost': round(parking_cost, 2),
+            'duration_hours': round(duration_hours, 2),
+            'payment': {
+                'transaction_id': transaction_id,
+                'amount': round(parking_cost, 2),
+                'method': payment_method,
+                'status': 'completed'
+            }
+        }), 200
             
     except Exception as e:
         logger.error(f"Error in user_release_spot with payment: {e}")
@@ -3735,6 +5824,7 @@ def user_release_spot_legacy():
                 SELECT 
                     r.*,
                     ps.spot_number,
+                    ps.lot_id,
                     pl.price,
                     pl.prime_location_name,
                     pl.address
@@ -3772,7 +5862,9 @@ def user_release_spot_legacy():
             
             conn.close()
             
-            robust_cache_invalidation()
+            release_free_spot(reservation['lot_id'], reservation['spot_id'], reservation['spot_number'])
+            clear_active_reservation(request.current_user['user_id'])
+            invalidate_cache_tags(f"lot:{reservation['lot_id']}", f"user:{request.current_user['user_id']}")
             
             logger.info(f"User {request.current_user['user_id']} released spot {reservation['spot_number']} (legacy), cost: ${round(parking_cost, 2)}")
             
@@ -3849,6 +5941,18 @@ def user_reserve_specific_spot():
         if not spot_id:
             return jsonify({'error': 'Spot ID is required'}), 400
         
+        if RESERVATION_ALLOCATION_MODE == 'redis':
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT lot_id FROM parking_spots WHERE id = ?', (spot_id,))
+                spot = cursor.fetchone()
+            if not spot:
+                return jsonify({'error': 'Parking spot not found'}), 404
+            try:
+                return reserve_with_redis_claim(request.current_user['user_id'], spot[0], spot_id)
+            except redis.RedisError as e:
+                logger.warning(f"Redis allocation unavailable, falling back to SQLite: {e}")
+        
         conn = get_db()
         conn.row_factory = dict_factory
         cursor = conn.cursor()
@@ -3907,6 +6011,8 @@ def user_reserve_specific_spot():
             cursor.execute('UPDATE parking_spots SET status = "O" WHERE id = ?', (spot_id,))
             
             cursor.execute('COMMIT')
+            discard_free_spot(spot['lot_id'], spot_id)
+            mark_active_reservation(request.current_user['user_id'], reservation_id)
             
             # Get the complete reservation details
             cursor.execute('''
@@ -3931,82 +6037,9 @@ def user_reserve_specific_spot():
             conn.close()
             
             # Send confirmation email
-            if user_details and user_details['email']:
-                reservation_email_body = f"""
-                <html>
-                <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                    <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                        <div style="background: linear-gradient(135deg, #64b5f6 0%, #1976d2 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                            <h1 style="margin: 0; font-size: 28px;">🅿️ Parking Spot Reserved!</h1>
-                        </div>
-                        
-                        <div style="background: white; padding: 30px; border: 1px solid #ddd; border-radius: 0 0 10px 10px;">
-                            <h2 style="color: #1976d2; margin-top: 0;">Hello {user_details['username']}!</h2>
-                            
-                            <p>Great! Your specific parking spot has been successfully reserved.</p>
-                            
-                            <div style="background: #e3f2fd; padding: 20px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #1976d2;">
-                                <h3 style="color: #0d47a1; margin-top: 0;">Reservation Details</h3>
-                                <table style="width: 100%; border-collapse: collapse;">
-                                    <tr style="border-bottom: 1px solid #bbdefb;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Reservation ID:</td>
-                                        <td style="padding: 8px 0;">#{reservation_id}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #bbdefb;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Parking Lot:</td>
-                                        <td style="padding: 8px 0;">{reservation['prime_location_name']}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #bbdefb;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Your Spot Number:</td>
-                                        <td style="padding: 8px 0; color: #1976d2; font-weight: bold; font-size: 18px;">#{reservation['spot_number']}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #bbdefb;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Address:</td>
-                                        <td style="padding: 8px 0;">{reservation['address']}</td>
-                                    </tr>
-                                    <tr style="border-bottom: 1px solid #bbdefb;">
-                                        <td style="padding: 8px 0; font-weight: bold;">Rate:</td>
-                                        <td style="padding: 8px 0;">${reservation['price']}/hour</td>
-                                    </tr>
-                                    <tr>
-                                        <td style="padding: 8px 0; font-weight: bold;">Reserved At:</td>
-                                        <td style="padding: 8px 0;">{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</td>
-                                    </tr>
-                                </table>
-                            </div>
-                            
-                            <div style="background: #f3e5f5; padding: 20px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #9c27b0;">
-                                <h3 style="color: #4a148c; margin-top: 0;">📍 What's Next?</h3>
-                                <ol style="color: #4a148c; margin: 0;">
-                                    <li><strong>Navigate to:</strong> {reservation['address']}</li>
-                                    <li><strong>Look for spot:</strong> #{reservation['spot_number']}</li>
-                                    <li><strong>Park your vehicle</strong> in your reserved spot</li>
-                                    <li><strong>Payment:</strong> You'll pay when you leave the parking</li>
-                                </ol>
-                            </div>
-                            
-                            <div style="text-align: center; margin-top: 30px;">
-                                <p style="color: #1976d2; font-weight: bold; font-size: 16px;">
-                                    Your spot is secured! Pay when you leave! 🚗
-                                </p>
-                                <p style="color: #6c757d; font-size: 14px;">
-                                    Best regards,<br>
-                                    <strong>The ParkMate Team</strong>
-                                </p>
-                            </div>
-                        </div>
-                    </div>
-                </body>
-                </html>
-                """
-                
-                send_email(
-                    user_details['email'], 
-                    f"Spot #{reservation['spot_number']} Reserved - {reservation['prime_location_name']}", 
-                    reservation_email_body
-                )
+            send_spot_reservation_confirmation(user_details, reservation)
             
-            robust_cache_invalidation()
+            invalidate_cache_tags(f"lot:{spot['lot_id']}", f"user:{request.current_user['user_id']}")
             
             logger.info(f"User {request.current_user['user_id']} reserved specific spot {reservation['spot_number']} (ID: {spot_id}) at {reservation['prime_location_name']}")
             
@@ -4214,6 +6247,8 @@ def user_reserve_specific_spot_legacy():
             cursor.execute('UPDATE parking_spots SET status = "O" WHERE id = ?', (spot_id,))
             
             cursor.execute('COMMIT')
+            discard_free_spot(spot['lot_id'], spot_id)
+            mark_active_reservation(request.current_user['user_id'], reservation_id)
             
             # Get the complete reservation details
             cursor.execute('''
@@ -4232,7 +6267,7 @@ def user_reserve_specific_spot_legacy():
             reservation = cursor.fetchone()
             
             conn.close()
-            robust_cache_invalidation()
+            invalidate_cache_tags(f"lot:{spot['lot_id']}", f"user:{request.current_user['user_id']}")
             
             return jsonify({
                 'message': f'Spot #{spot["spot_number"]} reserved successfully (Legacy)',
@@ -4274,7 +6309,10 @@ def user_reservations():
         reservations = cursor.fetchall()
         conn.close()
         
-        return jsonify({'reservations': reservations}), 200
+        return jsonify({
+            'reservations': reservations,
+            'failed_claim': get_failed_claim(request.current_user['user_id'])
+        }), 200
         
     except Exception as e:
         logger.error(f"Error fetching user reservations: {e}")
@@ -4285,7 +6323,7 @@ def user_reservations():
 def user_analytics():
     """Get user analytics data"""
     
-    @cached(timeout=ANALYTICS_CACHE_TIMEOUT, key_prefix=f'user:{request.current_user["user_id"]}')
+    @cached(timeout=ANALYTICS_CACHE_TIMEOUT, key_prefix=f'user:{request.current_user["user_id"]}', tags=(f'user:{request.current_user["user_id"]}', 'analytics'))
     def get_user_analytics():
         conn = get_db()
         conn.row_factory = dict_factory
@@ -4378,6 +6416,13 @@ def user_preferences():
             reminder_time = data.get('reminder_time', '18:00')
             notification_method = data.get('notification_method', 'email')
             
+            # Stored zero-padded so the reminder job can compare 'HH:MM' strings
+            try:
+                reminder_time = datetime.strptime(reminder_time, '%H:%M').strftime('%H:%M')
+            except (TypeError, ValueError):
+                conn.close()
+                return jsonify({'error': 'reminder_time must be in HH:MM format'}), 400
+            
             cursor.execute('''
                 INSERT OR REPLACE INTO user_preferences 
                 (user_id, reminder_enabled, reminder_time, notification_method, updated_at)
@@ -4468,6 +6513,7 @@ def cache_stats():
     try:
         info = redis_client.info()
         return jsonify({
+            'prefixes': get_cache_stats(),
             'redis_info': {
                 'version': info.get('redis_version'),
                 'used_memory': info.get('used_memory_human'),
@@ -4487,14 +6533,20 @@ def clear_cache():
     """Clear Redis cache"""
     
     try:
-        data = request.json
-        pattern = data.get('pattern', '*')
+        data = request.json or {}
+        tags = data.get('tags')
+        if tags:
+            cleared = invalidate_cache_tags(*tags)
+            return jsonify({
+                'message': f'Cleared {cleared} cache keys tagged: {", ".join(tags)}'
+            }), 200
         
-        keys = redis_client.keys(pattern)
-        if keys:
-            redis_client.delete(*keys)
+        # Defaults to the cache namespace so allocation and rate-limit state survive
+        pattern = data.get('pattern', f'{CACHE_KEY_NAMESPACE}:*')
+        cleared = invalidate_cache_pattern(pattern)
+        if cleared:
             return jsonify({
-                'message': f'Cleared {len(keys)} cache keys matching pattern: {pattern}'
+                'message': f'Cleared {cleared} cache keys matching pattern: {pattern}'
             }), 200
         else:
             return jsonify({
@@ -4504,6 +6556,133 @@ def clear_cache():
     except redis.RedisError as e:
         return jsonify({'error': f'Redis error: {e}'}), 500
 
+@app.route('/api/admin/email-outbox', methods=['GET'])
+@admin_required
+def email_outbox_status():
+    """Outbox counts by status, SMTP delivery metrics and the most recent dead letters"""
+    
+    with db_connection(dict_factory) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT status, COUNT(*) as count FROM email_outbox GROUP BY status')
+        counts = {row['status']: row['count'] for row in cursor.fetchall()}
+        
+        cursor.execute('''
+            SELECT id, to_email, subject, email_type, attempts, last_error, created_at
+            FROM email_outbox
+            WHERE status = 'dead'
+            ORDER BY id DESC
+            LIMIT 50
+        ''')
+        dead_letters = cursor.fetchall()
+    
+    try:
+        delivery = get_email_stats()
+    except redis.RedisError as e:
+        logger.warning(f"Email stats read error: {e}")
+        delivery = None
+    
+    return jsonify({
+        'counts': counts,
+        'delivery': delivery,
+        'dead_letters': dead_letters
+    }), 200
+
+@app.route('/api/admin/email-outbox/retry', methods=['POST'])
+@admin_required
+def retry_dead_emails():
+    """Send dead-lettered emails again (all of them, or the given ids)"""
+    
+    ids = (request.json or {}).get('ids')
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        if ids:
+            placeholders = ','.join('?' * len(ids))
+            cursor.execute(f'''
+                UPDATE email_outbox
+                SET status = 'pending', attempts = 0, next_attempt_at = CURRENT_TIMESTAMP
+                WHERE status = 'dead' AND id IN ({placeholders})
+            ''', ids)
+        else:
+            cursor.execute('''
+                UPDATE email_outbox
+                SET status = 'pending', attempts = 0, next_attempt_at = CURRENT_TIMESTAMP
+                WHERE status = 'dead'
+            ''')
+        requeued = cursor.rowcount
+        conn.commit()
+    
+    if requeued:
+        schedule_outbox_delivery()
+    return jsonify({'message': f'Requeued {requeued} emails'}), 200
+
+@app.route('/api/admin/notification-templates', methods=['GET'])
+@admin_required
+def list_notification_templates():
+    """Built-in notification templates and their database overrides"""
+    
+    with db_connection(dict_factory) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM notification_templates ORDER BY template_name')
+        overrides = {row['template_name']: row for row in cursor.fetchall()}
+    
+    templates = []
+    for name in sorted(set(DEFAULT_NOTIFICATION_TEMPLATES) | set(overrides)):
+        templates.append({
+            'template_name': name,
+            'default_subject': DEFAULT_NOTIFICATION_TEMPLATES.get(name),
+            'override': overrides.get(name)
+        })
+    return jsonify({'templates': templates}), 200
+
+@app.route('/api/admin/notification-templates/<template_name>', methods=['PUT'])
+@admin_required
+def update_notification_template(template_name):
+    """Create or update the database override of a notification template"""
+    
+    data = request.json or {}
+    subject_template = data.get('subject_template')
+    body_template = data.get('body_template')
+    is_active = 1 if data.get('is_active', True) else 0
+    
+    if not subject_template or body_template is None:
+        return jsonify({'error': 'subject_template and body_template are required'}), 400
+    
+    try:
+        if BUILTIN_TEMPLATE_BODY.fullmatch(body_template.strip()) or not body_template.strip():
+            if template_name not in DEFAULT_NOTIFICATION_TEMPLATES:
+                return jsonify({'error': 'Only built-in templates can reuse the default body'}), 400
+            notification_templates.subject_env.from_string(subject_template)
+        else:
+            notification_templates.compile(subject_template, body_template)
+    except TemplateError as e:
+        return jsonify({'error': f'Template syntax error: {e}'}), 400
+    
+    with db_connection() as conn:
+        conn.execute('''
+            INSERT INTO notification_templates (template_name, template_type, subject_template, body_template, is_active)
+            VALUES (?, 'email', ?, ?, ?)
+            ON CONFLICT (template_name) DO UPDATE SET
+                subject_template = excluded.subject_template,
+                body_template = excluded.body_template,
+                is_active = excluded.is_active,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (template_name, subject_template, body_template, is_active))
+        conn.commit()
+    
+    # Other workers pick the change up within NOTIFICATION_TEMPLATE_RELOAD_INTERVAL
+    notification_templates.refresh(force=True)
+    return jsonify({'message': f'Template {template_name} saved'}), 200
+
+@app.route('/api/admin/batch-jobs/<int:job_id>', methods=['GET'])
+@admin_required
+def batch_job_status(job_id):
+    """Status and progress counters of a batch job"""
+    
+    job = get_batch_job(job_id)
+    if not job:
+        return jsonify({'error': 'Batch job not found'}), 404
+    return jsonify({'job': job}), 200
+
 @app.route('/api/admin/trigger-parking-reminders', methods=['POST'])
 @admin_required
 def trigger_parking_reminders():